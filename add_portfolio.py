@@ -1,19 +1,14 @@
-import csv
 import sys
 from datetime import datetime
+from storage import locked, read_csv_rows, write_csv_rows
 
 def read_csv_file(filename):
     """Read CSV file and return rows"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    return rows
+    return read_csv_rows(filename)
 
 def write_csv_file(filename, rows):
-    """Write rows to CSV file"""
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
+    """Write rows to CSV file atomically"""
+    write_csv_rows(filename, rows)
 
 def get_latest_date_column(headers):
     """Find the latest date column in the header row"""
@@ -94,25 +89,27 @@ def main():
     type = sys.argv[3]
     
     try:
-        # Read watchlist.csv
-        watchlist_rows = read_csv_file('watchlist.csv')
+        # Lock both files so a concurrent price update or trade cannot interleave
+        with locked('watchlist.csv', exclusive=True), locked('portfolio.csv', exclusive=True):
+            # Read watchlist.csv
+            watchlist_rows = read_csv_file('watchlist.csv')
         
-        # Add asset to watchlist
-        watchlist_rows = add_asset_to_watchlist(name, id, type, watchlist_rows)
+            # Add asset to watchlist
+            watchlist_rows = add_asset_to_watchlist(name, id, type, watchlist_rows)
         
-        # Write updated watchlist back to file
-        write_csv_file('watchlist.csv', watchlist_rows)
-        print(f"Successfully added {name} to watchlist.csv")
+            # Write updated watchlist back to file
+            write_csv_file('watchlist.csv', watchlist_rows)
+            print(f"Successfully added {name} to watchlist.csv")
         
-        # Read portfolio.csv
-        portfolio_rows = read_csv_file('portfolio.csv')
+            # Read portfolio.csv
+            portfolio_rows = read_csv_file('portfolio.csv')
         
-        # Add asset to portfolio
-        portfolio_rows = add_asset_to_portfolio(name, id, type, portfolio_rows)
+            # Add asset to portfolio
+            portfolio_rows = add_asset_to_portfolio(name, id, type, portfolio_rows)
         
-        # Write updated portfolio back to file
-        write_csv_file('portfolio.csv', portfolio_rows)
-        print(f"Successfully added {name} to portfolio.csv")
+            # Write updated portfolio back to file
+            write_csv_file('portfolio.csv', portfolio_rows)
+            print(f"Successfully added {name} to portfolio.csv")
         
         print(f"Asset added successfully: {name} ({id}, {type})")
         
@@ -0,0 +1,216 @@
+import numpy as np
+from scipy.optimize import minimize
+from optimize_portfolio import optimize_weights, calculate_portfolio_return, calculate_portfolio_risk
+from clustering import hrp_weights
+
+# Allocation methods selectable from optimize_portfolio.py --allocator, PortfolioState.optimize and /optimize?method=
+ALLOCATORS = ['max-sharpe', 'risk-parity', 'min-variance', 'max-diversification', 'hrp']
+
+# Risk parity stops when every relative risk contribution is within this of its budget
+RISK_PARITY_TOLERANCE = 1e-8
+RISK_PARITY_MAX_SWEEPS = 1000
+
+def covariance_from_risks(risks, correlation_matrix):
+    """Covariance matrix from per-asset risks and the correlation matrix (same construction as calculate_portfolio_risk)"""
+    risks = np.asarray(risks, dtype=float)
+    return np.outer(risks, risks) * correlation_matrix
+
+def risk_contributions(weights, covariance):
+    """Each asset's share of portfolio variance, w_i (Sigma w)_i / w'Sigma w"""
+    contributions = weights * (covariance @ weights)
+    total = contributions.sum()
+    return contributions / total if total > 0 else np.zeros_like(contributions)
+
+def _risk_parity_ccd(covariance, budgets, tol, max_sweeps):
+    """Cyclical coordinate descent on min 1/2 y'Sy - sum(b_i log y_i); returns (y, sweeps, converged)"""
+    n = len(budgets)
+    diagonal = np.diag(covariance).copy()
+    y = budgets / np.sqrt(diagonal)
+    sigma_y = covariance @ y
+    for sweep in range(1, max_sweeps + 1):
+        for i in range(n):
+            # Positive root of S_ii y_i^2 + c y_i - b_i = 0, c = (S y)_i without asset i
+            c = sigma_y[i] - diagonal[i] * y[i]
+            new = (-c + np.sqrt(c * c + 4 * diagonal[i] * budgets[i])) / (2 * diagonal[i])
+            # Rows of a symmetric matrix are contiguous, unlike its columns
+            sigma_y += covariance[i] * (new - y[i])
+            y[i] = new
+        contributions = y * sigma_y
+        if np.abs(contributions / contributions.sum() - budgets).max() < tol:
+            return y, sweep, True
+    return y, max_sweeps, False
+
+def _risk_parity_newton(covariance, budgets, tol, max_steps):
+    """Damped Newton iteration on S y = b / y (y > 0); returns (y, steps, converged)"""
+    y = budgets / np.sqrt(np.diag(covariance))
+    for step in range(1, max_steps + 1):
+        residual = covariance @ y - budgets / y
+        jacobian = covariance + np.diag(budgets / y ** 2)
+        delta = np.linalg.solve(jacobian, residual)
+        # Shorten the step so y stays positive
+        scale = 1.0
+        shrinking = delta > 0
+        if shrinking.any():
+            scale = min(1.0, 0.9 * (y[shrinking] / delta[shrinking]).min())
+        y = y - scale * delta
+        contributions = y * (covariance @ y)
+        if np.abs(contributions / contributions.sum() - budgets).max() < tol:
+            return y, step, True
+    return y, max_steps, False
+
+def risk_parity_weights(covariance, budgets=None, solver='ccd', tol=RISK_PARITY_TOLERANCE, max_sweeps=RISK_PARITY_MAX_SWEEPS):
+    """
+    Long-only weights whose risk contributions match budgets (equal by default)
+
+    Solves the convex problem min 1/2 y'Sy - sum(b_i log y_i) and normalizes
+    y to sum to 1. The default solver is cyclical coordinate descent: every
+    coordinate update is the positive root of a quadratic and Sy is kept up to
+    date with one row update, so a sweep costs O(n^2) and scales to thousands
+    of assets. solver='newton' takes damped Newton steps instead (O(n^3) per
+    step, few steps), which can be faster for small universes.
+
+    Assets with zero variance (no price data) get weight 0. Returns
+    (weights, info) with sweeps and converged.
+    """
+    covariance = np.asarray(covariance, dtype=float)
+    n = covariance.shape[0]
+    weights = np.zeros(n)
+    active = np.diag(covariance) > 0
+    if not active.any():
+        return weights, {'sweeps': 0, 'converged': False}
+
+    sub = covariance[np.ix_(active, active)]
+    # Scaling leaves the weights unchanged and keeps the iteration well conditioned
+    sub = sub / np.diag(sub).mean()
+    b = np.full(active.sum(), 1.0) if budgets is None else np.asarray(budgets, dtype=float)[active]
+    b = b / b.sum()
+
+    if solver == 'newton':
+        y, sweeps, converged = _risk_parity_newton(sub, b, tol, max_sweeps)
+    else:
+        y, sweeps, converged = _risk_parity_ccd(np.ascontiguousarray(sub), b, tol, max_sweeps)
+    weights[active] = y / y.sum()
+    return weights, {'sweeps': sweeps, 'converged': converged}
+
+def _bounded_start(n, active, max_weight):
+    """Equal weights over the active assets, as a feasible starting point"""
+    start = np.zeros(n)
+    start[active] = 1.0 / active.sum()
+    return np.minimum(start, max_weight)
+
+def min_variance_weights(covariance, max_weight=1.0):
+    """
+    Long-only minimum-variance weights with at most max_weight per asset
+
+    Assets with zero variance (no price data) are left out. Returns the scipy
+    OptimizeResult; result.x holds the weights in decimal form.
+    """
+    covariance = np.asarray(covariance, dtype=float)
+    n = covariance.shape[0]
+    active = np.diag(covariance) > 0
+    scaled = covariance / max(np.diag(covariance)[active].mean(), 1e-12) if active.any() else covariance
+    bounds = [(0.0, max_weight) if active[i] else (0.0, 0.0) for i in range(n)]
+    return minimize(
+        lambda w: (0.5 * w @ scaled @ w, scaled @ w),
+        _bounded_start(n, active, max_weight),
+        jac=True,
+        method='SLSQP',
+        bounds=bounds,
+        constraints=[{'type': 'eq', 'fun': lambda w: w.sum() - 1.0, 'jac': lambda w: np.ones(n)}],
+        tol=1e-12,
+        options={'maxiter': 500}
+    )
+
+def diversification_ratio(weights, risks, covariance):
+    """Weighted average asset risk divided by portfolio risk (1 = no diversification benefit)"""
+    portfolio_risk = np.sqrt(max(weights @ covariance @ weights, 0.0))
+    return float(weights @ risks / portfolio_risk) if portfolio_risk > 0 else 0.0
+
+def max_diversification_weights(risks, correlation_matrix, max_weight=1.0):
+    """
+    Long-only weights maximizing the diversification ratio w'sigma / sqrt(w'Sigma w)
+
+    Assets with zero risk (no price data) are left out. Returns the scipy
+    OptimizeResult; result.x holds the weights in decimal form.
+    """
+    risks = np.asarray(risks, dtype=float)
+    n = len(risks)
+    active = risks > 0
+    scale = risks[active].mean() if active.any() else 1.0
+    sigma = risks / scale
+    covariance = covariance_from_risks(sigma, correlation_matrix)
+
+    def objective(w):
+        cov_w = covariance @ w
+        risk = np.sqrt(max(w @ cov_w, 1e-18))
+        average = w @ sigma
+        return -average / risk, -(sigma / risk - average * cov_w / risk ** 3)
+
+    bounds = [(0.0, max_weight) if active[i] else (0.0, 0.0) for i in range(n)]
+    return minimize(
+        objective,
+        _bounded_start(n, active, max_weight),
+        jac=True,
+        method='SLSQP',
+        bounds=bounds,
+        constraints=[{'type': 'eq', 'fun': lambda w: w.sum() - 1.0, 'jac': lambda w: np.ones(n)}],
+        tol=1e-12,
+        options={'maxiter': 500}
+    )
+
+def allocate(method, returns, risks, correlation_matrix, current_weights=None, risk_free_rate=0.02,
+             min_return=None, max_weight=1.0, solver='ccd'):
+    """
+    Run one of ALLOCATORS on in-memory arrays
+
+    returns and risks are in percent, as in portfolio.csv. current_weights
+    (decimal) is the max-Sharpe starting point; min_return only applies to
+    max-sharpe and max_weight to every method except risk-parity and hrp,
+    whose weights are fixed by the risk budgets and the correlation tree.
+    Returns (weights, info): weights are decimal, info holds method, success, message, return, risk,
+    sharpe (with risk_free_rate in percent like the other reports),
+    diversification_ratio and max_risk_contribution (largest share of
+    portfolio variance from one asset).
+    """
+    if method not in ALLOCATORS:
+        raise ValueError(f"Unknown allocator {method}, choose from {', '.join(ALLOCATORS)}")
+    returns = np.asarray(returns, dtype=float)
+    risks = np.asarray(risks, dtype=float)
+    covariance = covariance_from_risks(risks, correlation_matrix)
+    n = len(risks)
+    info = {'method': method}
+
+    if method == 'max-sharpe':
+        start = np.asarray(current_weights, dtype=float) if current_weights is not None else np.zeros(n)
+        if not start.any():
+            start = np.full(n, 1.0 / max(n, 1))
+        result = optimize_weights(returns, risks, correlation_matrix, start, risk_free_rate, min_return, max_weight)
+        weights, info['success'], info['message'] = result.x, bool(result.success), str(result.message)
+    elif method == 'risk-parity':
+        weights, details = risk_parity_weights(covariance, solver=solver)
+        info.update(details)
+        info['success'] = details['converged']
+        info['message'] = f"{'Converged' if details['converged'] else 'Not converged'} after {details['sweeps']} {solver} iterations"
+    elif method == 'min-variance':
+        result = min_variance_weights(covariance, max_weight)
+        weights, info['success'], info['message'] = result.x, bool(result.success), str(result.message)
+    elif method == 'hrp':
+        weights, details = hrp_weights(covariance, correlation_matrix)
+        info['success'], info['message'] = True, f"Hierarchical risk parity over {len(details['order'])} assets"
+    else:
+        result = max_diversification_weights(risks, correlation_matrix, max_weight)
+        weights, info['success'], info['message'] = result.x, bool(result.success), str(result.message)
+
+    weights = np.clip(weights, 0.0, None)
+    if weights.sum() > 0:
+        weights = weights / weights.sum()
+    portfolio_return = float(calculate_portfolio_return(weights, returns)) if n else 0.0
+    portfolio_risk = float(calculate_portfolio_risk(weights, risks, correlation_matrix)) if n else 0.0
+    info.update({
+        'return': portfolio_return,
+        'risk': portfolio_risk,
+        'sharpe': (portfolio_return - risk_free_rate * 100) / portfolio_risk if portfolio_risk else 0.0,
+        'diversification_ratio': diversification_ratio(weights, risks, covariance),
+        'max_risk_contribution': float(risk_contributions(weights, covariance).max()) if n else 0.0,
+    })
+    return weights, info
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import os
+import numpy as np
+from scipy.optimize import minimize
+from storage import atomic_open
+from portfolio_table import load_portfolio_table
+from returns_matrix import TRADING_DAYS
+from clean_returns import load_returns
+from instrumentation import stage
+
+# Benchmark used when none is given: an asset id or exact name from watchlist.csv
+DEFAULT_BENCHMARK = '399001'
+REPORT_FILE = 'benchmark_stats.csv'
+
+def default_benchmark():
+    """Benchmark from PORTFOLIO_BENCHMARK, or DEFAULT_BENCHMARK (深证成指)"""
+    return os.environ.get('PORTFOLIO_BENCHMARK') or DEFAULT_BENCHMARK
+
+def benchmark_row(data, key):
+    """Row of the benchmark in a load_returns() dict, matched by id first and then by exact name"""
+    for keys in (data['ids'], data['names']):
+        if key in keys:
+            return keys.index(key)
+    raise ValueError(f"Benchmark '{key}' is not a row of percentage_change.csv")
+
+def relative_stats(returns, benchmark, risk_free_rate=0.0):
+    """
+    Benchmark-relative statistics of every row of a returns matrix at once
+
+    returns is assets x dates and benchmark a dates vector (decimal, NaN for
+    missing days); each asset only uses the days where both have a return.
+    risk_free_rate is annual decimal. Returns a dict of per-asset arrays:
+    days, beta, alpha and tracking_error (annual, percent),
+    information_ratio, up_capture and down_capture (percent: 100 moves
+    one-for-one with the benchmark), NaN where undefined.
+    """
+    returns = np.atleast_2d(np.asarray(returns, dtype=float))
+    benchmark = np.asarray(benchmark, dtype=float)
+    valid = ~np.isnan(returns) & ~np.isnan(benchmark)[None, :]
+    days = valid.sum(axis=1)
+    r = np.where(valid, returns, 0.0)
+    b = np.where(valid, benchmark[None, :], 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_r = r.sum(axis=1) / days
+        mean_b = b.sum(axis=1) / days
+        dr = np.where(valid, r - mean_r[:, None], 0.0)
+        db = np.where(valid, b - mean_b[:, None], 0.0)
+        covariance = (dr * db).sum(axis=1) / (days - 1)
+        variance_b = (db * db).sum(axis=1) / (days - 1)
+        beta = covariance / variance_b
+        tracking_error = np.sqrt(((dr - db) ** 2).sum(axis=1) / (days - 1) * TRADING_DAYS)
+
+        daily_rf = risk_free_rate / TRADING_DAYS
+        alpha = (mean_r - daily_rf - beta * (mean_b - daily_rf)) * TRADING_DAYS
+        information_ratio = (mean_r - mean_b) * TRADING_DAYS / tracking_error
+
+        up = valid & (benchmark[None, :] > 0)
+        down = valid & (benchmark[None, :] < 0)
+        up_capture = (np.where(up, r, 0.0).sum(axis=1) / up.sum(axis=1)) / (np.where(up, b, 0.0).sum(axis=1) / up.sum(axis=1))
+        down_capture = (np.where(down, r, 0.0).sum(axis=1) / down.sum(axis=1)) / (np.where(down, b, 0.0).sum(axis=1) / down.sum(axis=1))
+
+    undefined = days < 2
+    stats = {
+        'days': days,
+        'beta': beta,
+        'alpha': alpha * 100,
+        'tracking_error': tracking_error * 100,
+        'information_ratio': information_ratio,
+        'up_capture': up_capture * 100,
+        'down_capture': down_capture * 100,
+    }
+    for key, value in stats.items():
+        if key != 'days':
+            value[undefined | ~np.isfinite(value)] = np.nan
+    return stats
+
+def portfolio_returns(returns, weights):
+    """Daily returns of a fixed-weight portfolio (missing asset returns count as 0, NaN on days no held asset has data)"""
+    weights = np.asarray(weights, dtype=float)
+    held = weights != 0
+    combined = np.where(np.isnan(returns), 0.0, returns).T @ weights
+    combined[np.isnan(returns[held]).all(axis=0)] = np.nan
+    return combined
+
+def holding_weights(table, ids):
+    """Weights of the current holdings (total_value) aligned with ids, zeros when nothing is held"""
+    values = np.zeros(len(ids))
+    for i, asset_id in enumerate(ids):
+        row = table.row_of(asset_id)
+        if row is not None:
+            values[i] = np.nan_to_num(table['total_value'][row])
+    total = values.sum()
+    return values / total if total > 0 else values
+
+def tracking_covariance(returns, benchmark):
+    """
+    (Sigma, c, benchmark variance) of daily returns, for tracking error (w'Sigma w - 2w'c + var b)
+
+    Missing days count as 0 after demeaning, as in correlation_matrix.
+    """
+    filled = np.where(np.isnan(returns), 0.0, returns)
+    b = np.where(np.isnan(benchmark), 0.0, benchmark)
+    filled = filled - filled.mean(axis=1, keepdims=True)
+    b = b - b.mean()
+    n = max(len(b) - 1, 1)
+    return filled @ filled.T / n, filled @ b / n, b @ b / n
+
+def min_tracking_error_weights(covariance, cross, max_weight=1.0, exclude=None, annual_returns=None, min_return=None):
+    """
+    Long-only weights minimizing tracking error against the benchmark
+
+    Minimizes w'Sigma w - 2w'c (the benchmark variance is constant) with
+    weights summing to 1 and at most max_weight each. Assets in exclude (e.g.
+    the benchmark itself when it is a holding) and assets with no variance
+    get 0. min_return (percent) applies to annual_returns (percent).
+    Returns the scipy OptimizeResult; result.x holds the weights in decimal form.
+    """
+    covariance = np.asarray(covariance, dtype=float)
+    n = covariance.shape[0]
+    active = np.diag(covariance) > 0
+    if exclude is not None:
+        active[list(exclude)] = False
+    scale = max(np.diag(covariance)[active].mean(), 1e-12) if active.any() else 1.0
+    sigma, c = covariance / scale, np.asarray(cross, dtype=float) / scale
+
+    constraints = [{'type': 'eq', 'fun': lambda w: w.sum() - 1.0, 'jac': lambda w: np.ones(n)}]
+    if min_return is not None and annual_returns is not None:
+        annual_returns = np.asarray(annual_returns, dtype=float)
+        constraints.append({'type': 'ineq', 'fun': lambda w: w @ annual_returns - min_return,
+                            'jac': lambda w: annual_returns})
+    start = np.zeros(n)
+    if active.any():
+        start[active] = 1.0 / active.sum()
+    return minimize(
+        lambda w: (w @ sigma @ w - 2 * w @ c, 2 * (sigma @ w - c)),
+        np.minimum(start, max_weight),
+        jac=True,
+        method='SLSQP',
+        bounds=[(0.0, max_weight) if active[i] else (0.0, 0.0) for i in range(n)],
+        constraints=constraints,
+        tol=1e-12,
+        options={'maxiter': 500}
+    )
+
+def tracking_weights(benchmark=None, min_return=None, max_weight=1.0, portfolio_file='portfolio.csv',
+                     percentage_change_file='percentage_change.csv'):
+    """
+    Weights of the portfolio.csv assets that track the benchmark most closely
+
+    Returns:
+    list: Optimized percentage vector (the current percentages if it fails,
+    empty when the input files or the benchmark are missing)
+    """
+    benchmark = benchmark or default_benchmark()
+    table = load_portfolio_table(portfolio_file)
+    data = load_returns(percentage_change_file)
+    if table is None or data is None:
+        print(f"Error: {portfolio_file} and {percentage_change_file} are required")
+        return []
+    percentages = list(np.nan_to_num(table['percentage'])) if not table.missing('percentage') else [0.0] * len(table.ids)
+    row = {asset_id: i for i, asset_id in enumerate(data['ids'])}
+    missing = [name for name, asset_id in zip(table.names, table.ids) if asset_id not in row]
+    if missing:
+        print(f"Error: no return history in {percentage_change_file} for {', '.join(missing)}")
+        return percentages
+
+    try:
+        bench = benchmark_row(data, benchmark)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return []
+    benchmark_returns = data['returns'][bench] / 100
+    returns = data['returns'][[row[asset_id] for asset_id in table.ids]] / 100
+    exclude = [i for i, asset_id in enumerate(table.ids) if asset_id == data['ids'][bench]]
+    annual_returns = None if table.missing('annual_return') else np.nan_to_num(table['annual_return'])
+
+    with stage('min_tracking_error', n_assets=len(table.ids)) as metrics:
+        covariance, cross, variance_b = tracking_covariance(returns, benchmark_returns)
+        result = min_tracking_error_weights(covariance, cross, max_weight, exclude, annual_returns, min_return)
+        metrics.set(success=bool(result.success))
+    if not result.success:
+        print(f"Tracking-error optimization failed: {result.message}")
+        return percentages
+
+    weights = np.clip(result.x, 0.0, None)
+    weights /= weights.sum()
+    before = relative_stats(portfolio_returns(returns, np.array(percentages) / 100), benchmark_returns)
+    after = relative_stats(portfolio_returns(returns, weights), benchmark_returns)
+    print(f"\nTracking {data['names'][bench]} ({data['ids'][bench]}):")
+    print(f"Tracking Error: {before['tracking_error'][0]:.2f}% -> {after['tracking_error'][0]:.2f}%")
+    print(f"Beta: {before['beta'][0]:.3f} -> {after['beta'][0]:.3f}")
+    return [w * 100 for w in weights]
+
+def write_benchmark_report(filename, names, ids, stats):
+    """One row per asset (the portfolio first) with its benchmark-relative statistics"""
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'days', 'beta', 'alpha', 'tracking_error', 'information_ratio',
+                         'up_capture', 'down_capture'])
+        for i, name in enumerate(names):
+            writer.writerow([name, ids[i], int(stats['days'][i]), f"{stats['beta'][i]:.4f}", f"{stats['alpha'][i]:.2f}%",
+                             f"{stats['tracking_error'][i]:.2f}%", f"{stats['information_ratio'][i]:.4f}",
+                             f"{stats['up_capture'][i]:.2f}%", f"{stats['down_capture'][i]:.2f}%"])
+
+def benchmark_main(benchmark=None, risk_free_rate=0.0, start=None, end=None, portfolio_file='portfolio.csv',
+                   percentage_change_file='percentage_change.csv', report_file=REPORT_FILE):
+    """Statistics of the portfolio and every asset in percentage_change.csv relative to the benchmark"""
+    benchmark = benchmark or default_benchmark()
+    data = load_returns(percentage_change_file)
+    table = load_portfolio_table(portfolio_file)
+    if data is None:
+        print(f"Error: {percentage_change_file} is required")
+        return None
+    bench = benchmark_row(data, benchmark)
+
+    dates = np.array(data['dates'])
+    first = np.searchsorted(dates, start) if start else 0
+    last = np.searchsorted(dates, end, side='right') if end else len(dates)
+    returns = data['returns'][:, first:last] / 100
+
+    names, ids = list(data['names']), list(data['ids'])
+    if table is not None and not table.missing('total_value'):
+        weights = holding_weights(table, data['ids'])
+        if weights.any():
+            returns = np.vstack([portfolio_returns(returns, weights)[None, :], returns])
+            names, ids = ['组合'] + names, ['portfolio'] + ids
+            bench += 1
+
+    with stage('relative_stats', n_assets=len(returns), n_dates=returns.shape[1]):
+        stats = relative_stats(returns, returns[bench], risk_free_rate)
+
+    print(f"Benchmark: {names[bench]} ({ids[bench]}), {returns.shape[1]} dates")
+    print(f"{'Asset':<30} {'Beta':>7} {'Alpha':>8} {'TE':>8} {'IR':>7} {'Up':>8} {'Down':>8}")
+    for i, name in enumerate(names):
+        print(f"{name[:30]:<30} {stats['beta'][i]:>7.3f} {stats['alpha'][i]:>7.2f}% {stats['tracking_error'][i]:>7.2f}% "
+              f"{stats['information_ratio'][i]:>7.3f} {stats['up_capture'][i]:>7.1f}% {stats['down_capture'][i]:>7.1f}%")
+    write_benchmark_report(report_file, names, ids, stats)
+    print(f"\nResults written to {report_file}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracking error, beta, alpha, information ratio and capture ratios against a benchmark")
+    parser.add_argument('--benchmark', default=None,
+                        help=f"id or name of a watchlist row (default: PORTFOLIO_BENCHMARK or {DEFAULT_BENCHMARK})")
+    parser.add_argument('--risk-free-rate', type=float, default=0.0, help="annual decimal, used by alpha")
+    parser.add_argument('--start', default=None, help="first date (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="last date (YYYY-MM-DD)")
+    parser.add_argument('--output', default=REPORT_FILE)
+    args = parser.parse_args()
+    try:
+        benchmark_main(args.benchmark, args.risk_free_rate, args.start, args.end, report_file=args.output)
+    except ValueError as e:
+        print(f"Error: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from synthetic_data import generate_dataset
+from instrumentation import peak_rss_mb
+
+# Pipeline stages in execution order; each one reads the files the previous ones wrote
+STAGES = [
+    'generate_percentage_change_csv',
+    'clean_returns_update',
+    'update_portfolio_main',
+    'asset_correlation_analysis',
+    'portfolio_risk_analysis',
+    'optimized_sharpe_ratio',
+]
+
+# clean_returns_update makes the later stages read the cleaned cache, so it only runs when asked for
+DEFAULT_STAGES = [stage for stage in STAGES if stage != 'clean_returns_update']
+
+DEFAULT_SIZES = ['100x1', '500x5']
+RESULTS_DIR = 'benchmark_results'
+
+def _stage_function(stage):
+    """Import and return a zero-argument callable for a stage (run inside the work directory)"""
+    if stage == 'generate_percentage_change_csv':
+        from calculate_percentage_change import generate_percentage_change_csv
+        return lambda: generate_percentage_change_csv('watchlist.csv', 'percentage_change.csv')
+    if stage == 'clean_returns_update':
+        from clean_returns import clean_returns_update
+        return clean_returns_update
+    if stage == 'update_portfolio_main':
+        from update_portfolio import update_portfolio_main
+        return update_portfolio_main
+    if stage in ('asset_correlation_analysis', 'portfolio_risk_analysis'):
+        # portfolio_analysis opens its log file in ./log at import time
+        os.makedirs('log', exist_ok=True)
+        import portfolio_analysis
+        if stage == 'asset_correlation_analysis':
+            return lambda: portfolio_analysis.asset_correlation_analysis('percentage_change.csv', 'asset_correlationship.csv')
+        return lambda: portfolio_analysis.portfolio_risk_analysis('portfolio.csv', 'asset_correlationship.csv')
+    if stage == 'optimized_sharpe_ratio':
+        from optimize_portfolio import optimized_sharpe_ratio
+        return lambda: optimized_sharpe_ratio(risk_free_rate=0.0167, max_weight=0.10)
+    raise ValueError(f"Unknown stage {stage}")
+
+def run_stage(stage, workdir, trace_memory=False):
+    """Run one stage in this process and return its measurements"""
+    os.chdir(workdir)
+    func = _stage_function(stage)
+    rss_before = peak_rss_mb()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+
+    output = io.StringIO()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(output):
+        func()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    peak = peak_rss_mb()
+    # stage_rss_mb is the peak growth during the stage itself, excluding the interpreter and imports
+    result = {'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4), 'peak_rss_mb': peak, 'rss_before_mb': rss_before,
+              'stage_rss_mb': round(peak - rss_before, 2) if peak is not None else None}
+    if trace_memory:
+        result['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    if 'Error' in output.getvalue():
+        result['warnings'] = [line for line in output.getvalue().splitlines() if 'Error' in line][:5]
+    return result
+
+def _run_stage_subprocess(stage, workdir, trace_memory, timeout):
+    """Run a stage in a fresh interpreter so peak RSS is per stage"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-stage', stage, workdir]
+    if trace_memory:
+        cmd.append('--tracemalloc')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                     os.environ.get('PYTHONPATH')])))
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
+    except subprocess.TimeoutExpired:
+        return {'status': 'timeout', 'timeout_s': timeout}
+    if proc.returncode != 0 or not proc.stdout.strip():
+        return {'status': 'failed', 'stderr': proc.stderr.strip().splitlines()[-5:]}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['status'] = 'ok'
+    return result
+
+def _git_commit():
+    """Short hash of the checked-out commit, if available"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def parse_size(size):
+    """'1000x5' -> (1000 assets, 5.0 years)"""
+    assets, years = size.lower().split('x')
+    return int(assets), float(years)
+
+def run_benchmarks(sizes, stages, seed=0, trace_memory=False, timeout=None, data_dir=None):
+    """Generate data for each size and time every stage; returns the result document"""
+    results = []
+    for size in sizes:
+        n_assets, years = parse_size(size)
+        workdir = tempfile.mkdtemp(prefix=f'bench_{size}_')
+        try:
+            if data_dir:
+                cached = os.path.join(data_dir, f'{size}_seed{seed}')
+                if not os.path.exists(os.path.join(cached, 'portfolio.csv')):
+                    generate_dataset(cached, n_assets, years, seed)
+                for name in ('watchlist.csv', 'portfolio.csv'):
+                    shutil.copy(os.path.join(cached, name), workdir)
+            else:
+                generate_dataset(workdir, n_assets, years, seed)
+            with open(os.path.join(workdir, 'watchlist.csv'), encoding='utf-8') as f:
+                n_dates = len(f.readline().split(',')) - 3
+
+            for stage in stages:
+                measurement = _run_stage_subprocess(stage, workdir, trace_memory, timeout)
+                entry = {'size': size, 'assets': n_assets, 'years': years, 'dates': n_dates, 'stage': stage}
+                entry.update(measurement)
+                results.append(entry)
+                wall = entry.get('wall_s')
+                print(f"{size:>10} {stage:<32} {entry['status']:<8}"
+                      + (f" {wall:>10.3f}s {entry.get('peak_rss_mb') or 0:>9.1f}MB"
+                         f" (+{entry.get('stage_rss_mb') or 0:.1f}MB)" if wall is not None else ''))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'tracemalloc': trace_memory,
+        'results': results,
+    }
+
+def compare_results(old, new):
+    """Print wall time and peak memory ratios (new/old) for matching size/stage pairs"""
+    previous = {(r['size'], r['stage']): r for r in old['results']}
+    print(f"\nComparison against {old.get('commit')} ({old.get('timestamp')}):")
+    if old.get('tracemalloc') != new.get('tracemalloc'):
+        print("Warning: only one of the runs used --tracemalloc, wall times are not comparable")
+    print(f"{'size':>10} {'stage':<32} {'old s':>10} {'new s':>10} {'ratio':>7} {'mem ratio':>9}")
+    for r in new['results']:
+        o = previous.get((r['size'], r['stage']))
+        if not o or o.get('status') != 'ok' or r.get('status') != 'ok':
+            continue
+        ratio = r['wall_s'] / o['wall_s'] if o['wall_s'] else float('inf')
+        mem = (r['peak_rss_mb'] / o['peak_rss_mb']) if o.get('peak_rss_mb') and r.get('peak_rss_mb') else float('nan')
+        print(f"{r['size']:>10} {r['stage']:<32} {o['wall_s']:>10.3f} {r['wall_s']:>10.3f} {ratio:>7.2f} {mem:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic data")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="ASSETSxYEARS, e.g. 100x1 1000x5 10000x20")
+    parser.add_argument('--stages', nargs='+', default=DEFAULT_STAGES, choices=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help="also record Python allocation peaks (slower)")
+    parser.add_argument('--timeout', type=float, default=None, help="seconds allowed per stage")
+    parser.add_argument('--data-dir', default=None, help="cache generated datasets here between runs")
+    parser.add_argument('--output', default=None, help="result JSON file (default benchmark_results/<time>_<commit>.json)")
+    parser.add_argument('--compare', default=None, help="previous result JSON to compare against")
+    parser.add_argument('--run-stage', nargs=2, metavar=('STAGE', 'WORKDIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage[0], args.run_stage[1], args.tracemalloc)))
+        return
+
+    document = run_benchmarks(args.sizes, args.stages, args.seed, args.tracemalloc, args.timeout, args.data_dir)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}_{document['commit'] or 'nocommit'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(json.load(f), document)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import ast
+import hashlib
+import json
+import os
+from storage import atomic_open
+from instrumentation import stage
+
+# Hashes of every stage's inputs and outputs from the last run of main.py
+STATE_FILE = 'build_state.json'
+
+HASH_CHUNK = 1 << 20
+
+def file_hash(path):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_signature(path, previous=None):
+    """
+    {'mtime_ns', 'size', 'hash'} of a file, or None if it does not exist
+
+    When mtime and size match the previous signature its hash is reused
+    without reading the file, so unchanged inputs cost one stat() each.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if previous and previous.get('mtime_ns') == st.st_mtime_ns and previous.get('size') == st.st_size:
+        return dict(previous)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': file_hash(path)}
+
+def module_files(module):
+    """
+    Source files of a project module and every project module it imports, directly or indirectly
+
+    Imports anywhere in a file count, including ones inside functions.
+    Only modules next to the given one are followed, not the standard
+    library or installed packages.
+    """
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    pending, files = [os.path.abspath(module.__file__)], set()
+    while pending:
+        path = pending.pop()
+        if path in files:
+            continue
+        files.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(directory, name.split('.')[0] + '.py')
+                if os.path.exists(candidate):
+                    pending.append(candidate)
+    return sorted(files)
+
+class BuildGraph:
+    """
+    Run pipeline stages only when their inputs, outputs or parameters changed
+
+    Each stage declares the files it reads and writes (a file may be both,
+    e.g. portfolio.csv). A stage is skipped when every file still has the
+    content hash recorded after its last run and the parameters are the
+    same; a stage whose rerun leaves its outputs unchanged therefore does
+    not make the stages after it stale.
+    """
+
+    def __init__(self, state_file=STATE_FILE, force=False):
+        self.state_file = state_file
+        self.force = force
+        self.ran, self.skipped = [], []
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def stale_reason(self, name, inputs, outputs, params):
+        """Why a stage has to run, or None if it is up to date"""
+        record = self.state.get(name)
+        if self.force:
+            return 'forced'
+        if record is None:
+            return 'no previous run'
+        if record.get('params') != params:
+            return 'parameters changed'
+        files = record.get('files', {})
+        for path in outputs:
+            if not os.path.exists(path):
+                return f"{path} missing"
+        for path in list(inputs) + list(outputs):
+            previous = files.get(path)
+            current = file_signature(path, previous)
+            if (current or {}).get('hash') != (previous or {}).get('hash'):
+                return f"{path} changed"
+        return None
+
+    def run(self, name, func, inputs=(), outputs=(), params=None):
+        """Call func() if the stage is stale and record the hashes of its files; returns True if it ran"""
+        params = params or {}
+        reason = self.stale_reason(name, inputs, outputs, params)
+        if reason is None:
+            print(f"Skipped {name}: inputs unchanged")
+            self.skipped.append(name)
+            with stage(name, skipped=True):
+                pass
+            return False
+
+        print(f"Running {name}: {reason}")
+        previous = self.state.get(name, {}).get('files', {})
+        # Pure inputs are recorded as they were before the stage read them, so
+        # a concurrent change during the run still makes the next run stale
+        before = {path: file_signature(path, previous.get(path)) for path in inputs if path not in outputs}
+        with stage(name, skipped=False):
+            func()
+        self.ran.append(name)
+
+        if not all(os.path.exists(path) for path in outputs):
+            # The stage reported an error instead of writing its outputs; try again next time
+            self.state.pop(name, None)
+        else:
+            files = dict(before)
+            files.update({path: file_signature(path, previous.get(path)) for path in outputs})
+            self.state[name] = {'params': params, 'files': files}
+        self.save()
+        return True
+
+    def save(self):
+        with atomic_open(self.state_file, 'w', backup=False) as f:
+            json.dump(self.state, f, indent=2, ensure_ascii=False)
+
+    def report(self):
+        print(f"\nStages run: {', '.join(self.ran) or 'none'}")
+        print(f"Stages skipped (unchanged): {', '.join(self.skipped) or 'none'}")
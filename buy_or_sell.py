@@ -1,76 +1,34 @@
-import csv
 import sys
 import os
 from datetime import datetime
+import numpy as np
+from storage import locked, read_csv_rows
+from portfolio_table import load_portfolio_table, save_portfolio_table
 
-def read_portfolio(filename):
-    """Read portfolio CSV file and return rows"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    return rows
-
-def write_portfolio(filename, rows):
-    """Write rows to portfolio CSV file"""
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
-
-def update_holdings(rows, asset_id, quantity, price, operation):
-    """Update holdings, holding_price and holding_earnings for an asset"""
-    if not rows:
-        return False
-    
-    # Find column indices
-    header = rows[0]
-    id_index = -1
-    name_index = -1
-    holdings_index = -1
-    holding_price_index = -1
-    holding_earnings_index = -1
-    
-    for i, col_name in enumerate(header):
-        # Handle BOM in column names
-        if col_name.startswith('\ufeff'):
-            col_name = col_name[1:]
-        if col_name == 'id':
-            id_index = i
-        elif col_name == 'name':
-            name_index = i
-        elif col_name == 'holdings':
-            holdings_index = i
-        elif col_name == 'holding_price':
-            holding_price_index = i
-        elif col_name == 'holding_earnings':
-            holding_earnings_index = i
-    
+def update_holdings(table, asset_id, quantity, price, operation, log=None):
+    """
+    Update holdings, holding_price and holding_earnings for an asset
+    
+    The trade is recorded with log (default log_transaction), called with the
+    log_transaction arguments.
+    """
+    log = log or log_transaction
     # Check if required columns exist
-    if (id_index == -1 or holdings_index == -1 or 
-        holding_price_index == -1 or holding_earnings_index == -1 or name_index == -1):
-        print(f"Error: Required columns not found in portfolio.csv")
-        print(f"  id_index: {id_index}")
-        print(f"  name_index: {name_index}")
-        print(f"  holdings_index: {holdings_index}")
-        print(f"  holding_price_index: {holding_price_index}")
-        print(f"  holding_earnings_index: {holding_earnings_index}")
+    missing = table.missing('id', 'name', 'holdings', 'holding_price', 'holding_earnings')
+    if missing:
+        print(f"Error: Required columns not found in portfolio.csv: {', '.join(missing)}")
         return False
     
     # Find the asset row
-    asset_row_index = -1
-    for i in range(1, len(rows)):
-        if rows[i][id_index] == asset_id:
-            asset_row_index = i
-            break
-    
-    if asset_row_index == -1:
+    i = table.row_of(asset_id)
+    if i is None:
         print(f"Error: Asset with ID {asset_id} not found in portfolio.csv")
         return False
     
-    # Get current values
-    row = rows[asset_row_index]
-    asset_name = row[name_index]
-    current_holdings = float(row[holdings_index]) if row[holdings_index] else 0
-    current_holding_price = float(row[holding_price_index]) if row[holding_price_index] else 0
+    # Get current values (empty cells count as 0)
+    asset_name = table.names[i]
+    current_holdings = np.nan_to_num(table['holdings'][i])
+    current_holding_price = np.nan_to_num(table['holding_price'][i])
     
     # Convert input values
     quantity = float(quantity)
@@ -91,11 +49,12 @@ def update_holdings(rows, asset_id, quantity, price, operation):
             new_holding_price = 0
         
         # Update the row
-        rows[asset_row_index][holdings_index] = str(new_holdings)
-        rows[asset_row_index][holding_price_index] = f"{new_holding_price:.2f}"
+        table.set('holdings', i, new_holdings)
+        # Stored to the cent, and earnings below use the stored value
+        table.set('holding_price', i, round(new_holding_price, 2))
         
         # Log the buy transaction
-        log_transaction(operation, asset_name, asset_id, quantity, price, total_price)
+        log(operation, asset_name, asset_id, quantity, price, total_price)
         
     elif operation.lower() == 'sell':
         # Calculate new holdings
@@ -110,33 +69,25 @@ def update_holdings(rows, asset_id, quantity, price, operation):
         profit_loss = (price - current_holding_price) * quantity
         
         # Update the row (holding_price remains the same for sells)
-        rows[asset_row_index][holdings_index] = str(new_holdings)
+        table.set('holdings', i, new_holdings)
         
         # If all holdings are sold, reset holding_price to 0
         if new_holdings == 0:
-            rows[asset_row_index][holding_price_index] = '0'
+            table.set_text('holding_price', [i], ['0'])
         
         # Log the sell transaction
-        log_transaction(operation, asset_name, asset_id, quantity, price, total_price, current_holding_price, profit_loss)
+        log(operation, asset_name, asset_id, quantity, price, total_price, current_holding_price, profit_loss)
     
     # Recalculate holding_earnings = (last_price - holding_price) * holdings
-    # We need to find the last_price column
-    last_price_index = -1
-    for i, col_name in enumerate(header):
-        if col_name == 'last_price':
-            last_price_index = i
-            break
-    
-    if last_price_index != -1:
-        last_price = float(rows[asset_row_index][last_price_index]) if rows[asset_row_index][last_price_index] else 0
-        holding_price = float(rows[asset_row_index][holding_price_index]) if rows[asset_row_index][holding_price_index] else 0
-        holdings = float(rows[asset_row_index][holdings_index]) if rows[asset_row_index][holdings_index] else 0
-        
+    # (0 if the last_price column is missing)
+    if 'last_price' in table:
+        last_price = np.nan_to_num(table['last_price'][i])
+        holding_price = np.nan_to_num(table['holding_price'][i])
+        holdings = np.nan_to_num(table['holdings'][i])
         holding_earnings = (last_price - holding_price) * holdings
-        rows[asset_row_index][holding_earnings_index] = f"{holding_earnings:.4f}"
+        table.set_text('holding_earnings', [i], [f"{holding_earnings:.4f}"])
     else:
-        # If last_price column not found, set holding_earnings to 0
-        rows[asset_row_index][holding_earnings_index] = '0'
+        table.set_text('holding_earnings', [i], ['0'])
     
     return True
 
@@ -165,10 +116,63 @@ def log_transaction(operation, asset_name, asset_id, quantity, price, total_pric
     
     print(f"Transaction logged: {operation} {quantity} of {asset_name} ({asset_id}) at {price}")
 
+def read_batch_file(filename):
+    """Read (operation, asset_id, quantity, price) trades from a batch CSV file such as rebalance.py writes"""
+    rows = read_csv_rows(filename)
+    header = [col.lstrip('\ufeff') for col in rows[0]] if rows else []
+    columns = ['operation', 'id', 'quantity', 'price']
+    missing = [col for col in columns if col not in header]
+    if missing:
+        raise ValueError(f"Required columns not found in {filename}: {', '.join(missing)}")
+    indices = [header.index(col) for col in columns]
+    return [tuple(row[i] for i in indices) for row in rows[1:] if any(cell.strip() for cell in row)]
+
+def apply_batch(filename, portfolio_filename='portfolio.csv'):
+    """
+    Apply every trade in a batch file to the portfolio, all or nothing
+    
+    Trades are applied in file order under one lock. If any trade fails the
+    portfolio file is left unchanged and nothing is logged.
+    """
+    trades = read_batch_file(filename)
+    with locked(portfolio_filename, exclusive=True):
+        table = load_portfolio_table(portfolio_filename)
+        if table is None:
+            print(f"Error: No data found in {portfolio_filename}")
+            return False
+        
+        # Log entries are written only once the whole batch is saved
+        pending = []
+        for n, (operation, asset_id, quantity, price) in enumerate(trades, start=1):
+            if operation.lower() not in ['buy', 'sell']:
+                print(f"Error: Operation must be either 'buy' or 'sell' (line {n + 1}: {operation})")
+                return False
+            if not update_holdings(table, asset_id, quantity, price, operation, log=lambda *args: pending.append(args)):
+                print(f"Error: Batch aborted at line {n + 1}, {portfolio_filename} was not changed")
+                return False
+        
+        save_portfolio_table(portfolio_filename, table)
+        for args in pending:
+            log_transaction(*args)
+    
+    print(f"Successfully applied {len(trades)} trades from {filename}")
+    return True
+
 def main():
+    # Batch mode: python buy_or_sell.py --batch trades.csv
+    if len(sys.argv) == 3 and sys.argv[1] == '--batch':
+        try:
+            if not apply_batch(sys.argv[2]):
+                sys.exit(1)
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
+    
     # Check if correct number of arguments provided
     if len(sys.argv) != 5:
         print("Usage: python buy_or_sell.py <buy/sell> <asset_id> <quantity> <price>")
+        print("       python buy_or_sell.py --batch <trades.csv>")
         print("Example: python buy_or_sell.py buy 000001 100 10.5")
         sys.exit(1)
     
@@ -184,16 +188,22 @@ def main():
         sys.exit(1)
     
     try:
-        # Read portfolio.csv
-        portfolio_rows = read_portfolio('portfolio.csv')
-        
-        # Update holdings
-        if update_holdings(portfolio_rows, asset_id, quantity, price, operation):
-            # Write updated portfolio back to file
-            write_portfolio('portfolio.csv', portfolio_rows)
-            print(f"Successfully updated portfolio for {operation} operation on asset {asset_id}")
-        else:
-            sys.exit(1)
+        # Hold the exclusive lock from read to write so a concurrent update run
+        # cannot overwrite this trade with a stale copy of portfolio.csv
+        with locked('portfolio.csv', exclusive=True):
+            # Read portfolio.csv
+            table = load_portfolio_table('portfolio.csv')
+            if table is None:
+                print("Error: No data found in portfolio.csv")
+                sys.exit(1)
+            
+            # Update holdings
+            if update_holdings(table, asset_id, quantity, price, operation):
+                # Write updated portfolio back to file
+                save_portfolio_table('portfolio.csv', table)
+                print(f"Successfully updated portfolio for {operation} operation on asset {asset_id}")
+            else:
+                sys.exit(1)
         
     except Exception as e:
         print(f"Error: {e}")
@@ -1,12 +1,15 @@
-import csv
+import sys
 from datetime import datetime
+import numpy as np
+from storage import read_csv_rows, iter_csv_rows, line_count, write_csv_rows
+from price_series import PRICE_SERIES, default_series, adjusted_file_for, price_matrix
+from returns_matrix import parse_price_rows
+from sidecar import write_returns_sidecar
+from trading_calendar import ALIGN_MODES, load_calendar, aligned_returns
 
 def read_watchlist(filename):
     """Read watchlist CSV file"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    return rows
+    return read_csv_rows(filename)
 
 def calculate_percentage_change(prices):
     """Calculate percentage change for each day"""
@@ -32,18 +35,97 @@ def calculate_percentage_change(prices):
     
     return changes
 
-def generate_percentage_change_csv(input_file, output_file):
-    """Generate percentage change CSV file"""
-    # Read the watchlist file
-    rows = read_watchlist(input_file)
+def adjusted_rows(rows, input_file):
+    """Watchlist rows with the prices replaced by the adjusted series (empty cells stay empty)"""
+    _, _, _, _, prices = price_matrix(rows, 'adjusted', adjusted_file_for(input_file))
+    return [rows[0]] + [row[:3] + ['' if np.isnan(price) else price for price in prices[i]]
+                        for i, row in enumerate(rows[1:])]
+
+def aligned_rows(rows, input_file, series, align, limit=None):
+    """
+    percentage_change.csv rows on the trading calendar, with gaps handled by align (see trading_calendar.py)
+
+    The calendar and fill index come from the watchlist's unit prices (they
+    decide which dates an asset traded on) and are applied to the chosen series.
+    """
+    names, ids, types, dates, unit_prices = parse_price_rows(rows)
+    prices = unit_prices
+    if series == 'adjusted':
+        _, _, _, _, prices = price_matrix(rows, series, adjusted_file_for(input_file))
+    columns, index = load_calendar(input_file, unit_prices, types, limit=limit)
+    returns = aligned_returns(prices, columns, index, align) * 100
+
+    header = rows[0][:3] + [f"chg_{dates[j]}" for j in columns[1:]]
+    output_rows = [header]
+    for i in range(len(names)):
+        output_rows.append([names[i], ids[i], types[i]] +
+                           ['' if np.isnan(change) else f"{change:.4f}%" for change in returns[i]])
+    return output_rows
+
+def generate_percentage_change_csv(input_file, output_file, series='unit', align='none', limit=None):
+    """
+    Generate percentage change CSV file from the unit or adjusted price series (see price_series.py)
+
+    align='ffill' or 'span' computes the changes on the trading calendar so a
+    missing price no longer loses the return around it; limit caps how many
+    trading days a price may be carried forward.
+    """
+    if align != 'none' or series == 'adjusted':
+        # The calendar and the adjusted series need the whole price matrix
+        rows = read_watchlist(input_file)
+        if not rows:
+            print("No data in watchlist file")
+            return
+        capacity = len(rows) - 1
+        if align != 'none':
+            write_percentage_change(output_file, iter(aligned_rows(rows, input_file, series, align, limit)), capacity)
+            print(f"Percentage change data ({align} aligned) written to {output_file}")
+            return
+        rows = iter(adjusted_rows(rows, input_file))
+    else:
+        # Unit prices stream from the watchlist one asset row at a time
+        capacity = max(line_count(input_file) - 1, 0)
+        rows = iter_csv_rows(input_file)
     
-    if not rows:
+    # Extract header
+    header = next(rows, None)
+    if header is None:
         print("No data in watchlist file")
         return
     
-    # Extract header
-    header = rows[0]
+    # Write to output file (overwrites if exists) while the rows are read
+    write_percentage_change(output_file, percentage_change_rows(header, rows), capacity)
     
+    print(f"Percentage change data written to {output_file}")
+
+def write_percentage_change(output_file, rows, capacity):
+    """
+    Write percentage_change.csv from a stream of output rows, then its binary sidecar (see sidecar.py)
+
+    The sidecar values are parsed from the written cells, so they are exactly
+    what a CSV reader gets. capacity bounds the number of data rows.
+    """
+    header = next(rows)
+    width = max(len(header) - 3, 0)
+    returns = np.full((capacity, width), np.nan)
+    names, ids, types = [], [], []
+    
+    def collect():
+        yield header
+        for i, row in enumerate(rows):
+            names.append(row[0])
+            ids.append(row[1])
+            types.append(row[2])
+            # Cells are '' or 'x.xxxx%' as written by calculate_percentage_change
+            cells = row[3:3 + width]
+            returns[i, :len(cells)] = [float(cell[:-1]) if cell else np.nan for cell in cells]
+            yield row
+    
+    write_csv_rows(output_file, collect())
+    write_returns_sidecar(output_file, header, names, ids, types, returns[:len(names)])
+
+def percentage_change_rows(header, rows):
+    """Yield the percentage_change.csv header and then one output row per watchlist row"""
     # Extract date columns (skip name, id, type)
     date_columns = header[3:]
     
@@ -53,40 +135,44 @@ def generate_percentage_change_csv(input_file, output_file):
     for i in range(1, len(date_columns)):
         percentage_change_columns.append(f"chg_{date_columns[i]}")
     
-    # Create new header for output file
-    new_header = header[:3] + percentage_change_columns
+    # Header for output file
+    yield header[:3] + percentage_change_columns
     
-    # Process each row
-    output_rows = [new_header]
-    
-    for row in rows[1:]:  # Skip header row
+    for row in rows:
         name, id, type = row[:3]
         prices = row[3:]
         
         # Calculate percentage changes
         percentage_changes = calculate_percentage_change(prices)
         
-        # Create new row with name, id, type and percentage changes
-        new_row = [name, id, type] + percentage_changes
-        output_rows.append(new_row)
-    
-    # Write to output file (overwrites if exists)
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(output_rows)
-    
-    print(f"Percentage change data written to {output_file}")
+        # New row with name, id, type and percentage changes
+        yield [name, id, type] + percentage_changes
 
-def percentage_change_update():
-    """Main function"""
+def percentage_change_update(series=None, align='none'):
+    """Main function; series defaults to PORTFOLIO_PRICE_SERIES"""
     input_file = 'watchlist.csv'
     output_file = 'percentage_change.csv'
+    series = series or default_series()
     
     try:
-        generate_percentage_change_csv(input_file, output_file)
+        generate_percentage_change_csv(input_file, output_file, series, align)
         print("Process completed successfully")
     except Exception as e:
         print(f"Error: {e}")
 
 if __name__ == '__main__':
-    percentage_change_update()
+    # --series adjusted computes the changes from cumulative NAV / forward-adjusted closes
+    series = None
+    if '--series' in sys.argv[1:]:
+        series = sys.argv[sys.argv.index('--series') + 1]
+        if series not in PRICE_SERIES:
+            print(f"Error: --series must be one of {', '.join(PRICE_SERIES)}")
+            sys.exit(1)
+    # --align ffill|span computes the changes on the trading calendar (see trading_calendar.py)
+    align = 'none'
+    if '--align' in sys.argv[1:]:
+        align = sys.argv[sys.argv.index('--align') + 1]
+        if align not in ALIGN_MODES:
+            print(f"Error: --align must be one of {', '.join(ALIGN_MODES)}")
+            sys.exit(1)
+    percentage_change_update(series, align)
@@ -0,0 +1,219 @@
+import argparse
+import csv
+import json
+import os
+import numpy as np
+from storage import atomic_open
+from sidecar import read_returns
+
+# Cleaned returns matrix shared by the downstream stages, and the report of every flagged return
+CLEAN_CACHE_FILE = 'percentage_change_clean.npz'
+EXCEPTIONS_FILE = 'return_exceptions.csv'
+
+# Robust z-score above which a daily return is an outlier
+DEFAULT_THRESHOLD = 5.0
+
+# Trailing window (trading days) for the rolling method, and the observations it needs
+DEFAULT_WINDOW = 63
+MIN_OBSERVATIONS = 20
+
+# MAD is scaled by this to estimate the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+METHODS = ['mad', 'rolling']
+ACTIONS = ['flag', 'winsorize', 'drop']
+
+def mad_scores(returns):
+    """
+    Robust z-scores per asset from the median and MAD of its whole history
+
+    Returns (center, scale, score) as assets x dates arrays. Assets whose MAD
+    is 0 (mostly unchanged prices) fall back to the mean absolute deviation.
+    """
+    with np.errstate(all='ignore'):
+        median = np.nanmedian(returns, axis=1, keepdims=True)
+        deviation = np.abs(returns - median)
+        scale = np.nanmedian(deviation, axis=1, keepdims=True) * MAD_SCALE
+        fallback = np.nanmean(deviation, axis=1, keepdims=True) * np.sqrt(np.pi / 2)
+        scale = np.where(scale > 0, scale, fallback)
+        score = np.where(scale > 0, (returns - median) / scale, np.nan)
+    shape = returns.shape
+    return np.broadcast_to(median, shape), np.broadcast_to(scale, shape), score
+
+def rolling_scores(returns, window=DEFAULT_WINDOW):
+    """
+    z-scores against the mean and standard deviation of the previous window days
+
+    Computed for the whole matrix at once from cumulative sums, so the cost
+    does not depend on the window. Days with fewer than MIN_OBSERVATIONS
+    returns in their window get a NaN score (never flagged).
+    """
+    valid = ~np.isnan(returns)
+    filled = np.where(valid, returns, 0.0)
+    n_assets = returns.shape[0]
+    zeros = np.zeros((n_assets, 1))
+    # Prefix sums with a leading 0 so sums over [t - window, t) are simple differences
+    sums = np.concatenate([zeros, np.cumsum(filled, axis=1)], axis=1)
+    squares = np.concatenate([zeros, np.cumsum(filled ** 2, axis=1)], axis=1)
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+
+    end = np.arange(returns.shape[1])
+    start = np.maximum(end - window, 0)
+    n = counts[:, end] - counts[:, start]
+    with np.errstate(all='ignore'):
+        mean = (sums[:, end] - sums[:, start]) / n
+        variance = ((squares[:, end] - squares[:, start]) - n * mean ** 2) / (n - 1)
+        scale = np.sqrt(np.maximum(variance, 0.0))
+        enough = (n >= MIN_OBSERVATIONS) & (scale > 0)
+        score = np.where(enough, (returns - mean) / scale, np.nan)
+    return mean, scale, score
+
+def clean_returns(returns, method='mad', threshold=DEFAULT_THRESHOLD, action='winsorize',
+                  window=DEFAULT_WINDOW, max_abs=None):
+    """
+    Flag outlier daily returns across the whole assets x dates matrix in one pass
+
+    A return is flagged when its robust z-score exceeds threshold, or when
+    its absolute value exceeds max_abs (same units as returns), which catches
+    bad scrapes regardless of the asset's volatility. action decides what
+    happens to flagged returns: 'flag' keeps them, 'winsorize' clamps them to
+    center +/- threshold * scale (or +/- max_abs), 'drop' makes them missing.
+
+    Returns (cleaned, details) where details holds flagged, center, scale and
+    score arrays.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, choose from {', '.join(METHODS)}")
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action {action}, choose from {', '.join(ACTIONS)}")
+
+    center, scale, score = mad_scores(returns) if method == 'mad' else rolling_scores(returns, window)
+    with np.errstate(invalid='ignore'):
+        flagged = np.abs(score) > threshold
+        if max_abs is not None:
+            flagged |= np.abs(returns) > max_abs
+
+    cleaned = returns.copy()
+    if action == 'winsorize':
+        with np.errstate(invalid='ignore'):
+            low = np.where(np.isnan(score), -np.inf, center - threshold * scale)
+            high = np.where(np.isnan(score), np.inf, center + threshold * scale)
+            if max_abs is not None:
+                low, high = np.maximum(low, -max_abs), np.minimum(high, max_abs)
+            cleaned[flagged] = np.clip(returns, low, high)[flagged]
+    elif action == 'drop':
+        cleaned[flagged] = np.nan
+
+    return cleaned, {'flagged': flagged, 'center': center, 'scale': scale, 'score': score}
+
+def write_exceptions_report(filename, names, ids, dates, returns, cleaned, details, action):
+    """Write one row per flagged return (returns in percent) to the exceptions report"""
+    rows, cols = np.nonzero(details['flagged'])
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'date', 'return', 'center', 'scale', 'score', 'action', 'cleaned'])
+        for i, j in zip(rows, cols):
+            score = details['score'][i, j]
+            writer.writerow([
+                names[i], ids[i], dates[j],
+                f"{returns[i, j]:.4f}%",
+                f"{details['center'][i, j]:.4f}%",
+                f"{details['scale'][i, j]:.4f}%",
+                '' if np.isnan(score) else f"{score:.2f}",
+                action,
+                '' if np.isnan(cleaned[i, j]) else f"{cleaned[i, j]:.4f}%",
+            ])
+    return len(rows)
+
+def _source_signature(filename):
+    """(mtime_ns, size) of the raw returns file the cache was built from"""
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+def save_clean_cache(cache_file, source_file, header, names, ids, types, dates, cleaned, params):
+    """Store the cleaned matrix with the signature of the file it was cleaned from"""
+    with atomic_open(cache_file, 'wb') as f:
+        np.savez(f, returns=cleaned, header=np.array(header, dtype=str), names=np.array(names, dtype=str),
+                 ids=np.array(ids, dtype=str), types=np.array(types, dtype=str), dates=np.array(dates, dtype=str),
+                 source=np.array(_source_signature(source_file), dtype=np.int64),
+                 params=np.array(json.dumps(params)))
+
+def cached_clean_returns(source_file='percentage_change.csv', cache_file=CLEAN_CACHE_FILE):
+    """
+    The cleaned returns for source_file if a cache built from its current contents exists, else None
+
+    Returns a dict with header (first three column names), names, ids,
+    types, dates, returns (assets x dates, percent, NaN for missing) and params.
+    """
+    if not os.path.exists(cache_file) or not os.path.exists(source_file):
+        return None
+    with np.load(cache_file, allow_pickle=False) as data:
+        if data['source'].tolist() != _source_signature(source_file):
+            return None
+        return {
+            'header': data['header'].tolist(),
+            'names': data['names'].tolist(),
+            'ids': data['ids'].tolist(),
+            'types': data['types'].tolist(),
+            'dates': data['dates'].tolist(),
+            'returns': data['returns'],
+            'params': json.loads(str(data['params'])),
+        }
+
+def load_returns(source_file='percentage_change.csv', cache_file=CLEAN_CACHE_FILE):
+    """
+    Returns matrix for the downstream stages: the cleaned cache when it is current, else source_file (via its sidecar, see sidecar.py)
+
+    Same dict as cached_clean_returns() with 'cleaned' telling which one was used.
+    """
+    cached = cached_clean_returns(source_file, cache_file)
+    if cached is not None:
+        cached['cleaned'] = True
+        return cached
+    header, names, ids, types, returns = read_returns(source_file)
+    if not header:
+        return None
+    return {
+        'header': header[:3],
+        'names': names,
+        'ids': ids,
+        'types': types,
+        'dates': [col[4:] if col.startswith('chg_') else col for col in header[3:]],
+        'returns': returns,
+        'params': None,
+        'cleaned': False,
+    }
+
+def clean_returns_update(source_file='percentage_change.csv', cache_file=CLEAN_CACHE_FILE,
+                         exceptions_file=EXCEPTIONS_FILE, method='mad', threshold=DEFAULT_THRESHOLD,
+                         action='winsorize', window=DEFAULT_WINDOW, max_abs=None):
+    """Clean percentage_change.csv once, write the exceptions report and cache the cleaned matrix"""
+    header, names, ids, types, returns = read_returns(source_file)
+    if not header:
+        print(f"No data in {source_file}")
+        return
+    dates = [col[4:] if col.startswith('chg_') else col for col in header[3:]]
+
+    cleaned, details = clean_returns(returns, method, threshold, action, window, max_abs)
+    flagged = write_exceptions_report(exceptions_file, names, ids, dates, returns, cleaned, details, action)
+    params = {'method': method, 'threshold': threshold, 'action': action, 'window': window, 'max_abs': max_abs}
+    save_clean_cache(cache_file, source_file, header[:3], names, ids, types, dates, cleaned, params)
+
+    assets = int(details['flagged'].any(axis=1).sum())
+    print(f"Flagged {flagged} outlier returns in {assets} assets ({method}, threshold {threshold}, {action})")
+    print(f"Exceptions written to {exceptions_file}, cleaned returns cached in {cache_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag and winsorize outlier daily returns in percentage_change.csv")
+    parser.add_argument('--method', choices=METHODS, default='mad',
+                        help="mad: median/MAD of each asset's history; rolling: trailing-window z-score")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--action', choices=ACTIONS, default='winsorize')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    parser.add_argument('--max-abs', type=float, default=None, help="absolute daily limit in percent, e.g. 20")
+    args = parser.parse_args()
+    clean_returns_update(method=args.method, threshold=args.threshold, action=args.action,
+                         window=args.window, max_abs=args.max_abs)
+
+if __name__ == '__main__':
+    main()
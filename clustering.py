@@ -0,0 +1,161 @@
+import argparse
+import csv
+import numpy as np
+from scipy.cluster.hierarchy import linkage, fcluster, leaves_list
+from scipy.spatial.distance import squareform
+from storage import atomic_open
+from portfolio_table import load_portfolio_table
+
+# Assets whose daily returns correlate at least this much with every other
+# member of their group are treated as near-duplicates (e.g. A/C share classes)
+REDUNDANCY_THRESHOLD = 0.95
+
+REPORT_FILE = 'asset_clusters.csv'
+
+def correlation_distance(correlation):
+    """Distance sqrt((1 - rho) / 2): 0 for perfectly correlated assets, 1 for perfectly anti-correlated"""
+    distance = np.sqrt(np.clip((1.0 - np.asarray(correlation, dtype=float)) / 2.0, 0.0, 1.0))
+    np.fill_diagonal(distance, 0.0)
+    return distance
+
+def cluster_tree(correlation, method='single'):
+    """scipy linkage matrix of the assets from their correlation distances"""
+    distance = correlation_distance(correlation)
+    # Average the two triangles so tiny asymmetries from rounding do not matter
+    return linkage(squareform((distance + distance.T) / 2, checks=False), method=method)
+
+def redundant_groups(correlation, threshold=REDUNDANCY_THRESHOLD):
+    """
+    Group label (1..k) per asset; every pair inside a group correlates at least threshold
+
+    Complete linkage cut at the distance of the threshold correlation, so a
+    group never chains together assets that are only indirectly similar.
+    """
+    if len(correlation) < 2:
+        return np.ones(len(correlation), dtype=int)
+    cut = np.sqrt((1.0 - threshold) / 2.0)
+    return fcluster(cluster_tree(correlation, 'complete'), t=cut, criterion='distance')
+
+def representatives(groups, preference):
+    """
+    Index of the representative of each asset's group: the member with the largest preference
+
+    preference is a sequence of sort keys per asset (larger is better), e.g.
+    (holding value, annual return). Returns an array mapping asset -> representative.
+    """
+    chosen = {}
+    for i, group in enumerate(groups):
+        if group not in chosen or preference[i] > preference[chosen[group]]:
+            chosen[group] = i
+    return np.array([chosen[group] for group in groups], dtype=int)
+
+def _cluster_variance(covariance, members):
+    """Variance of the inverse-variance portfolio of a cluster"""
+    sub = covariance[np.ix_(members, members)]
+    inverse = 1.0 / np.diag(sub)
+    weights = inverse / inverse.sum()
+    return weights @ sub @ weights
+
+def hrp_weights(covariance, correlation, method='single'):
+    """
+    Hierarchical Risk Parity weights (Lopez de Prado)
+
+    Orders the assets by the correlation tree (quasi-diagonalization) and
+    splits the budget down recursive bisections in inverse proportion to each
+    half's inverse-variance risk, so no matrix is inverted. Assets with zero
+    variance get 0. Returns (weights, details) with the leaf order.
+    """
+    covariance = np.asarray(covariance, dtype=float)
+    n = covariance.shape[0]
+    weights = np.zeros(n)
+    active = np.nonzero(np.diag(covariance) > 0)[0]
+    if len(active) == 0:
+        return weights, {'order': []}
+    if len(active) == 1:
+        weights[active] = 1.0
+        return weights, {'order': active.tolist()}
+
+    order = active[leaves_list(cluster_tree(np.asarray(correlation)[np.ix_(active, active)], method))]
+    weights[order] = 1.0
+    clusters = [order]
+    while clusters:
+        halves = []
+        for members in clusters:
+            if len(members) < 2:
+                continue
+            left, right = members[:len(members) // 2], members[len(members) // 2:]
+            left_variance = _cluster_variance(covariance, left)
+            right_variance = _cluster_variance(covariance, right)
+            alpha = 1.0 - left_variance / (left_variance + right_variance)
+            weights[left] *= alpha
+            weights[right] *= 1.0 - alpha
+            halves += [left, right]
+        clusters = halves
+    return weights, {'order': order.tolist()}
+
+def representative_universe(names, correlation, threshold=REDUNDANCY_THRESHOLD, table=None):
+    """
+    (groups, representative, keep) for assets named like the rows of a correlation matrix
+
+    Representatives prefer the asset with the largest holding in table
+    (portfolio.csv), then the highest annual return. keep lists the
+    representatives' positions in matrix order.
+    """
+    preference = [(0.0, 0.0)] * len(names)
+    if table is not None:
+        value = None if table.missing('total_value') else np.nan_to_num(table['total_value'])
+        annual = None if table.missing('annual_return') else np.nan_to_num(table['annual_return'])
+        row = {name: i for i, name in enumerate(table.names)}
+        preference = [(value[row[name]] if value is not None and name in row else 0.0,
+                       annual[row[name]] if annual is not None and name in row else 0.0) for name in names]
+    groups = redundant_groups(correlation, threshold)
+    representative = representatives(groups, preference)
+    keep = sorted(set(representative.tolist()))
+    return groups, representative, keep
+
+def write_cluster_report(filename, names, ids, groups, representative, correlation):
+    """One row per asset with its group, whether it represents the group and its correlation with the representative"""
+    sizes = np.bincount(groups)
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'group', 'group_size', 'representative', 'representative_name',
+                         'correlation_with_representative'])
+        for i in np.argsort(groups, kind='stable'):
+            r = representative[i]
+            writer.writerow([names[i], ids[i], groups[i], sizes[groups[i]], 'yes' if r == i else 'no', names[r],
+                             f"{correlation[i, r]:.4f}"])
+
+def clustering_main(threshold=REDUNDANCY_THRESHOLD, correlation_file='asset_correlationship.csv',
+                    portfolio_file='portfolio.csv', report_file=REPORT_FILE):
+    """Find near-duplicate assets in the correlation matrix and report a representative universe"""
+    from optimize_portfolio import read_correlation_data
+    names, correlation = read_correlation_data(correlation_file)
+    if not names:
+        print(f"Error: No data found in {correlation_file}")
+        return None
+    table = load_portfolio_table(portfolio_file)
+    ids = [table.ids[table.names.index(name)] if table is not None and name in table.names else '' for name in names]
+
+    groups, representative, keep = representative_universe(names, correlation, threshold, table)
+    print(f"{len(names)} assets -> {len(keep)} representatives (correlation >= {threshold})")
+    for group in np.unique(groups):
+        members = np.nonzero(groups == group)[0]
+        if len(members) > 1:
+            r = representative[members[0]]
+            others = ', '.join(names[i] for i in members if i != r)
+            print(f"  {names[r]}: {others}")
+
+    write_cluster_report(report_file, names, ids, groups, representative, correlation)
+    print(f"Groups written to {report_file}")
+    return groups, representative
+
+def main():
+    parser = argparse.ArgumentParser(description="Group near-duplicate assets by the correlation of their returns")
+    parser.add_argument('--threshold', type=float, default=REDUNDANCY_THRESHOLD,
+                        help="minimum pairwise correlation inside a group")
+    parser.add_argument('--output', default=REPORT_FILE)
+    args = parser.parse_args()
+    clustering_main(args.threshold, report_file=args.output)
+
+if __name__ == '__main__':
+    main()
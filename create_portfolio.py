@@ -1,13 +1,10 @@
-import csv
 import sys
 import os
+from storage import locked, read_csv_rows, write_csv_rows
 
 def read_watchlist(filename):
     """Read watchlist CSV file"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    return rows
+    return read_csv_rows(filename)
 
 def create_portfolio_file(input_file, output_file):
     """Create portfolio CSV file with specified columns"""
@@ -35,9 +32,7 @@ def create_portfolio_file(input_file, output_file):
         portfolio_rows = []
     
     # Write to output file (overwrites if exists)
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(portfolio_rows)
+    write_csv_rows(output_file, portfolio_rows)
     
     print(f"Portfolio data written to {output_file}")
 
@@ -50,40 +45,38 @@ def update_portfolio_file(input_file, output_file):
         print("No data in watchlist file")
         return
     
-    # Read the existing portfolio file
-    if os.path.exists(output_file):
-        with open(output_file, 'r', encoding='utf-8') as f:
-            portfolio_reader = csv.reader(f)
-            portfolio_rows = list(portfolio_reader)
-    else:
-        print(f"Error: {output_file} does not exist")
-        return
+    # Hold the portfolio lock across read and write so concurrent trades are not lost
+    with locked(output_file, exclusive=True):
+        # Read the existing portfolio file
+        if os.path.exists(output_file):
+            portfolio_rows = read_csv_rows(output_file)
+        else:
+            print(f"Error: {output_file} does not exist")
+            return
     
-    if not portfolio_rows:
-        print("No data in portfolio file")
-        return
+        if not portfolio_rows:
+            print("No data in portfolio file")
+            return
     
-    # Create a dictionary from watchlist data for easy lookup (using the second column as key)
-    watchlist_dict = {}
-    for row in watchlist_rows[1:]:  # Skip header row
-        if len(row) >= 3:
-            key = row[1]  # Use ID (second column) as key
-            watchlist_dict[key] = row[:3]  # Store first three columns
+        # Create a dictionary from watchlist data for easy lookup (using the second column as key)
+        watchlist_dict = {}
+        for row in watchlist_rows[1:]:  # Skip header row
+            if len(row) >= 3:
+                key = row[1]  # Use ID (second column) as key
+                watchlist_dict[key] = row[:3]  # Store first three columns
     
-    # Update the first three columns of the portfolio file
-    for i in range(1, len(portfolio_rows)):  # Skip header row
-        if len(portfolio_rows[i]) >= 3:
-            key = portfolio_rows[i][1]  # Use ID (second column) as key
-            if key in watchlist_dict:
-                # Update first three columns, keep the rest unchanged
-                portfolio_rows[i][:3] = watchlist_dict[key]
+        # Update the first three columns of the portfolio file
+        for i in range(1, len(portfolio_rows)):  # Skip header row
+            if len(portfolio_rows[i]) >= 3:
+                key = portfolio_rows[i][1]  # Use ID (second column) as key
+                if key in watchlist_dict:
+                    # Update first three columns, keep the rest unchanged
+                    portfolio_rows[i][:3] = watchlist_dict[key]
     
-    # Write updated data back to output file
-    with open(output_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(portfolio_rows)
+        # Write updated data back to output file
+        write_csv_rows(output_file, portfolio_rows)
     
-    print(f"Portfolio data updated in {output_file}")
+        print(f"Portfolio data updated in {output_file}")
 
 def create_portfolio():
     """Main function"""
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import numpy as np
+from storage import atomic_open
+
+# Sufficient statistics of the last correlation run, next to asset_correlationship.csv
+STATS_FILE = 'correlation_stats.npz'
+
+# Incremental updates between full recomputes that check the running sums for drift
+DRIFT_CHECK_INTERVAL = 20
+
+# Largest correlation difference from a full recompute accepted as rounding
+DRIFT_TOLERANCE = 1e-9
+
+def _filled(returns):
+    return np.where(np.isnan(returns), 0.0, returns)
+
+def build_stats(names, ids, dates, returns, window=None):
+    """
+    Sufficient statistics of a returns matrix (assets x dates, NaN for missing) from scratch
+
+    Missing returns count as 0 like in asset_correlation_analysis, so every
+    pair is over the same days; counts (pairwise days where both assets have
+    data) are kept to report coverage. With window only the last window
+    dates are used.
+    """
+    if window:
+        dates, returns = dates[-window:], returns[:, -window:]
+    filled = _filled(returns)
+    valid = (~np.isnan(returns)).astype(np.float64)
+    return {
+        'names': list(names), 'ids': list(ids), 'dates': list(dates), 'window': window or 0,
+        'cross': filled @ filled.T,
+        'sums': filled.sum(axis=1),
+        'counts': (valid @ valid.T).astype(np.int32),
+        'column_sums': filled.sum(axis=0),
+        'column_squares': (filled ** 2).sum(axis=0),
+        'updates': 0,
+    }
+
+def fold_days(stats, columns, sign=1):
+    """Add (sign=1) or remove (sign=-1) days of returns (assets x k, rows in stats order) with a rank-k update"""
+    filled = _filled(columns)
+    valid = (~np.isnan(columns)).astype(np.float64)
+    stats['cross'] += sign * (filled @ filled.T)
+    stats['sums'] += sign * filled.sum(axis=1)
+    stats['counts'] += (sign * (valid @ valid.T)).astype(np.int32)
+
+def add_assets(stats, names, ids, new_rows, existing_rows):
+    """
+    Append assets to the statistics: one new row and column of the cross products each
+
+    new_rows and existing_rows are the returns of the new and existing assets
+    over the dates in stats.
+    """
+    new_filled, old_filled = _filled(new_rows), _filled(existing_rows)
+    new_valid = (~np.isnan(new_rows)).astype(np.float64)
+    old_valid = (~np.isnan(existing_rows)).astype(np.float64)
+    between = new_filled @ old_filled.T
+    stats['cross'] = np.block([[stats['cross'], between.T], [between, new_filled @ new_filled.T]])
+    between = (new_valid @ old_valid.T).astype(np.int32)
+    stats['counts'] = np.block([[stats['counts'], between.T], [between, (new_valid @ new_valid.T).astype(np.int32)]])
+    stats['sums'] = np.concatenate([stats['sums'], new_filled.sum(axis=1)])
+    stats['column_sums'] = stats['column_sums'] + new_filled.sum(axis=0)
+    stats['column_squares'] = stats['column_squares'] + (new_filled ** 2).sum(axis=0)
+    stats['names'] += list(names)
+    stats['ids'] += list(ids)
+
+def correlation_from_stats(stats, order=None):
+    """
+    Correlation matrix from the statistics, same definition as returns_matrix.correlation_matrix
+
+    order selects and orders the assets (positions in stats['names']).
+    """
+    order = np.arange(len(stats['names'])) if order is None else np.asarray(order)
+    n_days = max(len(stats['dates']), 1)
+    sums = stats['sums'][order]
+    centered = stats['cross'][np.ix_(order, order)] - np.outer(sums, sums) / n_days
+    scale = np.sqrt(np.clip(np.diag(centered), 0.0, None))
+    nonzero = scale > 0
+    correlation = np.zeros_like(centered)
+    correlation[np.ix_(nonzero, nonzero)] = centered[np.ix_(nonzero, nonzero)] / np.outer(scale[nonzero], scale[nonzero])
+    np.fill_diagonal(correlation, 1.0)
+    return correlation
+
+def update_stats(stats, names, ids, dates, returns, window=None):
+    """
+    Bring the statistics up to date with the returns matrix; returns (stats, info)
+
+    New trailing dates are folded in and, with a window, the oldest dropped;
+    new assets are appended. Anything the running sums cannot follow
+    (changed window, removed assets, revised or inserted history) rebuilds
+    them, as does the drift check every DRIFT_CHECK_INTERVAL updates.
+    """
+    def rebuild(reason):
+        return build_stats(names, ids, dates, returns, window), {'mode': 'full', 'reason': reason}
+
+    if stats is None:
+        return rebuild('no saved statistics')
+    if stats['window'] != (window or 0):
+        return rebuild('window changed')
+
+    row = {name: i for i, name in enumerate(names)}
+    if any(name not in row for name in stats['names']):
+        return rebuild('assets removed')
+    column = {date: j for j, date in enumerate(dates)}
+    if any(date not in column for date in stats['dates']):
+        return rebuild('saved dates no longer in the data')
+    stored_columns = np.array([column[date] for date in stats['dates']], dtype=int)
+    last = stored_columns[-1] if len(stored_columns) else -1
+    if np.any(np.diff(stored_columns) != 1):
+        return rebuild('dates inserted into the saved history')
+
+    # The saved days must still hold the same returns (e.g. not re-cleaned or realigned)
+    existing = np.array([row[name] for name in stats['names']], dtype=int)
+    history = _filled(returns[np.ix_(existing, stored_columns)])
+    if not (np.allclose(history.sum(axis=0), stats['column_sums'], rtol=0, atol=1e-6)
+            and np.allclose((history ** 2).sum(axis=0), stats['column_squares'], rtol=0, atol=1e-6)):
+        return rebuild('saved history changed')
+
+    new_columns = np.arange(last + 1, len(dates))
+    info = {'mode': 'incremental', 'added_days': len(new_columns), 'dropped_days': 0, 'added_assets': 0}
+
+    # Fold in the new days for the existing assets, then drop days beyond the window
+    if len(new_columns):
+        block = returns[np.ix_(existing, new_columns)]
+        fold_days(stats, block)
+        filled = _filled(block)
+        stats['column_sums'] = np.concatenate([stats['column_sums'], filled.sum(axis=0)])
+        stats['column_squares'] = np.concatenate([stats['column_squares'], (filled ** 2).sum(axis=0)])
+        stats['dates'] += [dates[j] for j in new_columns]
+    if window and len(stats['dates']) > window:
+        drop = len(stats['dates']) - window
+        fold_days(stats, returns[np.ix_(existing, [column[date] for date in stats['dates'][:drop]])], sign=-1)
+        stats['dates'] = stats['dates'][drop:]
+        stats['column_sums'] = stats['column_sums'][drop:]
+        stats['column_squares'] = stats['column_squares'][drop:]
+        info['dropped_days'] = drop
+
+    # New assets get one row and column over the current days
+    known = set(stats['names'])
+    added = [i for i, name in enumerate(names) if name not in known]
+    if added:
+        window_columns = [column[date] for date in stats['dates']]
+        add_assets(stats, [names[i] for i in added], [ids[i] for i in added],
+                   returns[np.ix_(added, window_columns)], returns[np.ix_(existing, window_columns)])
+        info['added_assets'] = len(added)
+
+    stats['updates'] += 1
+    if stats['updates'] >= DRIFT_CHECK_INTERVAL:
+        fresh = build_stats(names, ids, dates, returns, window)
+        # Periodic full recompute: report how far the running sums drifted and start again from exact ones
+        position = {name: i for i, name in enumerate(stats['names'])}
+        order = [position[name] for name in fresh['names']]
+        drift = float(np.abs(correlation_from_stats(stats, order) - correlation_from_stats(fresh)).max()) if order else 0.0
+        info['drift'] = drift
+        if drift > DRIFT_TOLERANCE:
+            info['mode'] = 'full'
+            info['reason'] = f"drift {drift:.2e} above {DRIFT_TOLERANCE:g}"
+        return fresh, info
+    return stats, info
+
+def load_stats(filename=STATS_FILE):
+    """Saved statistics, or None"""
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        stats = {key: data[key] for key in ('cross', 'sums', 'counts', 'column_sums', 'column_squares')}
+    stats.update(meta)
+    return stats
+
+def save_stats(stats, filename=STATS_FILE):
+    meta = {key: stats[key] for key in ('names', 'ids', 'dates', 'window', 'updates')}
+    with atomic_open(filename, 'wb', backup=False) as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), cross=stats['cross'], sums=stats['sums'],
+                 counts=stats['counts'], column_sums=stats['column_sums'], column_squares=stats['column_squares'])
+
+def incremental_correlation(names, ids, dates, returns, window=None, stats_file=STATS_FILE):
+    """
+    Correlation matrix of the returns (assets x dates, NaN for missing), updating the saved statistics
+
+    Names must be unique; the matrix follows their order. Returns (correlation, info).
+    """
+    stats, info = update_stats(load_stats(stats_file), names, ids, dates, returns, window)
+    save_stats(stats, stats_file)
+    position = {name: i for i, name in enumerate(stats['names'])}
+    order = [position[name] for name in names]
+    counts = stats['counts'][np.ix_(order, order)]
+    info['days'] = len(stats['dates'])
+    info['min_overlap'] = int(counts.min()) if len(counts) else 0
+    return correlation_from_stats(stats, order), info
+
+def main():
+    parser = argparse.ArgumentParser(description="Update asset_correlationship.csv from saved sufficient statistics")
+    parser.add_argument('--window', type=int, default=None, help="correlations over the last N trading days")
+    parser.add_argument('--full', action='store_true', help="discard the saved statistics and rebuild them")
+    args = parser.parse_args()
+    if args.full and os.path.exists(STATS_FILE):
+        os.remove(STATS_FILE)
+    from portfolio_analysis import asset_correlation_analysis
+    asset_correlation_analysis('percentage_change.csv', 'asset_correlationship.csv', incremental=True, window=args.window)
+
+if __name__ == '__main__':
+    main()
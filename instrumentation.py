@@ -0,0 +1,169 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Structured metrics are appended here, one JSON object per stage
+METRICS_FILE = os.environ.get('PORTFOLIO_METRICS_FILE', os.path.join('metrics', 'metrics.jsonl'))
+
+# Set PORTFOLIO_METRICS=0 to turn recording off completely
+METRICS_ENABLED = os.environ.get('PORTFOLIO_METRICS', '1') != '0'
+
+# PORTFOLIO_PROFILE=cprofile, tracemalloc or cprofile,tracemalloc enables the optional profilers
+PROFILE_DIR = os.environ.get('PORTFOLIO_PROFILE_DIR', os.path.join('metrics', 'profiles'))
+_profile_modes = {m.strip() for m in os.environ.get('PORTFOLIO_PROFILE', '').split(',') if m.strip()}
+
+# Identifies all records written by this process
+RUN_ID = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+def enable_profiling(*modes):
+    """Turn on 'cprofile' and/or 'tracemalloc' capture for top-level stages (e.g. from a --profile flag)"""
+    _profile_modes.update(modes)
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 2)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 2)
+    except (ImportError, AttributeError):
+        return None
+
+def _stack():
+    """Active stages of the current thread, outermost first"""
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+class StageMetrics:
+    """Counters collected while a stage is running"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = dict(fields)
+        self.counters = {}
+
+    def add(self, **counts):
+        """Add to named counters, e.g. add(rows=100, http_bytes=2048)"""
+        for key, value in counts.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, **fields):
+        """Attach extra fields to the record, e.g. set(n_assets=30)"""
+        self.fields.update(fields)
+
+def count(**counts):
+    """Add to the counters of every active stage in this thread (no-op outside a stage)"""
+    for metrics in _stack():
+        metrics.add(**counts)
+
+def _write_record(record):
+    """Append one JSON record to METRICS_FILE"""
+    directory = os.path.dirname(METRICS_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _write_lock:
+        with open(METRICS_FILE, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Measure a block of work and append a record to METRICS_FILE.
+
+    Records wall time, CPU time, peak RSS and any counters added with
+    StageMetrics.add()/count() (rows, http_requests, http_bytes, retries, ...).
+    Counters also roll up into enclosing stages. Top-level stages are profiled
+    with cProfile/tracemalloc when enabled via PORTFOLIO_PROFILE or
+    enable_profiling().
+    """
+    metrics = StageMetrics(name, fields)
+    if not METRICS_ENABLED:
+        yield metrics
+        return
+
+    stack = _stack()
+    top_level = not stack
+    profiler = None
+    tracing = False
+    if top_level and 'cprofile' in _profile_modes:
+        import cProfile
+        profiler = cProfile.Profile()
+    if top_level and 'tracemalloc' in _profile_modes:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing = True
+
+    stack.append(metrics)
+    status = 'ok'
+    started = datetime.now()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    except BaseException as e:
+        status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        stack.pop()
+
+        record = {
+            'run_id': RUN_ID,
+            'stage': name,
+            'parent': stack[-1].name if stack else None,
+            'start': started.isoformat(timespec='milliseconds'),
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_rss_mb': peak_rss_mb(),
+            'status': status,
+        }
+        record.update(metrics.fields)
+        record.update(metrics.counters)
+
+        if profiler is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}_{RUN_ID}.prof")
+            profiler.dump_stats(path)
+            record['cprofile'] = path
+        if tracing:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            record['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 3)
+            record['tracemalloc_top'] = [str(s) for s in snapshot.statistics('lineno')[:10]]
+            tracemalloc.stop()
+
+        try:
+            _write_record(record)
+        except OSError as e:
+            print(f"Warning: could not write metrics to {METRICS_FILE}: {e}")
+
+def instrumented(name=None, **fields):
+    """Decorator form of stage(); the stage name defaults to the function name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__, **fields):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
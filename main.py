@@ -1,9 +1,67 @@
+import argparse
 from update_prices import update_prices
 from update_portfolio import update_portfolio_main
+import calculate_percentage_change
+import clean_returns
+import update_portfolio
+import portfolio_analysis
 from calculate_percentage_change import percentage_change_update
-from portfolio_analysis import portfolio_analysis
+from clean_returns import clean_returns_update
+from portfolio_analysis import portfolio_analysis as run_portfolio_analysis
+from price_series import PRICE_SERIES, default_series
+from trading_calendar import ALIGN_MODES
+from build_graph import BuildGraph, module_files
+from instrumentation import stage, enable_profiling
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Update prices, returns, portfolio.csv and the correlation analysis")
+    parser.add_argument('--profile', action='store_true',
+                        help="capture cProfile and tracemalloc data for the whole run (see instrumentation.py)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="compute per-asset statistics across N processes (see parallel_stats.py)")
+    parser.add_argument('--series', choices=PRICE_SERIES, default=None,
+                        help="adjusted computes returns from cumulative NAV / forward-adjusted closes (see price_series.py)")
+    parser.add_argument('--align', choices=ALIGN_MODES, default='none',
+                        help="compute returns on the trading calendar instead of losing them around gaps (see trading_calendar.py)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="update the correlations from saved sufficient statistics (see incremental_correlation.py)")
+    parser.add_argument('--correlation-window', type=int, default=None, metavar='N',
+                        help="correlations over the last N trading days; implies --incremental")
+    parser.add_argument('--clean', action='store_true',
+                        help="winsorize outlier daily returns once; later stages read the cached matrix (see clean_returns.py)")
+    parser.add_argument('--force', action='store_true', help="rerun every stage even if its inputs are unchanged")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    percentage_change_update()
-    update_portfolio_main()
-    portfolio_analysis()
+    args = parse_arguments()
+    if args.profile:
+        enable_profiling('cprofile', 'tracemalloc')
+    workers = args.workers
+    align = args.align
+    correlation_window = args.correlation_window
+    incremental = args.incremental or correlation_window is not None
+    clean = args.clean
+    
+    # Stages whose input files and parameters are unchanged since the last run are skipped (see build_graph.py);
+    # the source of every project module a stage imports counts as an input. --force reruns all of them
+    graph = BuildGraph(force=args.force)
+    series = args.series or default_series()
+    price_inputs = ['watchlist.csv'] + (['adjusted_prices.npz'] if series == 'adjusted' else [])
+    
+    with stage('main', workers=workers):
+        graph.run('percentage_change_update', lambda: percentage_change_update(series, align),
+                  inputs=price_inputs + [*module_files(calculate_percentage_change)],
+                  outputs=['percentage_change.csv', 'percentage_change.npz'],
+                  params={'series': series, 'align': align})
+        if clean:
+            graph.run('clean_returns_update', clean_returns_update,
+                      inputs=['percentage_change.csv', *module_files(clean_returns)],
+                      outputs=['percentage_change_clean.npz', 'return_exceptions.csv'])
+        graph.run('update_portfolio_main', lambda: update_portfolio_main(workers),
+                  inputs=['watchlist.csv', 'percentage_change.csv', 'percentage_change_clean.npz', *module_files(update_portfolio)],
+                  outputs=['portfolio.csv'])
+        graph.run('portfolio_analysis', lambda: run_portfolio_analysis(workers, incremental, correlation_window),
+                  inputs=['percentage_change.csv', 'percentage_change_clean.npz', 'portfolio.csv', *module_files(portfolio_analysis)],
+                  outputs=['asset_correlationship.csv', 'asset_correlationship.npz', 'risk_contribution.csv'],
+                  params={'incremental': incremental, 'correlation_window': correlation_window})
+    graph.report()
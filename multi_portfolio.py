@@ -0,0 +1,163 @@
+import os
+import sys
+from contextlib import ExitStack
+import numpy as np
+from portfolio_state import PortfolioState
+from portfolio_table import load_portfolio_table, save_portfolio_table
+from storage import locked, write_csv_rows
+from update_portfolio import read_watchlist
+
+# Derived columns rewritten in every client portfolio file (same formats as update_portfolio.py)
+DERIVED_COLUMNS = ['last_price', 'total_value', 'percentage', 'holding_earnings', 'annual_return', 'risk']
+
+def list_portfolio_files(portfolio_dir):
+    """All *.csv portfolio files in portfolio_dir, sorted by name"""
+    return sorted(os.path.join(portfolio_dir, name) for name in os.listdir(portfolio_dir)
+                  if name.endswith('.csv') and not name.startswith('.'))
+
+def read_holdings(filename, id_index):
+    """
+    Read one portfolio file and align its holdings with the shared universe
+
+    Returns (table, holdings, holding_prices); ids that are not in the
+    watchlist are reported and ignored. Holding prices stay NaN where the
+    cost basis is missing, so no earnings are computed for those assets.
+    """
+    table = load_portfolio_table(filename)
+    holdings = np.zeros(len(id_index))
+    holding_prices = np.full(len(id_index), np.nan)
+    if table is None:
+        return table, holdings, holding_prices
+
+    rows = []
+    for i, asset_id in enumerate(table.ids):
+        if not asset_id:
+            continue
+        if asset_id not in id_index:
+            print(f"Warning: {asset_id} in {filename} is not in watchlist.csv, skipped")
+            continue
+        rows.append(i)
+    targets = [id_index[table.ids[i]] for i in rows]
+    if 'holdings' in table:
+        holdings[targets] = np.nan_to_num(table['holdings'][rows])
+    if 'holding_price' in table:
+        holding_prices[targets] = table['holding_price'][rows]
+    return table, holdings, holding_prices
+
+def evaluate_portfolios(state, holdings, holding_prices):
+    """
+    Evaluate many portfolios in one batch against the shared statistics
+
+    holdings and holding_prices are portfolios x universe matrices. The
+    covariance is built once for the union of assets held by any portfolio and
+    every portfolio's value, weights, earnings, return and risk come from
+    matrix products over that union. earnings are NaN where the last or the
+    holding price is missing.
+    """
+    s = state.snapshot()
+    last_prices = np.nan_to_num(s['last_prices'])
+
+    total_values = np.round(holdings * last_prices, 2)
+    totals = total_values.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(totals[:, None] != 0, total_values / totals[:, None], 0.0)
+    earnings = (s['last_prices'] - holding_prices) * holdings
+
+    # Covariance only for the union of held assets (percent units, like optimize_portfolio)
+    union = np.nonzero((holdings != 0).any(axis=0))[0]
+    risks = s['risks'][union]
+    covariance = np.outer(risks, risks) * s['correlation'][np.ix_(union, union)]
+    union_weights = weights[:, union]
+    portfolio_returns = union_weights @ s['annual_returns'][union]
+    portfolio_variance = ((union_weights @ covariance) * union_weights).sum(axis=1)
+    portfolio_risks = np.sqrt(np.maximum(portfolio_variance, 0.0))
+
+    return {
+        'total_values': total_values,
+        'totals': totals,
+        'weights': weights,
+        'earnings': earnings,
+        'portfolio_returns': portfolio_returns,
+        'portfolio_risks': portfolio_risks,
+        'union_size': len(union),
+    }
+
+def write_projection(filename, table, state, result, p, latest_prices):
+    """
+    Write the derived columns of portfolio p back to its file
+
+    latest_prices maps id -> the watchlist's price text, copied as is like
+    update_portfolio does; values computed from missing inputs are written
+    as '0'.
+    """
+    if table is None:
+        return
+    s = state.snapshot()
+    missing = table.missing(*DERIVED_COLUMNS)
+    if missing:
+        print(f"Error: Required columns {missing} not found in {filename}")
+        return
+    rows = np.array([i for i, asset_id in enumerate(table.ids) if asset_id in s['id_index']], dtype=int)
+    universe = np.array([s['id_index'][table.ids[i]] for i in rows], dtype=int)
+
+    priced = [i for i in rows if table.ids[i] in latest_prices]
+    table.set_text('last_price', priced, [latest_prices[table.ids[i]] for i in priced])
+    no_holdings = np.isnan(table['holdings'][rows])
+    unvalued = rows[np.isnan(s['last_prices'][universe]) | no_holdings]
+    table.set('total_value', rows, result['total_values'][p, universe])
+    table.set_text('total_value', unvalued, ['0'] * len(unvalued))
+    table.set('percentage', rows, result['weights'][p, universe] * 100)
+    earnings = result['earnings'][p, universe]
+    table.set('holding_earnings', rows, np.nan_to_num(earnings))
+    no_earnings = rows[np.isnan(earnings) | no_holdings]
+    table.set_text('holding_earnings', no_earnings, ['0'] * len(no_earnings))
+    table.set('annual_return', rows, s['annual_returns'][universe])
+    table.set('risk', rows, s['risks'][universe])
+    save_portfolio_table(filename, table)
+
+def multi_portfolio_main(portfolio_dir='portfolios', watchlist_file='watchlist.csv', summary_file='portfolios_summary.csv'):
+    """Update every portfolio in portfolio_dir from one shared price/statistics computation"""
+    if not os.path.isdir(portfolio_dir):
+        print(f"Error: {portfolio_dir} directory does not exist")
+        return
+
+    files = list_portfolio_files(portfolio_dir)
+    if not files:
+        print(f"No portfolio files found in {portfolio_dir}")
+        return
+
+    # Prices, returns, statistics and correlation are computed once for the whole universe
+    state = PortfolioState(watchlist_file, portfolio_file=None)
+    state.refresh()
+    id_index = state.snapshot()['id_index']
+    latest_prices = read_watchlist(watchlist_file)
+
+    summary = [['portfolio', 'total_value', 'annual_return', 'risk', 'assets_held']]
+    # Lock every client file from read to write so concurrent trades are not overwritten
+    with ExitStack() as stack:
+        for filename in files:
+            stack.enter_context(locked(filename, exclusive=True))
+
+        loaded = [read_holdings(filename, id_index) for filename in files]
+        holdings = np.array([item[1] for item in loaded]).reshape(len(files), len(id_index))
+        holding_prices = np.array([item[2] for item in loaded]).reshape(len(files), len(id_index))
+        result = evaluate_portfolios(state, holdings, holding_prices)
+
+        for p, filename in enumerate(files):
+            write_projection(filename, loaded[p][0], state, result, p, latest_prices)
+            name = os.path.splitext(os.path.basename(filename))[0]
+            summary.append([
+                name,
+                f"{result['totals'][p]:.2f}",
+                f"{result['portfolio_returns'][p]:.2f}%",
+                f"{result['portfolio_risks'][p]:.2f}%",
+                str(int((holdings[p] != 0).sum())),
+            ])
+            print(f"{name}: total value {result['totals'][p]:.2f}, annual return "
+                  f"{result['portfolio_returns'][p]:.2f}%, risk {result['portfolio_risks'][p]:.2f}%")
+
+    write_csv_rows(summary_file, summary)
+    print(f"Evaluated {len(files)} portfolios over {result['union_size']} shared assets, summary written to {summary_file}")
+
+if __name__ == '__main__':
+    multi_portfolio_main(*sys.argv[1:2])
@@ -1,61 +1,40 @@
-import csv
+import argparse
 import numpy as np
 from scipy.optimize import minimize
 import warnings
+from storage import read_csv_rows
+from sidecar import read_correlation_sidecar
+from portfolio_table import load_portfolio_table
+from instrumentation import stage
 warnings.filterwarnings('ignore')
 
 def read_portfolio_data(filename):
-    """Read portfolio data from CSV file"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
+    """
+    Read names, ids and the percentage, annual_return and risk columns (in percent) from a portfolio CSV file
     
-    if not rows:
-        return [], [], [], []
+    Empty or invalid cells are read as 0.
+    """
+    table = load_portfolio_table(filename)
     
-    # Extract data from rows (skip header)
-    names = []
-    ids = []
-    percentages = []
-    annual_returns = []
-    risks = []
+    if table is None:
+        return [], [], np.array([]), np.array([]), np.array([])
     
-    for row in rows[1:]:  # Skip header row
-        if len(row) >= 11:  # Updated to account for the two new columns
-            names.append(row[0])
-            ids.append(row[1])
-            # Convert percentage strings to floats
-            # Find column indices dynamically
-            percentage_index = -1
-            annual_return_index = -1
-            risk_index = -1
-            
-            for i, col_name in enumerate(rows[0]):  # rows[0] is the header
-                if col_name == 'percentage':
-                    percentage_index = i
-                elif col_name == 'annual_return':
-                    annual_return_index = i
-                elif col_name == 'risk':
-                    risk_index = i
-            
-            # Use dynamic indices if found, otherwise fall back to original hardcoded values
-            if percentage_index != -1 and annual_return_index != -1 and risk_index != -1:
-                percentages.append(float(row[percentage_index].rstrip('%')) if row[percentage_index] else 0)
-                annual_returns.append(float(row[annual_return_index].rstrip('%')) if row[annual_return_index] else 0)
-                risks.append(float(row[risk_index].rstrip('%')) if row[risk_index] else 0)
-            else:
-                # Fallback to original hardcoded indices for backward compatibility
-                percentages.append(float(row[6].rstrip('%')) if row[6] else 0)
-                annual_returns.append(float(row[7].rstrip('%')) if row[7] else 0)
-                risks.append(float(row[8].rstrip('%')) if row[8] else 0)
-    
-    return names, ids, percentages, annual_returns, risks
+    missing = table.missing('percentage', 'annual_return', 'risk')
+    if missing:
+        print(f"Error: Required columns {missing} not found in {filename}")
+        return [], [], np.array([]), np.array([]), np.array([])
+    
+    return (table.names, table.ids, np.nan_to_num(table['percentage']),
+            np.nan_to_num(table['annual_return']), np.nan_to_num(table['risk']))
 
 def read_correlation_data(filename):
-    """Read asset correlation data from CSV file"""
-    with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
+    """Read asset correlation data from its binary sidecar when current (see sidecar.py), else from the CSV file"""
+    sidecar = read_correlation_sidecar(filename)
+    if sidecar is not None:
+        asset_names, _, _, correlation_matrix = sidecar
+        return asset_names, correlation_matrix
+    
+    rows = read_csv_rows(filename)
     
     if not rows:
         return [], np.array([])
@@ -109,6 +88,35 @@ def sharpe_ratio(weights, returns, risks, correlation_matrix, risk_free_rate):
     # Return negative Sharpe ratio because we want to maximize it (minimize negative)
     return -sharpe
 
+def optimize_weights(returns, risks, correlation_matrix, initial_weights, risk_free_rate=0.02, min_return=None, max_weight=1.0):
+    """
+    Run the max-Sharpe SLSQP optimization on in-memory arrays
+    
+    Returns the scipy OptimizeResult; result.x holds the weights in decimal form.
+    """
+    # Constraints:
+    # 1. Weights must sum to 1
+    # 2. Weights must be between 0 and 1 (no short selling)
+    # 3. Portfolio annual return must be at least min_return (if specified)
+    constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1.0}]
+    
+    # Add minimum return constraint if specified
+    if min_return is not None:
+        constraints.append({'type': 'ineq', 'fun': lambda x: calculate_portfolio_return(x, returns) - min_return})
+    
+    bounds = [(0, max_weight) for _ in range(len(initial_weights))]
+    
+    # Optimize: minimize negative Sharpe ratio
+    return minimize(
+        sharpe_ratio,
+        initial_weights,
+        args=(returns, risks, correlation_matrix, risk_free_rate),
+        method='SLSQP',
+        bounds=bounds,
+        constraints=constraints,
+        tol=1e-6
+    )
+
 def optimized_sharpe_ratio(risk_free_rate=0.02, min_return=None, max_weight=1.0):
     """
     Optimize portfolio weights to maximize Sharpe ratio
@@ -122,10 +130,12 @@ def optimized_sharpe_ratio(risk_free_rate=0.02, min_return=None, max_weight=1.0)
     list: Optimized percentage vector
     """
     # Read portfolio data
-    names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
+    with stage('read_portfolio_data'):
+        names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
     
     # Read correlation data
-    asset_names, correlation_matrix = read_correlation_data('asset_correlationship.csv')
+    with stage('read_correlation_data'):
+        asset_names, correlation_matrix = read_correlation_data('asset_correlationship.csv')
     
     # Check if we have data
     if not names or not asset_names:
@@ -144,28 +154,11 @@ def optimized_sharpe_ratio(risk_free_rate=0.02, min_return=None, max_weight=1.0)
     # Initial weights (current percentages)
     initial_weights = np.array(percentages) / 100.0  # Convert from percentages to decimals
     
-    # Constraints:
-    # 1. Weights must sum to 1
-    # 2. Weights must be between 0 and 1 (no short selling)
-    # 3. Portfolio annual return must be at least min_return (if specified)
-    constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1.0}]
-    
-    # Add minimum return constraint if specified
-    if min_return is not None:
-        constraints.append({'type': 'ineq', 'fun': lambda x: calculate_portfolio_return(x, returns) - min_return})
-    
-    bounds = [(0, max_weight) for _ in range(len(initial_weights))]
-    
-    # Optimize: minimize negative Sharpe ratio
-    result = minimize(
-        sharpe_ratio,
-        initial_weights,
-        args=(returns, risks, correlation_matrix, risk_free_rate),
-        method='SLSQP',
-        bounds=bounds,
-        constraints=constraints,
-        tol=1e-6
-    )
+    with stage('optimize_weights', n_assets=len(initial_weights)) as metrics:
+        result = optimize_weights(returns, risks, correlation_matrix, initial_weights,
+                                  risk_free_rate, min_return, max_weight)
+        metrics.set(success=bool(result.success), iterations=int(getattr(result, 'nit', 0)))
+        metrics.add(function_evaluations=int(getattr(result, 'nfev', 0)))
     
     # Check if optimization was successful
     if result.success:
@@ -189,6 +182,253 @@ def optimized_sharpe_ratio(risk_free_rate=0.02, min_return=None, max_weight=1.0)
         # Return original percentages if optimization failed
         return percentages
 
+# Weights below this count as not held for the cardinality limit
+HOLDING_THRESHOLD = 1e-4
+
+# Cost rates (decimal, per unit of traded weight) swept by the cost-vs-Sharpe report
+TRADEOFF_COST_RATES = [0.0, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02]
+
+def optimize_weights_with_turnover(returns, risks, correlation_matrix, current_weights, risk_free_rate=0.02,
+                                   cost_rate=0.0, max_turnover=None, max_assets=None, min_return=None,
+                                   max_weight=1.0, initial_trades=None):
+    """
+    Max-Sharpe weights net of trading costs, relative to current_weights
+    
+    The L1 turnover sum|w - w0| is made smooth by splitting the trade into
+    buys u >= 0 and sells v >= 0 (w = w0 + u - v, turnover = sum(u + v)), so
+    SLSQP can be used with analytic gradients. The objective is the Sharpe
+    ratio of the return net of cost_rate * turnover; max_turnover caps the
+    turnover (in weight, e.g. 0.2 = 20% of the book). max_assets limits the
+    number of holdings by repeatedly dropping the smallest positions and
+    re-solving from the previous solution.
+    
+    returns and risks are in percent and risk_free_rate in decimal, as in
+    optimized_sharpe_ratio; the rate is subtracted as is, like sharpe_ratio
+    does, so cost_rate=0 gives the same weights as optimize_weights. The
+    reported ratios use the rate in percent like optimized_sharpe_ratio.
+    Returns (weights, info) where info holds success, message, iterations,
+    turnover, cost (percent of portfolio value), return, risk, sharpe
+    (gross), net_sharpe and trades (the u/v vector for warm starts).
+    """
+    returns = np.asarray(returns, dtype=float)
+    risks = np.asarray(risks, dtype=float)
+    current = np.asarray(current_weights, dtype=float)
+    n = len(current)
+    covariance = np.outer(risks, risks) * correlation_matrix
+    # Same objective as sharpe_ratio: the decimal rate is subtracted from percent returns
+    rf = risk_free_rate
+    cost = cost_rate * 100
+    
+    def split(x):
+        return current + x[:n] - x[n:]
+    
+    def objective(x):
+        w = split(x)
+        cov_w = covariance @ w
+        risk = np.sqrt(max(w @ cov_w, 1e-18))
+        net = w @ returns - rf - cost * x.sum()
+        grad_w = -(returns / risk - net * cov_w / risk ** 3)
+        grad_cost = np.full(n, cost / risk)
+        return -net / risk, np.concatenate([grad_w + grad_cost, -grad_w + grad_cost])
+    
+    ones = np.ones(n)
+    constraints = [{'type': 'eq', 'fun': lambda x: split(x).sum() - 1.0,
+                    'jac': lambda x: np.concatenate([ones, -ones])}]
+    if min_return is not None:
+        constraints.append({'type': 'ineq', 'fun': lambda x: split(x) @ returns - min_return,
+                            'jac': lambda x: np.concatenate([returns, -returns])})
+    if max_turnover is not None:
+        constraints.append({'type': 'ineq', 'fun': lambda x: max_turnover - x.sum(),
+                            'jac': lambda x: -np.ones(2 * n)})
+    
+    if max_assets and max_assets * max_weight < 1.0:
+        # Fewer holdings than this cannot add up to 100% under max_weight
+        feasible = int(np.ceil(1.0 / max_weight - 1e-9))
+        print(f"Warning: max_assets {max_assets} is infeasible with max_weight {max_weight}, using {feasible}")
+        max_assets = feasible
+    
+    dropped = np.zeros(n, dtype=bool)
+    x = np.zeros(2 * n) if initial_trades is None else np.asarray(initial_trades, dtype=float)
+    iterations = 0
+    while True:
+        # Buys up to max_weight, sells down to 0; dropped assets are sold completely
+        buy_bounds = [(0.0, 0.0) if dropped[i] else (0.0, max(max_weight - current[i], 0.0)) for i in range(n)]
+        sell_bounds = [(current[i], current[i]) if dropped[i] else (max(current[i] - max_weight, 0.0), current[i])
+                       for i in range(n)]
+        bounds = buy_bounds + sell_bounds
+        x = np.clip(x, [b[0] for b in bounds], [b[1] for b in bounds])
+        result = minimize(objective, x, jac=True, method='SLSQP', bounds=bounds,
+                          constraints=constraints, tol=1e-9, options={'maxiter': 500})
+        x = result.x
+        iterations += int(getattr(result, 'nit', 0))
+        
+        held = (split(x) > HOLDING_THRESHOLD) & ~dropped
+        excess = int(held.sum()) - max_assets if max_assets else 0
+        if excess <= 0:
+            break
+        # Drop about half of the excess smallest positions per round
+        candidates = np.nonzero(held)[0]
+        smallest = candidates[np.argsort(split(x)[candidates])]
+        dropped[smallest[:max(1, (excess + 1) // 2)]] = True
+    
+    weights = split(x)
+    weights[weights < 0] = 0.0
+    portfolio_return = calculate_portfolio_return(weights, returns)
+    portfolio_risk = calculate_portfolio_risk(weights, risks, correlation_matrix)
+    turnover = np.abs(weights - current).sum()
+    info = {
+        'success': bool(result.success),
+        'message': result.message,
+        'iterations': iterations,
+        'turnover': turnover * 100,
+        'cost': cost * turnover,
+        'return': portfolio_return,
+        'risk': portfolio_risk,
+        # Reported like optimized_sharpe_ratio and the allocators, with the rate in percent
+        'sharpe': (portfolio_return - risk_free_rate * 100) / portfolio_risk if portfolio_risk else 0.0,
+        'net_sharpe': (portfolio_return - risk_free_rate * 100 - cost * turnover) / portfolio_risk if portfolio_risk else 0.0,
+        'holdings': int((weights > HOLDING_THRESHOLD).sum()),
+        'trades': x,
+    }
+    return weights, info
+
+def turnover_tradeoff(returns, risks, correlation_matrix, current_weights, risk_free_rate=0.02,
+                      cost_rates=TRADEOFF_COST_RATES, **kwargs):
+    """
+    Expected cost vs Sharpe ratio for a range of cost rates
+    
+    Each solve is warm-started from the previous one. Returns one info dict
+    (see optimize_weights_with_turnover) per cost rate, with the rate added.
+    """
+    rows = []
+    trades = None
+    for cost_rate in cost_rates:
+        _, info = optimize_weights_with_turnover(returns, risks, correlation_matrix, current_weights, risk_free_rate,
+                                                 cost_rate, initial_trades=trades, **kwargs)
+        trades = info['trades']
+        info['cost_rate'] = cost_rate
+        rows.append(info)
+    return rows
+
+def print_tradeoff(rows):
+    """Print the cost-vs-Sharpe table from turnover_tradeoff()"""
+    print("\nTransaction Cost vs Sharpe Ratio:")
+    print("-" * 78)
+    print(f"{'Cost rate':>10} {'Turnover (%)':>13} {'Cost (%)':>9} {'Return (%)':>11} {'Risk (%)':>9} "
+          f"{'Sharpe':>8} {'Net Sharpe':>11} {'Assets':>7}")
+    print("-" * 78)
+    for row in rows:
+        print(f"{row['cost_rate']:>10.4f} {row['turnover']:>13.2f} {row['cost']:>9.3f} {row['return']:>11.2f} "
+              f"{row['risk']:>9.2f} {row['sharpe']:>8.4f} {row['net_sharpe']:>11.4f} {row['holdings']:>7}")
+    print("-" * 78)
+
+def turnover_optimized_sharpe_ratio(risk_free_rate=0.02, cost_rate=0.0015, max_turnover=None, max_assets=None,
+                                    min_return=None, max_weight=1.0, tradeoff=False):
+    """
+    Optimize portfolio weights for Sharpe ratio net of the cost of trading away from the current weights
+    
+    Parameters are as for optimized_sharpe_ratio plus cost_rate (decimal cost
+    per unit of traded value), max_turnover (fraction of the book that may be
+    traded) and max_assets (maximum number of holdings). With tradeoff=True the
+    cost-vs-Sharpe table over TRADEOFF_COST_RATES is printed as well.
+    
+    Returns:
+    list: Optimized percentage vector
+    """
+    with stage('read_portfolio_data'):
+        names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
+    with stage('read_correlation_data'):
+        asset_names, correlation_matrix = read_correlation_data('asset_correlationship.csv')
+    
+    if not names or not asset_names:
+        print("Error: No data found in portfolio or correlation files")
+        return percentages
+    if names != asset_names:
+        print("Warning: Asset names don't match between portfolio.csv and asset_correlationship.csv")
+    
+    # Current weights are the starting point and the reference for turnover
+    current = np.array(percentages) / 100.0
+    if current.sum() > 0:
+        current = current / current.sum()
+    
+    with stage('optimize_weights_with_turnover', n_assets=len(current)) as metrics:
+        weights, info = optimize_weights_with_turnover(annual_returns, risks, correlation_matrix, current,
+                                                       risk_free_rate, cost_rate, max_turnover, max_assets,
+                                                       min_return, max_weight)
+        metrics.set(success=info['success'], iterations=info['iterations'], turnover=round(info['turnover'], 4))
+    
+    if tradeoff:
+        with stage('turnover_tradeoff'):
+            print_tradeoff(turnover_tradeoff(annual_returns, risks, correlation_matrix, current, risk_free_rate,
+                                             max_turnover=max_turnover, max_assets=max_assets,
+                                             min_return=min_return, max_weight=max_weight))
+    
+    if not info['success']:
+        print(f"Optimization failed: {info['message']}")
+        return percentages
+    
+    print(f"\nTurnover-Aware Optimized Portfolio Metrics (cost rate {cost_rate:.4f}):")
+    print(f"Annual Return: {info['return']:.2f}%")
+    print(f"Risk (Standard Deviation): {info['risk']:.2f}%")
+    print(f"Turnover: {info['turnover']:.2f}%, expected cost: {info['cost']:.3f}%")
+    print(f"Sharpe Ratio: {info['sharpe']:.4f} (net of costs: {info['net_sharpe']:.4f})")
+    print(f"Holdings: {info['holdings']}")
+    return [w * 100 for w in weights]
+
+def allocated_weights(method, risk_free_rate=0.02, min_return=None, max_weight=1.0, solver='ccd', dedupe=None):
+    """
+    Weights from one of the allocators in allocators.py (risk-parity, min-variance, max-diversification, hrp, max-sharpe)
+    
+    Uses the same covariance (risk from portfolio.csv, asset_correlationship.csv)
+    as the Sharpe optimizer. With dedupe (a correlation threshold) only one
+    representative of each group of near-duplicate assets is allocated to;
+    the others get 0.
+    
+    Returns:
+    list: Allocated percentage vector
+    """
+    from allocators import allocate
+    
+    with stage('read_portfolio_data'):
+        names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
+    with stage('read_correlation_data'):
+        asset_names, correlation_matrix = read_correlation_data('asset_correlationship.csv')
+    
+    if not names or not asset_names:
+        print("Error: No data found in portfolio or correlation files")
+        return percentages
+    if names != asset_names:
+        print("Warning: Asset names don't match between portfolio.csv and asset_correlationship.csv")
+    
+    keep = np.arange(len(names))
+    if dedupe is not None:
+        from clustering import representative_universe
+        with stage('representative_universe', threshold=dedupe) as metrics:
+            keep = np.array(representative_universe(asset_names, correlation_matrix, dedupe,
+                                                    load_portfolio_table('portfolio.csv'))[2], dtype=int)
+            metrics.set(n_assets=len(names), kept=len(keep))
+        print(f"Allocating to {len(keep)} of {len(names)} assets (correlation < {dedupe} between representatives)")
+    
+    with stage('allocate', method=method, n_assets=len(keep)) as metrics:
+        subset, info = allocate(method, np.asarray(annual_returns)[keep], np.asarray(risks)[keep],
+                                np.asarray(correlation_matrix)[np.ix_(keep, keep)],
+                                np.array(percentages)[keep] / 100.0, risk_free_rate, min_return, max_weight, solver)
+        metrics.set(success=info['success'])
+    weights = np.zeros(len(names))
+    weights[keep] = subset
+    
+    if not info['success']:
+        print(f"Allocation failed: {info['message']}")
+        return percentages
+    
+    print(f"\n{method} Portfolio Metrics:")
+    print(f"Annual Return: {info['return']:.2f}%")
+    print(f"Risk (Standard Deviation): {info['risk']:.2f}%")
+    print(f"Sharpe Ratio: {info['sharpe']:.4f}")
+    print(f"Diversification Ratio: {info['diversification_ratio']:.4f}")
+    print(f"Largest Risk Contribution: {info['max_risk_contribution'] * 100:.2f}%")
+    return [w * 100 for w in weights]
+
 def print_portfolio_comparison(original_percentages, optimized_percentages, asset_names):
     """Print a comparison of original and optimized portfolio weights"""
     print("\nPortfolio Weight Optimization Results:")
@@ -201,11 +441,92 @@ def print_portfolio_comparison(original_percentages, optimized_percentages, asse
     
     print("-" * 50)
 
-# Example usage
-if __name__ == '__main__':
-    # Example with default risk-free rate of 1.67%
-    risk_free_rate = 0.0167
-    optimized_weights = optimized_sharpe_ratio(risk_free_rate=risk_free_rate, min_return=15, max_weight=0.10)
+# Minimum annual return (percent) of the Sharpe-based modes unless --min-return is given
+DEFAULT_MIN_RETURN = 15
+
+def parse_arguments():
+    """Command line options; the defaults reproduce the original example run"""
+    parser = argparse.ArgumentParser(description="Optimize portfolio weights for Sharpe ratio")
+    parser.add_argument('--risk-free-rate', type=float, default=0.0167, help="decimal, default 0.0167 (1.67%%)")
+    parser.add_argument('--min-return', type=float, default=None,
+                        help="minimum annual return in percent (default 15; none in tracking mode)")
+    parser.add_argument('--max-weight', type=float, default=0.10, help="maximum weight per asset (decimal)")
+    parser.add_argument('--cost-rate', type=float, default=None,
+                        help="turnover-aware mode: cost per unit of traded value, e.g. 0.0015")
+    parser.add_argument('--max-turnover', type=float, default=None,
+                        help="turnover-aware mode: maximum fraction of the book traded, e.g. 0.2")
+    parser.add_argument('--max-assets', type=int, default=None, help="turnover-aware mode: maximum number of holdings")
+    parser.add_argument('--tradeoff', action='store_true', help="print expected cost vs Sharpe ratio over a range of cost rates")
+    parser.add_argument('--allocator', default='max-sharpe',
+                        choices=['max-sharpe', 'risk-parity', 'min-variance', 'max-diversification', 'hrp'],
+                        help="allocation method (turnover-aware options apply to max-sharpe)")
+    parser.add_argument('--dedupe', type=float, default=None, metavar='THRESHOLD',
+                        help="allocate to one representative per group of assets correlated at least THRESHOLD, e.g. 0.95")
+    parser.add_argument('--solver', default='ccd', choices=['ccd', 'newton'], help="risk-parity solver")
+    parser.add_argument('--track', default=None, metavar='BENCHMARK',
+                        help="minimize tracking error against a watchlist row (id or name), e.g. 399001")
+    parser.add_argument('--resample', type=int, default=None, metavar='N',
+                        help="resampled-efficiency mode: average the max-Sharpe weights of up to N bootstrapped histories")
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help="resampled mode: stop submitting resamples after this many seconds")
+    parser.add_argument('--block', type=int, default=1, help="resampled mode: bootstrap block length in trading days")
+    parser.add_argument('--seed', type=int, default=0, help="resampled mode: random seed")
+    parser.add_argument('--workers', type=int, default=None, help="resampled mode: worker processes (default: all CPUs)")
+    args = parser.parse_args()
+    # Each mode is chosen by its own flags and main() runs only one of them
+    modes = {
+        'allocator': [flag for flag, given in [('--allocator', args.allocator != 'max-sharpe'),
+                                               ('--dedupe', args.dedupe is not None)] if given],
+        'tracking': ['--track'] if args.track is not None else [],
+        'resampled': ['--resample'] if args.resample is not None else [],
+        'turnover-aware': [flag for flag, given in [('--cost-rate', args.cost_rate is not None),
+                                                    ('--max-turnover', args.max_turnover is not None),
+                                                    ('--max-assets', args.max_assets is not None),
+                                                    ('--tradeoff', args.tradeoff)] if given],
+    }
+    chosen = [flags for flags in modes.values() if flags]
+    if len(chosen) > 1:
+        parser.error(f"{' and '.join(', '.join(flags) for flags in chosen)} select different modes; use one at a time")
+    if args.min_return is None and args.track is None:
+        # The tracking fit only takes a return floor when one is asked for
+        args.min_return = DEFAULT_MIN_RETURN
+    return args
+
+def main():
+    args = parse_arguments()
+    risk_free_rate = args.risk_free_rate
+    if args.allocator != 'max-sharpe' or args.dedupe is not None:
+        with stage('allocated_weights'):
+            optimized_weights = allocated_weights(args.allocator, risk_free_rate, args.min_return,
+                                                  args.max_weight, args.solver, args.dedupe)
+    elif args.track is not None:
+        # Benchmark-tracking mode: closest fit to the benchmark's daily returns
+        from benchmark import tracking_weights
+        with stage('tracking_weights'):
+            optimized_weights = tracking_weights(args.track, min_return=args.min_return, max_weight=args.max_weight)
+    elif args.resample is not None:
+        # Resampled-efficiency mode: weights averaged over bootstrapped return histories
+        from resampled import resampled_sharpe_ratio
+        with stage('resampled_sharpe_ratio'):
+            optimized_weights = resampled_sharpe_ratio(
+                risk_free_rate=risk_free_rate, min_return=args.min_return, max_weight=args.max_weight,
+                max_resamples=args.resample, time_budget=args.time_budget, workers=args.workers,
+                block=args.block, seed=args.seed)
+    elif args.cost_rate is not None or args.max_turnover is not None or args.max_assets is not None or args.tradeoff:
+        # Turnover-aware mode: penalize or cap trading away from the current weights
+        with stage('turnover_optimized_sharpe_ratio'):
+            optimized_weights = turnover_optimized_sharpe_ratio(
+                risk_free_rate=risk_free_rate, cost_rate=args.cost_rate or 0.0, max_turnover=args.max_turnover,
+                max_assets=args.max_assets, min_return=args.min_return, max_weight=args.max_weight,
+                tradeoff=args.tradeoff)
+    else:
+        with stage('optimized_sharpe_ratio'):
+            optimized_weights = optimized_sharpe_ratio(risk_free_rate=risk_free_rate, min_return=args.min_return,
+                                                       max_weight=args.max_weight)
+    
+    if len(optimized_weights) == 0:
+        # The mode already printed why it has no weights (e.g. missing input files)
+        return
     
     # Read asset names for display
     names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
@@ -247,3 +568,6 @@ if __name__ == '__main__':
     print(f"Original Portfolio Sharpe Ratio:  {original_sharpe:.4f}")
     print(f"Optimized Portfolio Sharpe Ratio: {optimized_sharpe:.4f}")
     print(f"Improvement: {optimized_sharpe - original_sharpe:.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from returns_matrix import annual_return_and_risk, normalize_returns, correlation_block, CORRELATION_BLOCK
+
+# PORTFOLIO_WORKERS=N turns on the parallel mode for update_portfolio/portfolio_analysis (0 or unset = serial)
+def default_workers():
+    """Worker count from PORTFOLIO_WORKERS, or None for serial mode"""
+    try:
+        workers = int(os.environ.get('PORTFOLIO_WORKERS', '0'))
+    except ValueError:
+        return None
+    return workers if workers > 1 else None
+
+def _shared_dir():
+    """Scratch directory for memory-mapped arrays, in RAM where the OS provides one"""
+    return tempfile.mkdtemp(prefix='portfolio_shared_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+def _share(directory, name, array):
+    """Copy array into a memory-mapped file that worker processes can open without copying"""
+    path = os.path.join(directory, f'{name}.npy')
+    mapped = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+    mapped[...] = array
+    mapped.flush()
+    return path
+
+def _output(directory, name, shape):
+    """Create a zero-filled memory-mapped float64 output array"""
+    path = os.path.join(directory, f'{name}.npy')
+    np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape).flush()
+    return path
+
+def _chunks(n, workers, multiple=1):
+    """Split range(n) into about 4 chunks per worker, with boundaries on `multiple`"""
+    size = max(multiple, -(-n // (workers * 4)))
+    size = -(-size // multiple) * multiple
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+def _stats_chunk(returns_path, annual_path, risk_path, start, stop):
+    """Worker: annual return and risk for rows start:stop"""
+    returns = np.load(returns_path, mmap_mode='r')
+    annual_return, risk = annual_return_and_risk(np.asarray(returns[start:stop]))
+    annual = np.load(annual_path, mmap_mode='r+')
+    risks = np.load(risk_path, mmap_mode='r+')
+    annual[start:stop] = annual_return
+    risks[start:stop] = risk
+    annual.flush()
+    risks.flush()
+
+def _correlation_chunk(normalized_path, output_path, start, stop):
+    """Worker: correlation rows start:stop, computed in the same blocks as the serial version"""
+    normalized = np.load(normalized_path, mmap_mode='r')
+    output = np.load(output_path, mmap_mode='r+')
+    for block_start in range(start, stop, CORRELATION_BLOCK):
+        block_stop = min(block_start + CORRELATION_BLOCK, stop)
+        output[block_start:block_stop] = correlation_block(normalized, block_start, block_stop)
+    output.flush()
+
+def parallel_annual_return_and_risk(returns, workers=None):
+    """
+    annual_return_and_risk() split over a process pool
+
+    The returns matrix is shared through a memory-mapped file and each worker
+    writes its rows straight into shared output arrays. Per-row results are
+    identical to the serial function.
+    """
+    workers = workers or os.cpu_count() or 1
+    n = returns.shape[0]
+    if workers <= 1 or n < 2:
+        return annual_return_and_risk(returns)
+
+    directory = _shared_dir()
+    try:
+        returns_path = _share(directory, 'returns', np.ascontiguousarray(returns, dtype=np.float64))
+        annual_path = _output(directory, 'annual_return', (n,))
+        risk_path = _output(directory, 'risk', (n,))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_stats_chunk, returns_path, annual_path, risk_path, start, stop)
+                       for start, stop in _chunks(n, workers)]
+            for future in futures:
+                future.result()
+        return np.array(np.load(annual_path)), np.array(np.load(risk_path))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def parallel_correlation_matrix(returns, workers=None):
+    """
+    correlation_matrix() split over a process pool
+
+    Normalization is done once in the parent; workers compute disjoint row
+    blocks of Z @ Z.T from the shared normalized matrix into a shared n x n
+    output. Chunk boundaries are multiples of CORRELATION_BLOCK, so the result
+    is bit-for-bit identical to the serial function.
+    """
+    workers = workers or os.cpu_count() or 1
+    n = returns.shape[0]
+    if workers <= 1 or n <= CORRELATION_BLOCK:
+        from returns_matrix import correlation_matrix
+        return correlation_matrix(returns)
+
+    directory = _shared_dir()
+    try:
+        normalized_path = _share(directory, 'normalized', normalize_returns(returns))
+        output_path = _output(directory, 'correlation', (n, n))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_correlation_chunk, normalized_path, output_path, start, stop)
+                       for start, stop in _chunks(n, workers, CORRELATION_BLOCK)]
+            for future in futures:
+                future.result()
+        return np.array(np.load(output_path))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def measure_speedup(n_assets=2000, n_dates=2500, worker_counts=None, seed=0):
+    """Time serial vs parallel statistics on a random returns matrix and check the results match"""
+    from returns_matrix import correlation_matrix
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0003, 0.01, (n_assets, n_dates))
+    returns[rng.random(returns.shape) < 0.01] = np.nan
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = worker_counts or sorted({w for w in (1, 2, 4, 8, 16, 32, 64, cpu_count) if w <= cpu_count})
+
+    start = time.perf_counter()
+    serial_stats = annual_return_and_risk(returns)
+    serial_corr = correlation_matrix(returns)
+    serial = time.perf_counter() - start
+    print(f"{n_assets} assets x {n_dates} dates, {cpu_count} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8} {'efficiency':>10} {'identical':>9}")
+    print(f"{'serial':>8} {serial:>9.3f} {1.0:>8.2f} {1.0:>10.2f} {'-':>9}")
+
+    for workers in worker_counts:
+        start = time.perf_counter()
+        stats = parallel_annual_return_and_risk(returns, workers)
+        corr = parallel_correlation_matrix(returns, workers)
+        elapsed = time.perf_counter() - start
+        identical = (np.array_equal(stats[0], serial_stats[0]) and np.array_equal(stats[1], serial_stats[1])
+                     and np.array_equal(corr, serial_corr))
+        speedup = serial / elapsed
+        print(f"{workers:>8} {elapsed:>9.3f} {speedup:>8.2f} {speedup / workers:>10.2f} {str(identical):>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure parallel per-asset statistics speedup")
+    parser.add_argument('--assets', type=int, default=2000)
+    parser.add_argument('--dates', type=int, default=2500)
+    parser.add_argument('--workers', type=int, nargs='+', default=None)
+    args = parser.parse_args()
+    measure_speedup(args.assets, args.dates, args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import argparse
+import csv
+from datetime import datetime
+import numpy as np
+from storage import atomic_open, read_csv_rows
+from returns_matrix import parse_price_rows
+from portfolio_table import load_portfolio_table
+
+TRANSACTIONS_FILE = 'bargain_log/transactions.log'
+
+# Bisection steps for the vectorized XIRR; the bracket shrinks by 2^-steps
+XIRR_STEPS = 60
+XIRR_BRACKET = (-0.9999, 100.0)
+
+def read_transactions(filename=TRANSACTIONS_FILE):
+    """
+    Parse the buy_or_sell.py ledger into (dates, ids, quantities, prices)
+
+    Lines look like 'time | BUY | name | id | quantity | price | total [| ...]'.
+    Quantities are signed (sells negative); dates are 'YYYY-MM-DD' strings.
+    """
+    dates, ids, quantities, prices = [], [], [], []
+    try:
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                parts = [part.strip() for part in line.split('|')]
+                if len(parts) < 7 or parts[1] not in ('BUY', 'SELL'):
+                    continue
+                try:
+                    quantity, price = float(parts[4]), float(parts[5])
+                except ValueError:
+                    continue
+                dates.append(parts[0][:10])
+                ids.append(parts[3])
+                quantities.append(quantity if parts[1] == 'BUY' else -quantity)
+                prices.append(price)
+    except FileNotFoundError:
+        pass
+    return dates, ids, np.array(quantities), np.array(prices)
+
+def forward_fill(prices):
+    """Carry each asset's last price forward over empty dates (leading gaps stay NaN)"""
+    n_dates = prices.shape[1]
+    positions = np.where(~np.isnan(prices), np.arange(n_dates), 0)
+    latest = np.maximum.accumulate(positions, axis=1)
+    return prices[np.arange(len(prices))[:, None], latest]
+
+def build_book(watchlist_rows, holdings_now, trade_dates, trade_ids, quantities, trade_prices):
+    """
+    Daily holdings, values and flows of the book on the watchlist dates
+
+    holdings_now are the current holdings aligned with the watchlist rows. The
+    ledger is replayed backwards from them, so holdings before the first trade
+    are whatever the portfolio started with. A trade counts on the first
+    watchlist date on or after its day; buys are money added to the book and
+    sells money taken out, at the traded price.
+
+    Returns a dict with names, ids, dates and assets x dates matrices
+    holdings, values, flows, plus the number of trades that could not be
+    placed (asset not in the watchlist).
+    """
+    names, ids, _, dates, prices = parse_price_rows(watchlist_rows)
+    prices = np.nan_to_num(forward_fill(prices))
+    id_index = {asset_id: i for i, asset_id in enumerate(ids)}
+
+    rows = np.array([id_index.get(asset_id, -1) for asset_id in trade_ids], dtype=int)
+    placed = rows >= 0
+    columns = np.minimum(np.searchsorted(dates, np.array(trade_dates, dtype=str)), max(len(dates) - 1, 0))
+
+    traded = np.zeros(prices.shape)
+    flows = np.zeros(prices.shape)
+    np.add.at(traded, (rows[placed], columns[placed]), quantities[placed])
+    np.add.at(flows, (rows[placed], columns[placed]), (quantities * trade_prices)[placed])
+
+    # Holdings at the end of day t = current holdings - trades made after day t
+    later = np.cumsum(traded[:, ::-1], axis=1)[:, ::-1]
+    later = np.concatenate([later[:, 1:], np.zeros((len(ids), 1))], axis=1)
+    holdings = np.asarray(holdings_now, dtype=float)[:, None] - later
+
+    return {
+        'names': names,
+        'ids': ids,
+        'dates': dates,
+        'holdings': holdings,
+        'values': holdings * prices,
+        'flows': flows,
+        'unplaced': int((~placed).sum()),
+    }
+
+def linked_returns(values, flows):
+    """
+    Daily book returns and each asset's linked contribution to the cumulative TWR
+
+    The book return on day t is (V_t - F_t) / V_{t-1} - 1 with flows at the
+    end of the day. Asset i contributes c_it = (V_it - V_i,t-1 - F_it) / V_{t-1};
+    scaling by the growth up to the day before, G_{t-1}, makes the cumulative
+    contributions add up exactly to the TWR G_t - 1 on every day.
+
+    Returns (daily, growth, cumulative_contributions), the last as an
+    assets x dates matrix (the first date is the starting point, all zero).
+    """
+    total = values.sum(axis=0)
+    pnl = np.diff(values, axis=1) - flows[:, 1:]
+    previous = total[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        contributions = np.where(previous > 0, pnl / previous, 0.0)
+    daily = contributions.sum(axis=0)
+    growth = np.concatenate([[1.0], np.cumprod(1.0 + daily)])
+    linked = contributions * growth[:-1]
+    cumulative = np.concatenate([np.zeros((len(values), 1)), np.cumsum(linked, axis=1)], axis=1)
+    return daily, growth, cumulative
+
+def vectorized_xirr(amounts, years, steps=XIRR_STEPS):
+    """
+    XIRR for many cash-flow rows at once
+
+    amounts is a k x t matrix (negative = invested) and years the time of each
+    column in years. All rows are bisected together; rows whose NPV does not
+    change sign over XIRR_BRACKET get NaN.
+    """
+    amounts = np.atleast_2d(np.asarray(amounts, dtype=float))
+    years = np.asarray(years, dtype=float)
+    low = np.full(len(amounts), XIRR_BRACKET[0])
+    high = np.full(len(amounts), XIRR_BRACKET[1])
+
+    def npv(rates):
+        return (amounts / (1.0 + rates[:, None]) ** years).sum(axis=1)
+
+    f_low = npv(low)
+    solvable = np.sign(f_low) != np.sign(npv(high))
+    for _ in range(steps):
+        mid = (low + high) / 2
+        f_mid = npv(mid)
+        same = np.sign(f_mid) == np.sign(f_low)
+        low = np.where(same, mid, low)
+        f_low = np.where(same, f_mid, f_low)
+        high = np.where(same, high, mid)
+    return np.where(solvable, (low + high) / 2, np.nan)
+
+def window_cash_flows(values, flows):
+    """
+    Cash-flow rows for XIRR over a window: buy in at the first day's value, add flows, sell out at the last
+
+    values and flows are ... x days arrays; returns amounts with the same shape.
+    """
+    amounts = -flows.copy()
+    amounts[..., 0] = -values[..., 0]
+    amounts[..., -1] += values[..., -1]
+    return amounts
+
+def money_weighted_to_date(total, flows, years):
+    """XIRR from the first day to every later day at once (NaN for the first day)"""
+    n = len(total)
+    # Row e holds the cash flows of the window ending on day e
+    upto = np.tri(n, dtype=bool)
+    amounts = np.where(upto, -flows[None, :], 0.0)
+    amounts[:, 0] = -total[0]
+    amounts[np.arange(n), np.arange(n)] += total
+    rates = vectorized_xirr(amounts, years)
+    rates[0] = np.nan
+    return rates
+
+def attribution(book, start=None, end=None):
+    """
+    TWR, XIRR and per-asset attribution for the book between start and end ('YYYY-MM-DD', inclusive)
+
+    Returns a dict with dates, daily returns, twr_to_date and xirr_to_date for
+    every day of the window (all computed at once), the window totals and
+    per-asset start/end value, net flow, P&L, contribution and XIRR.
+    """
+    dates = np.array(book['dates'], dtype=str)
+    first = np.searchsorted(dates, start) if start else 0
+    last = np.searchsorted(dates, end, side='right') if end else len(dates)
+    window = slice(first, last)
+    values, flows = book['values'][:, window], book['flows'][:, window].copy()
+    dates = dates[window]
+    if len(dates) < 2:
+        return None
+    # Trades on the first day are already in its value
+    flows[:, 0] = 0.0
+
+    total = values.sum(axis=0)
+    total_flows = flows.sum(axis=0)
+    daily, growth, cumulative = linked_returns(values, flows)
+    years = (dates.astype('datetime64[D]') - dates.astype('datetime64[D]')[0]).astype(float) / 365.0
+
+    held = (values != 0).any(axis=1) | (flows != 0).any(axis=1)
+    asset_xirr = np.full(len(values), np.nan)
+    if held.any():
+        asset_xirr[held] = vectorized_xirr(window_cash_flows(values[held], flows[held]), years)
+
+    return {
+        'dates': dates,
+        'total': total,
+        'flows': total_flows,
+        'daily': np.concatenate([[0.0], daily]),
+        'twr_to_date': growth - 1.0,
+        'xirr_to_date': money_weighted_to_date(total, total_flows, years),
+        'twr': float(growth[-1] - 1.0),
+        'xirr': float(vectorized_xirr(window_cash_flows(total, total_flows), years)[0]),
+        'asset_start': values[:, 0],
+        'asset_end': values[:, -1],
+        'asset_flows': flows.sum(axis=1),
+        'asset_pnl': values[:, -1] - values[:, 0] - flows.sum(axis=1),
+        'asset_contribution': cumulative[:, -1],
+        'asset_xirr': asset_xirr,
+        'held': held,
+    }
+
+def write_attribution_report(filename, book, result):
+    """Per-asset attribution, largest contribution first"""
+    order = np.argsort(-result['asset_contribution'])
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'start_value', 'end_value', 'net_flow', 'pnl', 'contribution', 'xirr'])
+        for i in order:
+            if not result['held'][i]:
+                continue
+            writer.writerow([
+                book['names'][i], book['ids'][i],
+                f"{result['asset_start'][i]:.2f}", f"{result['asset_end'][i]:.2f}",
+                f"{result['asset_flows'][i]:.2f}", f"{result['asset_pnl'][i]:.2f}",
+                f"{result['asset_contribution'][i] * 100:.4f}%",
+                '' if np.isnan(result['asset_xirr'][i]) else f"{result['asset_xirr'][i] * 100:.2f}%",
+            ])
+
+def write_daily_report(filename, result):
+    """Value, flow, daily return, TWR and XIRR to date for every day of the window"""
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'total_value', 'net_flow', 'daily_return', 'twr_to_date', 'xirr_to_date'])
+        for k, date in enumerate(result['dates']):
+            xirr = result['xirr_to_date'][k]
+            writer.writerow([date, f"{result['total'][k]:.2f}", f"{result['flows'][k]:.2f}",
+                             f"{result['daily'][k] * 100:.4f}%", f"{result['twr_to_date'][k] * 100:.4f}%",
+                             '' if np.isnan(xirr) else f"{xirr * 100:.2f}%"])
+
+def performance_main(start=None, end=None, watchlist_file='watchlist.csv', portfolio_file='portfolio.csv',
+                     transactions_file=TRANSACTIONS_FILE, report_file='performance_attribution.csv', daily_file=None):
+    """Rebuild the book from the ledger and print its realized performance"""
+    rows = read_csv_rows(watchlist_file)
+    table = load_portfolio_table(portfolio_file)
+    if not rows or table is None or table.missing('holdings'):
+        print(f"Error: {watchlist_file} and {portfolio_file} with a holdings column are required")
+        return None
+
+    ids = [row[1] if len(row) > 1 else '' for row in rows[1:]]
+    holdings_now = np.zeros(len(ids))
+    for i, asset_id in enumerate(ids):
+        row = table.row_of(asset_id)
+        if row is not None:
+            holdings_now[i] = np.nan_to_num(table['holdings'][row])
+
+    book = build_book(rows, holdings_now, *read_transactions(transactions_file))
+    if book['unplaced']:
+        print(f"Warning: {book['unplaced']} trades are for assets not in {watchlist_file} and were skipped")
+    if (book['holdings'] < -1e-9).any():
+        print(f"Warning: {transactions_file} sells more than portfolio.csv could have held; holdings go negative")
+
+    result = attribution(book, start, end)
+    if result is None:
+        print("Error: The window needs at least two price dates")
+        return None
+
+    print(f"{result['dates'][0]} ~ {result['dates'][-1]} ({len(result['dates'])} days)")
+    print(f"Value: {result['total'][0]:.2f} -> {result['total'][-1]:.2f}, net flows: {result['flows'].sum():.2f}")
+    print(f"Time-weighted return: {result['twr'] * 100:.2f}%")
+    print(f"Money-weighted return (XIRR, annual): {result['xirr'] * 100:.2f}%")
+
+    order = [i for i in np.argsort(-np.abs(result['asset_contribution'])) if result['held'][i]]
+    print(f"\n{'Asset':<30} {'P&L':>14} {'Contribution':>13} {'XIRR':>9}")
+    for i in order[:10]:
+        xirr = result['asset_xirr'][i]
+        print(f"{book['names'][i][:30]:<30} {result['asset_pnl'][i]:>14.2f} {result['asset_contribution'][i] * 100:>12.2f}% "
+              f"{'' if np.isnan(xirr) else f'{xirr * 100:.2f}%':>9}")
+
+    write_attribution_report(report_file, book, result)
+    print(f"\nAttribution written to {report_file}")
+    if daily_file:
+        write_daily_report(daily_file, result)
+        print(f"Daily TWR/XIRR written to {daily_file}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Realized TWR, XIRR and per-asset attribution from the transaction ledger")
+    parser.add_argument('--start', default=None, help="YYYY-MM-DD (default: first watchlist date)")
+    parser.add_argument('--end', default=None, help="YYYY-MM-DD (default: last watchlist date)")
+    parser.add_argument('--output', default='performance_attribution.csv')
+    parser.add_argument('--daily', default=None, help="also write TWR/XIRR to date for every day to this CSV")
+    args = parser.parse_args()
+    for value in (args.start, args.end):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+    performance_main(args.start, args.end, report_file=args.output, daily_file=args.daily)
+
+if __name__ == '__main__':
+    main()
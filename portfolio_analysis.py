@@ -2,6 +2,13 @@ import csv
 import math
 import logging
 from datetime import datetime
+import numpy as np
+from storage import atomic_open, read_csv_rows
+from portfolio_table import load_portfolio_table
+from sidecar import read_returns, write_correlation_sidecar, read_correlation_sidecar
+from parallel_stats import default_workers, parallel_correlation_matrix
+from clean_returns import cached_clean_returns
+from incremental_correlation import incremental_correlation
 
 # 设置日志记录
 # 创建logger
@@ -28,75 +35,75 @@ file_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 logger.addHandler(file_handler)
 
-def asset_correlation_analysis(percentage_change_file, output_file):
+def asset_correlation_analysis(percentage_change_file, output_file, workers=None, incremental=False, window=None):
     """
     资产相关性分析：读取percentage_change.csv中的数据，计算各个资产之间的相关性，
     得到一个相关性矩阵并储存在asset_correlationship.csv中
+    workers > 1 时使用进程池并行计算（见parallel_stats.py）
+    incremental=True 时由保存的充分统计量增量更新（见incremental_correlation.py），window为最近的交易日数
     """
     try:
-        # 读取percentage_change.csv数据
-        with open(percentage_change_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            rows = list(reader)
+        # 读取percentage_change.csv数据（优先使用二进制副本，否则逐行解析CSV；空值或无效值按0处理）
+        header, names, ids, _, all_returns = read_returns(percentage_change_file)
         
-        if not rows or len(rows) < 2:
+        if not names:
             logger.error("percentage_change.csv文件中没有足够的数据")
             return
+        raw_returns, all_returns = all_returns, np.nan_to_num(all_returns)
+        dates = [col[4:] if col.startswith('chg_') else col for col in header[3:]]
         
-        # 提取资产名称和收益率数据
-        headers = rows[0]
-        assets_data = {}
-        
-        # 获取日期列（从第4列开始）
-        date_columns = headers[3:]
-        
-        # 处理每个资产的数据
-        for row in rows[1:]:
-            asset_name = row[0]
-            # 提取收益率数据并转换为数值
-            returns = []
-            for i in range(3, len(row)):
-                if row[i]:  # 如果有数据
-                    try:
-                        # 移除%符号并转换为浮点数
-                        returns.append(float(row[i].rstrip('%')))
-                    except ValueError:
-                        # 如果转换失败，跳过该数据点
-                        returns.append(0.0)
-                else:
-                    returns.append(0.0)
-            assets_data[asset_name] = returns
-        
-        # 获取资产名称列表
-        asset_names = list(assets_data.keys())
+        # 获取资产名称列表，重复的资产名称以最后一行为准
+        last_row = {name: i for i, name in enumerate(names)}
+        asset_names = list(last_row.keys())
         
         # 计算相关性矩阵
         n_assets = len(asset_names)
-        correlation_matrix = [[0.0 for _ in range(n_assets)] for _ in range(n_assets)]
-        
-        # 计算每对资产之间的相关性
-        for i in range(n_assets):
-            for j in range(n_assets):
-                if i == j:
-                    # 同一资产的相关性为1
-                    correlation_matrix[i][j] = 1.0
-                else:
-                    # 计算两个资产收益率之间的相关性
-                    correlation = calculate_correlation(assets_data[asset_names[i]], assets_data[asset_names[j]])
-                    correlation_matrix[i][j] = correlation
+        cleaned = cached_clean_returns(percentage_change_file)
+        if incremental:
+            # 增量模式：只把新增的交易日和新增的资产计入保存的统计量，定期完整重算检查数值漂移
+            if cleaned is not None:
+                cleaned_row = {name: i for i, name in enumerate(cleaned['names'])}
+                returns_matrix = cleaned['returns'][[cleaned_row[name] for name in asset_names]]
+            else:
+                returns_matrix = raw_returns[[last_row[name] for name in asset_names]]
+            correlation_matrix, info = incremental_correlation(
+                asset_names, [ids[last_row[name]] for name in asset_names], dates, returns_matrix, window)
+            if info['mode'] == 'full':
+                logger.info(f"相关性统计量完整重算（{info['reason']}），{info['days']}个交易日")
+            else:
+                logger.info(f"相关性统计量增量更新：新增{info['added_days']}个交易日、{info['added_assets']}个资产，"
+                            f"移出{info['dropped_days']}个交易日，共{info['days']}个交易日")
+            if 'drift' in info:
+                logger.info(f"与完整重算的最大差异: {info['drift']:.2e}")
+        elif cleaned is not None:
+            # 使用clean_returns.py缓存的清洗后收益率矩阵，不再重新清洗；缺失数据按0处理，与原始数据的处理方式一致
+            logger.info(f"使用清洗后的收益率数据（{cleaned['params']['method']}，阈值{cleaned['params']['threshold']}）")
+            cleaned_row = {name: i for i, name in enumerate(cleaned['names'])}
+            returns_matrix = np.nan_to_num(cleaned['returns'])[[cleaned_row[name] for name in asset_names]]
+            correlation_matrix = parallel_correlation_matrix(returns_matrix, workers or 1)
+        else:
+            # 向量化计算（returns_matrix.correlation_matrix）；workers > 1 时收益率矩阵通过内存映射文件共享，各进程分块计算
+            returns_matrix = all_returns[[last_row[name] for name in asset_names]]
+            correlation_matrix = parallel_correlation_matrix(returns_matrix, workers or 1)
         
         # 将相关性矩阵写入asset_correlationship.csv
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        with atomic_open(output_file, 'w') as f:
             writer = csv.writer(f)
             
             # 写入表头
             header_row = [''] + asset_names
             writer.writerow(header_row)
             
-            # 写入相关性数据
+            # 写入相关性数据，同时保留写入后的数值用于二进制副本
+            written = np.empty((n_assets, n_assets))
             for i in range(n_assets):
-                data_row = [asset_names[i]] + [f"{correlation_matrix[i][j]:.4f}" for j in range(n_assets)]
+                data_row = [asset_names[i]] + [f"{value:.4f}" for value in correlation_matrix[i]]
                 writer.writerow(data_row)
+                written[i] = np.array(data_row[1:], dtype=float)
+        
+        # 以上三角形式保存二进制副本（asset_correlationship.npz），记录资产ID和日期
+        write_correlation_sidecar(output_file, asset_names, [ids[last_row[name]] for name in asset_names],
+                                  dates[-window:] if incremental and window else dates, written)
         
         logger.info(f"资产相关性分析完成，结果已保存到{output_file}")
         return correlation_matrix, asset_names
@@ -105,81 +112,31 @@ def asset_correlation_analysis(percentage_change_file, output_file):
         logger.error(f"资产相关性分析过程中出现错误: {e}")
         return None, None
 
-def calculate_correlation(returns1, returns2):
-    """
-    计算两个资产收益率序列之间的相关性
-    """
-    if len(returns1) != len(returns2) or len(returns1) == 0:
-        return 0.0
-    
-    n = len(returns1)
-    
-    # 计算平均值
-    mean1 = sum(returns1) / n
-    mean2 = sum(returns2) / n
-    
-    # 计算协方差和标准差
-    covariance = sum((returns1[i] - mean1) * (returns2[i] - mean2) for i in range(n))
-    variance1 = sum((returns1[i] - mean1) ** 2 for i in range(n))
-    variance2 = sum((returns2[i] - mean2) ** 2 for i in range(n))
-    
-    # 避免除零错误
-    if variance1 == 0 or variance2 == 0:
-        return 0.0
-    
-    # 计算相关性
-    correlation = covariance / (math.sqrt(variance1) * math.sqrt(variance2))
-    return correlation
-
 def portfolio_annual_return_analysis(portfolio_file):
     """
     资产组合年化收益分析：通过读取portfolio.csv中各个资产的percentage和年化收益率计算整个资产组合的年化收益率
     """
     try:
         # 读取portfolio.csv数据
-        with open(portfolio_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            rows = list(reader)
+        table = load_portfolio_table(portfolio_file)
         
-        if not rows or len(rows) < 2:
+        if table is None or len(table) < 1:
             logger.error("portfolio.csv文件中没有足够的数据")
             return None
         
-        # 找到相关列的索引
-        headers = rows[0]
-        percentage_index = -1
-        annual_return_index = -1
-        
-        for i, header in enumerate(headers):
-            if header == 'percentage':
-                percentage_index = i
-            elif header == 'annual_return':
-                annual_return_index = i
-        
-        if percentage_index == -1 or annual_return_index == -1:
+        if table.missing('percentage', 'annual_return'):
             logger.error("无法找到percentage或annual_return列")
             return None
         
-        # 计算资产组合的年化收益率
-        portfolio_return = 0.0
+        # 权重和年化收益率（百分比形式），无法转换的资产跳过
+        weights = table['percentage']
+        annual_returns = table['annual_return']
+        valid = ~(np.isnan(weights) | np.isnan(annual_returns))
+        for i in np.nonzero(~valid)[0]:
+            logger.warning(f"处理资产{table.names[i]}时出现数据转换错误: 缺少percentage或annual_return")
         
-        for row in rows[1:]:  # 跳过表头
-            try:
-                # 提取权重和年化收益率
-                weight_str = row[percentage_index].rstrip('%')
-                annual_return_str = row[annual_return_index].rstrip('%')
-                
-                weight = float(weight_str) / 100  # 转换为小数
-                annual_return = float(annual_return_str) / 100  # 转换为小数
-                
-                # 计算加权收益
-                portfolio_return += weight * annual_return
-            except ValueError as e:
-                logger.warning(f"处理资产{row[0]}时出现数据转换错误: {e}")
-                continue
-        
-        # 转换为百分比形式
-        portfolio_return_percentage = portfolio_return * 100
+        # 计算加权收益（结果为百分比形式）
+        portfolio_return_percentage = float(np.dot(weights[valid], annual_returns[valid]) / 100)
         
         logger.info(f"资产组合年化收益率分析完成: {portfolio_return_percentage:.2f}%")
         return portfolio_return_percentage
@@ -188,99 +145,129 @@ def portfolio_annual_return_analysis(portfolio_file):
         logger.error(f"资产组合年化收益分析过程中出现错误: {e}")
         return None
 
-def portfolio_risk_analysis(portfolio_file, correlation_file):
+def risk_contribution_breakdown(weights, risks, correlation_matrix):
+    """
+    风险分解：由一次 Σw 乘积得到组合风险以及各资产的边际风险贡献、风险贡献、
+    风险贡献占比、相对组合的beta和组合的分散化比率（weights、risks为小数）
+    """
+    # Σ = diag(σ)·ρ·diag(σ)，所以 Σw = σ * (ρ @ (w * σ))，不需要构造协方差矩阵
+    covariance_weights = risks * (correlation_matrix @ (weights * risks))
+    portfolio_variance = float(weights @ covariance_weights)
+    portfolio_risk = math.sqrt(max(portfolio_variance, 0.0))
+    
+    if portfolio_risk > 0:
+        # 边际风险贡献 ∂σ_p/∂w_i = (Σw)_i / σ_p，beta_i = (Σw)_i / σ_p²
+        marginal_risk = covariance_weights / portfolio_risk
+        beta = covariance_weights / portfolio_variance
+        diversification_ratio = float(weights @ risks) / portfolio_risk
+    else:
+        marginal_risk = np.zeros_like(weights)
+        beta = np.zeros_like(weights)
+        diversification_ratio = 0.0
+    
+    # 风险贡献之和等于组合风险
+    risk_contribution = weights * marginal_risk
+    return {
+        'portfolio_risk': portfolio_risk,
+        'marginal_risk': marginal_risk,
+        'risk_contribution': risk_contribution,
+        'risk_contribution_share': risk_contribution / portfolio_risk if portfolio_risk > 0 else np.zeros_like(weights),
+        'beta': beta,
+        'diversification_ratio': diversification_ratio,
+    }
+
+def write_risk_contribution_report(report_file, table, weights, risks, breakdown):
+    """
+    将各资产的风险分解写入报告文件（百分比形式），最后两行为组合风险和分散化比率
+    """
+    with atomic_open(report_file, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'weight', 'risk', 'marginal_risk', 'risk_contribution',
+                         'risk_contribution_pct', 'beta'])
+        for i in range(len(table)):
+            writer.writerow([
+                table.names[i],
+                table.ids[i],
+                f"{weights[i] * 100:.2f}%",
+                f"{risks[i] * 100:.2f}%",
+                f"{breakdown['marginal_risk'][i] * 100:.4f}%",
+                f"{breakdown['risk_contribution'][i] * 100:.4f}%",
+                f"{breakdown['risk_contribution_share'][i] * 100:.2f}%",
+                f"{breakdown['beta'][i]:.4f}",
+            ])
+        writer.writerow([])
+        writer.writerow(['portfolio_risk', f"{breakdown['portfolio_risk'] * 100:.4f}%"])
+        writer.writerow(['diversification_ratio', f"{breakdown['diversification_ratio']:.4f}"])
+
+def portfolio_risk_analysis(portfolio_file, correlation_file, report_file='risk_contribution.csv'):
     """
-    资产组合风险分析：通过读取portfolio.csv中各个资产的percentage，risk以及相关性矩阵计算整个资产组合的风险
+    资产组合风险分析：通过读取portfolio.csv中各个资产的percentage，risk以及相关性矩阵计算整个资产组合的风险，
+    并将各资产的边际风险贡献、风险贡献、beta和分散化比率写入report_file（为None时不写）
     """
     try:
         # 读取portfolio.csv数据
-        with open(portfolio_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            rows = list(reader)
+        table = load_portfolio_table(portfolio_file)
         
-        if not rows or len(rows) < 2:
+        if table is None or len(table) < 1:
             logger.error("portfolio.csv文件中没有足够的数据")
             return None
         
-        # 找到相关列的索引
-        headers = rows[0]
-        asset_names = []
-        weights = []
-        individual_risks = []
-        
-        percentage_index = -1
-        risk_index = -1
-        
-        for i, header in enumerate(headers):
-            if header == 'percentage':
-                percentage_index = i
-            elif header == 'risk':
-                risk_index = i
-        
-        if percentage_index == -1 or risk_index == -1:
+        if table.missing('percentage', 'risk'):
             logger.error("无法找到percentage或risk列")
             return None
         
-        # 提取资产名称、权重和个体风险
-        for row in rows[1:]:  # 跳过表头
-            try:
-                asset_names.append(row[0])
-                weight_str = row[percentage_index].rstrip('%')
-                risk_str = row[risk_index].rstrip('%')
-                
-                weight = float(weight_str) / 100  # 转换为小数
-                risk = float(risk_str) / 100  # 转换为小数
-                
-                weights.append(weight)
-                individual_risks.append(risk)
-            except ValueError as e:
-                logger.warning(f"处理资产{row[0]}时出现数据转换错误: {e}")
-                return None
-        
-        # 读取相关性矩阵
-        with open(correlation_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            correlation_rows = list(reader)
-        
-        if not correlation_rows or len(correlation_rows) < 2:
-            logger.error("相关性矩阵文件中没有足够的数据")
+        # 提取权重和个体风险并转换为小数
+        weights = table['percentage'] / 100
+        individual_risks = table['risk'] / 100
+        invalid = np.nonzero(np.isnan(weights) | np.isnan(individual_risks))[0]
+        if len(invalid):
+            logger.warning(f"处理资产{table.names[invalid[0]]}时出现数据转换错误: 缺少percentage或risk")
             return None
         
+        # 读取相关性矩阵：优先使用与CSV文件一致的二进制副本
+        sidecar = read_correlation_sidecar(correlation_file)
+        if sidecar is not None:
+            correlation_asset_names, _, _, correlation_matrix = sidecar
+        else:
+            correlation_rows = read_csv_rows(correlation_file)
+            
+            if not correlation_rows or len(correlation_rows) < 2:
+                logger.error("相关性矩阵文件中没有足够的数据")
+                return None
+            
+            correlation_asset_names = correlation_rows[0][1:]  # 跳过第一个空单元格
+            
+            # 提取相关性矩阵数据
+            correlation_matrix = []
+            for row in correlation_rows[1:]:  # 跳过表头
+                correlation_row = []
+                for i in range(1, len(row)):  # 跳过资产名称列
+                    try:
+                        correlation_row.append(float(row[i]))
+                    except ValueError:
+                        logger.warning(f"相关性矩阵中存在无效数据: {row[i]}")
+                        correlation_row.append(0.0)
+                correlation_matrix.append(correlation_row)
+            correlation_matrix = np.array(correlation_matrix)
+        
         # 验证资产名称是否匹配
-        correlation_asset_names = correlation_rows[0][1:]  # 跳过第一个空单元格
-        if correlation_asset_names != asset_names:
+        if correlation_asset_names != table.names:
             logger.error("portfolio.csv和相关性矩阵文件中的资产名称不匹配")
             return None
         
-        # 提取相关性矩阵数据
-        correlation_matrix = []
-        for row in correlation_rows[1:]:  # 跳过表头
-            correlation_row = []
-            for i in range(1, len(row)):  # 跳过资产名称列
-                try:
-                    correlation_row.append(float(row[i]))
-                except ValueError:
-                    logger.warning(f"相关性矩阵中存在无效数据: {row[i]}")
-                    correlation_row.append(0.0)
-            correlation_matrix.append(correlation_row)
-        
-        # 计算资产组合风险
+        # 计算资产组合风险及风险分解
         # 公式: σ_p = √(ΣΣ w_i * w_j * σ_i * σ_j * ρ_ij)
-        portfolio_variance = 0.0
-        
-        for i in range(len(weights)):
-            for j in range(len(weights)):
-                portfolio_variance += (
-                    weights[i] * weights[j] * 
-                    individual_risks[i] * individual_risks[j] * 
-                    correlation_matrix[i][j]
-                )
-        
-        # 计算标准差（风险）
-        portfolio_risk = math.sqrt(portfolio_variance)
+        breakdown = risk_contribution_breakdown(weights, individual_risks, correlation_matrix)
         
         # 转换为百分比形式
-        portfolio_risk_percentage = portfolio_risk * 100
+        portfolio_risk_percentage = breakdown['portfolio_risk'] * 100
+        
+        if report_file:
+            write_risk_contribution_report(report_file, table, weights, individual_risks, breakdown)
+            top = np.argsort(-breakdown['risk_contribution_share'])[:5]
+            logger.info("风险贡献最大的资产: " + ", ".join(
+                f"{table.names[i]} {breakdown['risk_contribution_share'][i] * 100:.2f}%" for i in top))
+            logger.info(f"分散化比率: {breakdown['diversification_ratio']:.4f}，风险分解已保存到{report_file}")
         
         logger.info(f"资产组合风险分析完成: {portfolio_risk_percentage:.2f}%")
         return portfolio_risk_percentage
@@ -289,14 +276,16 @@ def portfolio_risk_analysis(portfolio_file, correlation_file):
         logger.error(f"资产组合风险分析过程中出现错误: {e}")
         return None
 
-def portfolio_analysis():
+def portfolio_analysis(workers=None, incremental=False, window=None):
     """
     主函数：执行所有分析
     """
     logger.info("开始资产组合分析")
+    workers = workers or default_workers()
     
     # 1. 资产相关性分析
-    correlation_matrix, asset_names = asset_correlation_analysis('percentage_change.csv', 'asset_correlationship.csv')
+    correlation_matrix, asset_names = asset_correlation_analysis('percentage_change.csv', 'asset_correlationship.csv',
+                                                                 workers, incremental, window)
     
     # 2. 资产组合年化收益分析
     portfolio_return = portfolio_annual_return_analysis('portfolio.csv')
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from allocators import allocate, ALLOCATORS
+from portfolio_state import PortfolioState
+from portfolio_daemon import PortfolioDaemon
+from price_series import PRICE_SERIES, default_series
+
+# 设置日志记录
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(console_handler)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Upper bound on cached responses; the whole cache is dropped whenever the state version changes
+MAX_CACHE_ENTRIES = 256
+
+class HTTPError(Exception):
+    """Error with an HTTP status code, turned into a JSON error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+def run_optimization(ids, annual_returns, risks, correlation, weights, risk_free_rate, min_return, max_weight,
+                     method='max-sharpe'):
+    """Worker-process entry point: one of allocators.ALLOCATORS on plain arrays"""
+    weights, info = allocate(method, annual_returns, risks, correlation, weights, risk_free_rate, min_return, max_weight)
+    if not info['success']:
+        return {'success': False, 'method': method, 'message': info['message']}
+    return {
+        'success': True,
+        'method': method,
+        'annual_return': info['return'],
+        'risk': info['risk'],
+        'diversification_ratio': info['diversification_ratio'],
+        'max_risk_contribution': info['max_risk_contribution'],
+        'weights': {asset_id: round(float(w) * 100, 4) for asset_id, w in zip(ids, weights)},
+    }
+
+def _float_param(query, name, default=None):
+    """Read an optional float query parameter"""
+    values = query.get(name)
+    if not values or values[0] == '':
+        return default
+    try:
+        return float(values[0])
+    except ValueError:
+        raise HTTPError(400, f"Invalid value for {name}: {values[0]}")
+
+class PortfolioAPI:
+    """
+    Local JSON API over a PortfolioState.
+
+    GET /portfolio                      current holdings, values, weights, portfolio return/risk
+    GET /assets                         per-asset last price, annual return and risk
+    GET /assets/<id>                    one asset
+    GET /correlation?ids=a,b,c          correlation submatrix for the chosen assets
+    GET /optimize?method=&risk_free_rate=&min_return=&max_weight=
+                                        on-demand allocation; method is max-sharpe (default),
+                                        risk-parity, min-variance, max-diversification or hrp
+
+    Responses are cached per (path, query) and the cache is cleared whenever the
+    state version changes, i.e. when any underlying file changed. Optimizer
+    runs go to a process pool so they never block other clients, and identical
+    concurrent optimize requests share one run.
+    """
+
+    def __init__(self, state, workers=None):
+        self.state = state
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self._cache = {}
+        self._cache_version = None
+        self._inflight = {}
+
+    async def handle(self, method, path, query):
+        """Route a request and return (status, payload)"""
+        if method != 'GET':
+            raise HTTPError(405, "Only GET is supported")
+
+        loop = asyncio.get_running_loop()
+        # stat() on each request keeps the cache honest; re-parsing runs off the event loop
+        await loop.run_in_executor(None, self.state.refresh)
+        if self.state.version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = self.state.version
+
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        if key in self._cache:
+            return 200, self._cache[key]
+
+        if key in self._inflight:
+            payload = await asyncio.shield(self._inflight[key])
+        else:
+            future = loop.create_future()
+            self._inflight[key] = future
+            try:
+                payload = await self._dispatch(path, query)
+                future.set_result(payload)
+            except Exception as e:
+                future.set_exception(e)
+                # Mark retrieved so asyncio does not warn when no one else awaited it
+                future.exception()
+                raise
+            finally:
+                del self._inflight[key]
+
+        if self.state.version == self._cache_version:
+            if len(self._cache) >= MAX_CACHE_ENTRIES:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = payload
+        return 200, payload
+
+    async def _dispatch(self, path, query):
+        """Build the JSON payload for a path"""
+        parts = [p for p in path.split('/') if p]
+        if parts == ['portfolio']:
+            return self.state.portfolio_summary()
+        if parts == ['assets']:
+            return {'version': self.state.version, 'assets': self.state.asset_stats()}
+        if len(parts) == 2 and parts[0] == 'assets':
+            for asset in self.state.asset_stats():
+                if asset['id'] == parts[1]:
+                    return asset
+            raise HTTPError(404, f"Asset {parts[1]} not found")
+        if parts == ['correlation']:
+            ids = [i for i in ','.join(query.get('ids', [])).split(',') if i]
+            if not ids:
+                raise HTTPError(400, "ids parameter is required, e.g. /correlation?ids=161716,399001")
+            known, matrix = self.state.correlation_submatrix(ids)
+            return {'ids': known, 'missing': [i for i in ids if i not in known],
+                    'matrix': np.round(matrix, 4).tolist()}
+        if parts == ['optimize']:
+            return await self._optimize(query)
+        raise HTTPError(404, f"Unknown path {path}")
+
+    async def _optimize(self, query):
+        """Run the optimizer in the process pool on a snapshot of the state"""
+        risk_free_rate = _float_param(query, 'risk_free_rate', 0.02)
+        min_return = _float_param(query, 'min_return')
+        max_weight = _float_param(query, 'max_weight', 1.0)
+        method = query.get('method', ['max-sharpe'])[0] or 'max-sharpe'
+        if method not in ALLOCATORS:
+            raise HTTPError(400, f"Unknown method {method}, choose from {', '.join(ALLOCATORS)}")
+
+        s = self.state.snapshot()
+        if not s['ids']:
+            raise HTTPError(503, "No assets loaded")
+        _, weights = self.state.portfolio_values(s)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self.executor, run_optimization, s['ids'], s['annual_returns'], s['risks'],
+            s['correlation'], weights, risk_free_rate, min_return, max_weight, method)
+        result['version'] = s['version']
+        return result
+
+    async def serve_client(self, reader, writer):
+        """Handle one HTTP/1.1 connection (one request, then close)"""
+        status, payload = 500, {'error': 'Internal Server Error'}
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            # Drain headers; request bodies are not used
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            try:
+                method, target, _ = request_line.decode('latin1').split(' ', 2)
+            except ValueError:
+                raise HTTPError(400, "Malformed request line")
+            url = urlsplit(target)
+            status, payload = await self.handle(method.upper(), url.path, parse_qs(url.query))
+        except HTTPError as e:
+            status, payload = e.status, {'error': e.message}
+        except Exception as e:
+            logger.error(f"处理请求时出现错误: {e}")
+        finally:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    "Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n").encode('latin1')
+            try:
+                writer.write(head + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    def close(self):
+        """Shut down the worker pool"""
+        self.executor.shutdown(cancel_futures=True)
+
+async def serve(api, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Serve the API until cancelled"""
+    server = await asyncio.start_server(api.serve_client, host, port)
+    logger.info(f"API服务已启动: http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON API over portfolio analytics")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="processes used for optimizer runs")
+    parser.add_argument('--schedule', action='store_true',
+                        help="also run the daemon's scheduled price updates in this process")
+    parser.add_argument('--series', choices=PRICE_SERIES, default=default_series(),
+                        help="price series the returns and statistics are computed from")
+    args = parser.parse_args()
+
+    state = PortfolioState(series=args.series)
+    state.refresh()
+    daemon = None
+    if args.schedule:
+        daemon = PortfolioDaemon(state)
+        daemon.start()
+
+    api = PortfolioAPI(state, workers=args.workers)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        if daemon is not None:
+            daemon.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime
+from portfolio_state import PortfolioState
+from storage import read_csv_rows
+from update_prices import fetch_new_data, merge_into_watchlist
+from price_series import PRICE_SERIES, default_series
+
+# 设置日志记录
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(console_handler)
+
+# Fund NAVs are published in the evening, so funds are fetched once per trading day after this time
+FUND_REFRESH_TIME = '21:30'
+
+# Stocks and indices are refreshed every STOCK_REFRESH_INTERVAL seconds during trading sessions
+STOCK_REFRESH_INTERVAL = 15 * 60
+STOCK_TRADING_SESSIONS = [('09:30', '11:30'), ('13:00', '15:05')]
+
+# How often files are checked for changes made by other processes (buy_or_sell, add_portfolio, ...)
+STATE_REFRESH_INTERVAL = 30
+
+def _minutes(hhmm):
+    """Convert 'HH:MM' to minutes since midnight"""
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def in_trading_session(now):
+    """True if now falls inside a weekday stock trading session"""
+    if now.weekday() >= 5:
+        return False
+    minute = now.hour * 60 + now.minute
+    return any(_minutes(start) <= minute <= _minutes(end) for start, end in STOCK_TRADING_SESSIONS)
+
+def last_price_date(rows, asset_type):
+    """Latest header date for which any asset of asset_type has a price"""
+    header = rows[0]
+    items = [row for row in rows[1:] if len(row) > 2 and row[2] == asset_type]
+    for col in range(len(header) - 1, 2, -1):
+        if any(len(row) > col and row[col].strip() for row in items):
+            return header[col]
+    return None
+
+class PortfolioDaemon:
+    """
+    Keeps a PortfolioState hot and fetches new prices incrementally on a schedule.
+
+    Funds are fetched once per weekday after FUND_REFRESH_TIME, stocks every
+    STOCK_REFRESH_INTERVAL seconds during trading sessions. Each fetch only
+    requests dates from the last stored date onwards and merges them into the
+    watchlist, after which the state recomputes the affected rows.
+    """
+
+    def __init__(self, state=None, watchlist_file='watchlist.csv', sync_files=False):
+        self.state = state or PortfolioState(watchlist_file)
+        self.watchlist_file = watchlist_file
+        self.sync_files = sync_files
+        self._last_fund_refresh = None
+        self._last_stock_refresh = 0.0
+        self._last_state_refresh = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh_prices(self, asset_type):
+        """Fetch prices for one asset type from its last stored date up to today"""
+        rows = read_csv_rows(self.watchlist_file)
+        if not rows or len(rows) < 2:
+            logger.warning("watchlist中没有资产，跳过价格更新")
+            return False
+
+        start_date = last_price_date(rows, asset_type)
+        if start_date is None:
+            logger.warning(f"没有{asset_type}类型的历史价格，请先运行update_prices.py获取完整历史")
+            return False
+        end_date = datetime.now().strftime('%Y-%m-%d')
+
+        items = [row for row in rows[1:] if len(row) > 2 and row[2] == asset_type]
+        logger.info(f"增量更新{len(items)}个{asset_type}的价格: {start_date} ~ {end_date}")
+        new_data, adjusted_data = fetch_new_data(items, start_date, end_date)
+        if not new_data:
+            logger.info("没有获取到新的价格数据")
+            return False
+
+        merge_into_watchlist(self.watchlist_file, new_data, keep_existing_dates=True, adjusted_data=adjusted_data)
+        if self.sync_files:
+            self._sync_files()
+        return True
+
+    def _sync_files(self):
+        """Rewrite the derived CSV files so file-based tools see the new prices"""
+        from calculate_percentage_change import percentage_change_update
+        from update_portfolio import update_portfolio_main
+        percentage_change_update()
+        update_portfolio_main()
+
+    def refresh_state(self):
+        """Pick up file changes and log what was recomputed"""
+        start = time.perf_counter()
+        changed = self.state.refresh()
+        if changed:
+            elapsed = (time.perf_counter() - start) * 1000
+            logger.info(f"内存状态已更新({', '.join(changed)})，耗时{elapsed:.1f}ms，版本{self.state.version}")
+        return changed
+
+    def run_pending(self, now=None):
+        """Run every job that is due at now"""
+        now = now or datetime.now()
+        monotonic = time.monotonic()
+
+        if (now.weekday() < 5 and now.strftime('%H:%M') >= FUND_REFRESH_TIME
+                and self._last_fund_refresh != now.date()):
+            self._last_fund_refresh = now.date()
+            self._run_job(self.refresh_prices, 'fund')
+
+        if in_trading_session(now) and monotonic - self._last_stock_refresh >= STOCK_REFRESH_INTERVAL:
+            self._last_stock_refresh = monotonic
+            self._run_job(self.refresh_prices, 'stock')
+
+        if monotonic - self._last_state_refresh >= STATE_REFRESH_INTERVAL:
+            self._last_state_refresh = monotonic
+            self._run_job(self.refresh_state)
+
+    def _run_job(self, job, *args):
+        """Run a scheduled job; errors are logged so the daemon keeps running"""
+        try:
+            job(*args)
+        except Exception as e:
+            logger.error(f"定时任务{job.__name__}{args}出现错误: {e}")
+
+    def run_forever(self, poll_interval=5):
+        """Load the state and run scheduled jobs until stop() is called"""
+        self.refresh_state()
+        self._last_state_refresh = time.monotonic()
+        logger.info("服务已启动")
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(poll_interval)
+        logger.info("服务已停止")
+
+    def start(self):
+        """Run the scheduler in a background thread"""
+        self._thread = threading.Thread(target=self.run_forever, name='portfolio-daemon', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Ask the scheduler loop to exit"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep portfolio state in memory and refresh prices on a schedule")
+    parser.add_argument('--refresh-now', action='store_true', help="fetch fund and stock prices once at start-up")
+    parser.add_argument('--sync-files', action='store_true',
+                        help="rewrite percentage_change.csv and portfolio.csv after each price update")
+    parser.add_argument('--series', choices=PRICE_SERIES, default=default_series(),
+                        help="price series the in-memory returns and statistics are computed from")
+    args = parser.parse_args()
+
+    daemon = PortfolioDaemon(PortfolioState(series=args.series), sync_files=args.sync_files)
+    if args.refresh_now:
+        for asset_type in ('fund', 'stock'):
+            daemon._run_job(daemon.refresh_prices, asset_type)
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        logger.info("服务已停止")
+
+if __name__ == '__main__':
+    main()
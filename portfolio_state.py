@@ -0,0 +1,238 @@
+import os
+import threading
+import numpy as np
+from portfolio_table import load_portfolio_table
+from returns_matrix import (load_price_matrix, compute_returns, latest_prices,
+                            annual_return_and_risk, correlation_matrix, normalize_returns)
+from optimize_portfolio import calculate_portfolio_return, calculate_portfolio_risk
+from allocators import allocate
+from price_series import adjusted_file_for, adjusted_prices
+
+def file_signature(filename):
+    """(mtime, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class PortfolioState:
+    """
+    Hot in-memory copy of prices, returns, per-asset statistics, the correlation
+    matrix and the portfolio holdings.
+
+    refresh() re-reads only the files whose (mtime, size) changed and recomputes
+    only the derived arrays that depend on them. Published arrays are never
+    modified in place, so snapshot() can be used from other threads while a
+    refresh is running.
+
+    series='adjusted' computes returns and statistics from the adjusted price
+    store (see price_series.py); last prices are always the unit prices.
+    """
+
+    def __init__(self, watchlist_file='watchlist.csv', portfolio_file='portfolio.csv', series='unit'):
+        self.watchlist_file = watchlist_file
+        self.portfolio_file = portfolio_file
+        self.series = series
+        self.adjusted_file = adjusted_file_for(watchlist_file)
+        self._lock = threading.RLock()
+        self._watchlist_signature = None
+        self._portfolio_signature = None
+        # Bumped on every change; consumers use it to invalidate caches
+        self.version = 0
+
+        self.names, self.ids, self.types, self.dates = [], [], [], []
+        self.id_index = {}
+        self.prices = np.empty((0, 0))
+        self.return_prices = np.empty((0, 0))
+        self.returns = np.empty((0, 0))
+        self.last_prices = np.empty(0)
+        self.annual_returns = np.empty(0)
+        self.risks = np.empty(0)
+        self.correlation = np.empty((0, 0))
+
+        self.portfolio_table = None
+        self.holdings = np.empty(0)
+        self.holding_prices = np.empty(0)
+
+    def refresh(self):
+        """Reload changed files and recompute dependent state; returns the list of changed parts"""
+        changed = []
+        with self._lock:
+            signature = file_signature(self.watchlist_file)
+            if self.series == 'adjusted':
+                signature = (signature, file_signature(self.adjusted_file))
+            if signature != self._watchlist_signature:
+                previous_ids = self.ids
+                changed += self._reload_prices()
+                self._watchlist_signature = signature
+                if self.ids != previous_ids:
+                    # Holdings are aligned to watchlist rows, so realign them too
+                    self._portfolio_signature = None
+
+            # portfolio_file may be None when only the shared price statistics are wanted
+            signature = file_signature(self.portfolio_file) if self.portfolio_file else None
+            if self.portfolio_file and signature != self._portfolio_signature:
+                self._reload_portfolio()
+                self._portfolio_signature = signature
+                changed.append('portfolio')
+            elif not self.portfolio_file and len(self.holdings) != len(self.ids):
+                self.holdings = np.zeros(len(self.ids))
+                self.holding_prices = np.full(len(self.ids), np.nan)
+
+            if changed:
+                self.version += 1
+        return changed
+
+    def _reload_prices(self):
+        """Re-parse the watchlist and recompute only the rows whose prices changed"""
+        names, ids, types, dates, prices = load_price_matrix(self.watchlist_file)
+        return_prices = adjusted_prices(ids, dates, prices, self.adjusted_file) if self.series == 'adjusted' else prices
+
+        same_shape = (ids == self.ids and dates == self.dates and prices.shape == self.prices.shape)
+        if same_shape:
+            differs = ~((prices == self.prices) | (np.isnan(prices) & np.isnan(self.prices)))
+            differs |= ~((return_prices == self.return_prices) | (np.isnan(return_prices) & np.isnan(self.return_prices)))
+            changed_rows = np.nonzero(differs.any(axis=1))[0]
+            self.names, self.types = names, types
+            if len(changed_rows) == 0:
+                return []
+            if len(changed_rows) < len(ids) // 2:
+                self._update_rows(prices, return_prices, changed_rows)
+                return ['prices', 'returns', 'statistics', 'correlation']
+
+        # New dates or assets: the whole matrix is recomputed
+        self.names, self.ids, self.types, self.dates = names, ids, types, dates
+        self.id_index = {asset_id: i for i, asset_id in enumerate(ids)}
+        self.prices, self.return_prices = prices, return_prices
+        self.returns = compute_returns(return_prices)
+        self.last_prices = latest_prices(prices)
+        self.annual_returns, self.risks = annual_return_and_risk(self.returns)
+        self.correlation = correlation_matrix(self.returns)
+        return ['prices', 'returns', 'statistics', 'correlation']
+
+    def _update_rows(self, prices, return_prices, rows):
+        """Recompute returns, statistics and correlation rows/columns for the given assets"""
+        returns = self.returns.copy()
+        returns[rows] = compute_returns(return_prices[rows])
+
+        last_prices = self.last_prices.copy()
+        last_prices[rows] = latest_prices(prices[rows])
+
+        annual_returns, risks = self.annual_returns.copy(), self.risks.copy()
+        annual_returns[rows], risks[rows] = annual_return_and_risk(returns[rows])
+
+        # Only the rows and columns of changed assets depend on their returns
+        normalized = normalize_returns(returns)
+        block = normalized[rows] @ normalized.T
+        block[np.arange(len(rows)), rows] = 1.0
+        correlation = self.correlation.copy()
+        correlation[rows, :] = block
+        correlation[:, rows] = block.T
+
+        self.prices, self.return_prices, self.returns, self.last_prices = prices, return_prices, returns, last_prices
+        self.annual_returns, self.risks, self.correlation = annual_returns, risks, correlation
+
+    def _reload_portfolio(self):
+        """Re-read holdings and holding prices (NaN where missing), aligned with the watchlist rows"""
+        holdings = np.zeros(len(self.ids))
+        holding_prices = np.full(len(self.ids), np.nan)
+        table = load_portfolio_table(self.portfolio_file) if os.path.exists(self.portfolio_file) else None
+
+        if table is not None:
+            rows = [i for i, asset_id in enumerate(table.ids) if asset_id in self.id_index]
+            targets = [self.id_index[table.ids[i]] for i in rows]
+            if 'holdings' in table:
+                holdings[targets] = np.nan_to_num(table['holdings'][rows])
+            if 'holding_price' in table:
+                holding_prices[targets] = table['holding_price'][rows]
+
+        self.portfolio_table = table
+        self.holdings, self.holding_prices = holdings, holding_prices
+
+    def snapshot(self):
+        """Consistent view of the current arrays for use outside the lock"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'names': self.names,
+                'ids': self.ids,
+                'types': self.types,
+                'dates': self.dates,
+                'id_index': self.id_index,
+                'prices': self.prices,
+                'returns': self.returns,
+                'last_prices': self.last_prices,
+                'annual_returns': self.annual_returns,
+                'risks': self.risks,
+                'correlation': self.correlation,
+                'holdings': self.holdings,
+                'holding_prices': self.holding_prices,
+            }
+
+    def asset_stats(self):
+        """Per-asset latest price, annual return and risk (percent)"""
+        s = self.snapshot()
+        return [
+            {
+                'name': s['names'][i],
+                'id': s['ids'][i],
+                'type': s['types'][i],
+                'last_price': None if np.isnan(s['last_prices'][i]) else float(s['last_prices'][i]),
+                'annual_return': float(s['annual_returns'][i]),
+                'risk': float(s['risks'][i]),
+            }
+            for i in range(len(s['ids']))
+        ]
+
+    def portfolio_values(self, s=None):
+        """Total value and weight of each holding, computed like update_total_value/update_percentage"""
+        s = s or self.snapshot()
+        total_values = np.round(np.nan_to_num(s['last_prices']) * s['holdings'], 2)
+        total = total_values.sum()
+        weights = total_values / total if total else np.zeros_like(total_values)
+        return total_values, weights
+
+    def portfolio_summary(self):
+        """Current holdings with value, weight and the portfolio's annual return and risk"""
+        s = self.snapshot()
+        total_values, weights = self.portfolio_values(s)
+        # No earnings without a last price or cost basis, like update_holding_earnings
+        earnings = np.nan_to_num((s['last_prices'] - s['holding_prices']) * s['holdings'])
+        assets = [
+            {
+                'name': s['names'][i],
+                'id': s['ids'][i],
+                'type': s['types'][i],
+                'holdings': float(s['holdings'][i]),
+                'holding_price': None if np.isnan(s['holding_prices'][i]) else float(s['holding_prices'][i]),
+                'holding_earnings': round(float(earnings[i]), 2),
+                'total_value': float(total_values[i]),
+                'percentage': round(float(weights[i]) * 100, 2),
+            }
+            for i in range(len(s['ids']))
+        ]
+        return {
+            'version': s['version'],
+            'total_value': round(float(total_values.sum()), 2),
+            'annual_return': float(calculate_portfolio_return(weights, s['annual_returns'])) if len(weights) else 0.0,
+            'risk': float(calculate_portfolio_risk(weights, s['risks'], s['correlation'])) if len(weights) else 0.0,
+            'assets': assets,
+        }
+
+    def correlation_submatrix(self, ids):
+        """Correlation matrix restricted to the given asset ids (unknown ids are dropped)"""
+        s = self.snapshot()
+        known = [asset_id for asset_id in ids if asset_id in s['id_index']]
+        index = [s['id_index'][asset_id] for asset_id in known]
+        return known, s['correlation'][np.ix_(index, index)]
+
+    def optimize(self, risk_free_rate=0.02, min_return=None, max_weight=1.0, method='max-sharpe'):
+        """Weights (percent per asset id) from one of allocators.ALLOCATORS on the hot state, or None if it failed"""
+        s = self.snapshot()
+        _, weights = self.portfolio_values(s)
+        weights, info = allocate(method, s['annual_returns'], s['risks'], s['correlation'], weights,
+                                 risk_free_rate, min_return, max_weight)
+        if not info['success']:
+            return None
+        return {asset_id: float(w * 100) for asset_id, w in zip(s['ids'], weights)}
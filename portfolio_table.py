@@ -0,0 +1,142 @@
+import numpy as np
+from storage import read_csv_rows, write_csv_rows
+
+# Identity columns at the start of every portfolio row
+KEY_COLUMNS = ['name', 'id', 'type']
+
+# Numeric columns created by create_portfolio.py
+NUMERIC_COLUMNS = ['last_price', 'holdings', 'holding_price', 'holding_earnings',
+                   'total_value', 'percentage', 'annual_return', 'risk']
+
+# Columns stored as '12.34%'; their arrays hold the number in percent
+PERCENT_COLUMNS = {'percentage', 'annual_return', 'risk'}
+
+# How changed cells are written back, the same formats the update scripts have always used
+COLUMN_FORMATS = {
+    'last_price': str,
+    'holdings': str,
+    'holding_price': '{:.2f}'.format,
+    'holding_earnings': '{:.2f}'.format,
+    'total_value': '{:.2f}'.format,
+    'percentage': '{:.2f}%'.format,
+    'annual_return': '{:.2f}%'.format,
+    'risk': '{:.2f}%'.format,
+}
+
+def parse_cells(cells):
+    """Parse cells such as '12.5' or '3.20%' into a float64 array (NaN for empty or invalid cells)"""
+    values = np.full(len(cells), np.nan)
+    for i, cell in enumerate(cells):
+        if cell:
+            try:
+                values[i] = float(cell.rstrip('%'))
+            except ValueError:
+                pass
+    return values
+
+def format_cell(column, value):
+    """Format one value for column; NaN is written as 0 like the update scripts do for missing inputs"""
+    if np.isnan(value):
+        return '0%' if column in PERCENT_COLUMNS else '0'
+    return COLUMN_FORMATS.get(column, str)(float(value))
+
+class PortfolioTable:
+    """
+    portfolio.csv held as typed columns
+
+    `columns` maps column name -> position in the header (a BOM on the first
+    header cell is ignored) and `id_index` maps asset id -> row (first row if an
+    id appears twice). table['holdings'] is a float64 array with NaN for empty
+    or invalid cells; percent columns are in percent without the '%'.
+
+    Assign whole columns with table[column] = values or single rows with
+    set(); only changed cells are reformatted when the table is saved, every
+    other cell and any extra column is written back exactly as it was read.
+    """
+
+    def __init__(self, header, rows):
+        self.header = list(header)
+        self.columns = {name.lstrip('\ufeff'): i for i, name in enumerate(self.header)}
+        width = len(self.header)
+        self.rows = [row + [''] * (width - len(row)) for row in rows]
+        self.names = self.text('name')
+        self.ids = self.text('id')
+        self.types = self.text('type')
+        self.id_index = {}
+        for i, asset_id in enumerate(self.ids):
+            self.id_index.setdefault(asset_id, i)
+        self._values = {}
+        self._changed = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def missing(self, *columns):
+        """Names of the given columns that are not in the header"""
+        return [column for column in columns if column not in self.columns]
+
+    def text(self, column):
+        """Raw string cells of a column; name/id/type fall back to their standard positions"""
+        index = self.columns.get(column)
+        if index is None and column in KEY_COLUMNS:
+            index = KEY_COLUMNS.index(column)
+        if index is None:
+            return [''] * len(self.rows)
+        return [row[index] if index < len(row) else '' for row in self.rows]
+
+    def __getitem__(self, column):
+        """Typed values of a numeric column (parsed once, then cached)"""
+        if column not in self._values:
+            if column not in self.columns:
+                raise KeyError(f"Column '{column}' not found in portfolio")
+            self._values[column] = parse_cells(self.text(column))
+            self._changed[column] = np.zeros(len(self.rows), dtype=bool)
+        return self._values[column]
+
+    def __setitem__(self, column, values):
+        """Replace a whole numeric column"""
+        self.set(column, slice(None), values)
+
+    def set(self, column, rows, values):
+        """Set the values of column at rows (an index, index array, mask or slice)"""
+        current = self[column]
+        current[rows] = values
+        self._changed[column][rows] = True
+
+    def set_text(self, column, rows, texts):
+        """Set cells of column to preformatted strings, written back verbatim (e.g. prices copied from the watchlist)"""
+        index = self.columns[column]
+        values = self[column]
+        changed = self._changed[column]
+        for i, text in zip(rows, texts):
+            self.rows[i][index] = text
+            values[i] = parse_cells([text])[0]
+            changed[i] = False
+
+    def row_of(self, asset_id):
+        """Row of an asset id, or None if it is not in the portfolio"""
+        return self.id_index.get(asset_id)
+
+    def to_rows(self):
+        """Header and data rows as strings, with changed cells formatted for the CSV file"""
+        for column, changed in self._changed.items():
+            index = self.columns[column]
+            values = self._values[column]
+            for i in np.nonzero(changed)[0]:
+                self.rows[i][index] = format_cell(column, values[i])
+            changed[:] = False
+        return [self.header] + self.rows
+
+def load_portfolio_table(filename):
+    """Read a portfolio CSV file into a PortfolioTable (None if the file is empty); blank lines are dropped"""
+    rows = read_csv_rows(filename)
+    if not rows:
+        return None
+    return PortfolioTable(rows[0], [row for row in rows[1:] if any(cell.strip() for cell in row)])
+
+def save_portfolio_table(filename, table):
+    """Atomically write a PortfolioTable back in the portfolio CSV format"""
+    write_csv_rows(filename, table.to_rows())
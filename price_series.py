@@ -0,0 +1,126 @@
+import os
+import sys
+import numpy as np
+from storage import atomic_open, locked, read_csv_rows
+from returns_matrix import parse_price_rows, compute_returns
+
+# Price series a stage can compute returns from:
+#   unit     - the prices in watchlist.csv (unit NAV for funds, closes from efinance for stocks)
+#   adjusted - cumulative NAV (累计净值) for funds and forward-adjusted closes for stocks,
+#              which do not drop when a fund pays a distribution
+PRICE_SERIES = ['unit', 'adjusted']
+
+# Adjusted prices live next to the watchlist as an assets x dates float64 matrix
+ADJUSTED_FILE = 'adjusted_prices.npz'
+
+# PORTFOLIO_PRICE_SERIES=adjusted makes the return calculations use the adjusted series by default
+def default_series():
+    """Series from PORTFOLIO_PRICE_SERIES, or 'unit'"""
+    series = os.environ.get('PORTFOLIO_PRICE_SERIES', 'unit')
+    return series if series in PRICE_SERIES else 'unit'
+
+def adjusted_file_for(watchlist_file):
+    """Adjusted price store belonging to a watchlist file (same directory)"""
+    return os.path.join(os.path.dirname(watchlist_file), ADJUSTED_FILE)
+
+def read_adjusted_store(filename):
+    """(ids, dates, prices) from the adjusted price store; empty if it does not exist"""
+    if not os.path.exists(filename):
+        return [], [], np.empty((0, 0))
+    with locked(filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return data['ids'].tolist(), data['dates'].tolist(), data['prices']
+
+def write_adjusted_store(filename, ids, dates, prices):
+    """Atomically write the adjusted price store"""
+    with atomic_open(filename, 'wb') as f:
+        np.savez(f, ids=np.array(ids, dtype=str), dates=np.array(dates, dtype=str), prices=prices)
+
+def merge_adjusted(filename, adjusted_data):
+    """
+    Merge fetched adjusted prices ({id: {date: price}}) into the store
+
+    History is always kept: readers select the watchlist's ids and dates, so
+    dates dropped from the watchlist by a full re-fetch are simply not read.
+    """
+    if not adjusted_data:
+        return
+    with locked(filename, exclusive=True):
+        ids, dates, prices = read_adjusted_store(filename)
+        known = set(ids)
+        new_ids = ids + [asset_id for asset_id in adjusted_data if asset_id not in known]
+        new_dates = sorted(set(dates).union(*(data.keys() for data in adjusted_data.values())))
+        id_index = {asset_id: i for i, asset_id in enumerate(new_ids)}
+        date_index = {date: j for j, date in enumerate(new_dates)}
+
+        # Existing history moves to its columns in the widened matrix in one step
+        merged = np.full((len(new_ids), len(new_dates)), np.nan)
+        if len(ids) and len(dates):
+            merged[np.ix_(np.arange(len(ids)), [date_index[date] for date in dates])] = prices
+        for asset_id, data in adjusted_data.items():
+            row = merged[id_index[asset_id]]
+            for date, price in data.items():
+                try:
+                    row[date_index[date]] = float(price)
+                except ValueError:
+                    pass
+        write_adjusted_store(filename, new_ids, new_dates, merged)
+
+def adjusted_prices(ids, dates, unit_prices, filename=ADJUSTED_FILE):
+    """
+    Adjusted prices aligned with (ids, dates) of a watchlist
+
+    The store is gathered with one fancy-indexing step over precomputed id and
+    date positions. An asset only switches to the adjusted series when the
+    store covers every date it has a unit price for, since splicing the two
+    series would create a fake return at the seam; others (e.g. only fetched
+    incrementally since the store was added) keep their unit prices until
+    update_prices.py re-fetches their history, and a missing store gives the
+    unit series unchanged.
+    """
+    store_ids, store_dates, store_prices = read_adjusted_store(filename)
+    prices = np.array(unit_prices, dtype=float, copy=True)
+    if not store_ids:
+        return prices
+
+    id_index = {asset_id: i for i, asset_id in enumerate(store_ids)}
+    date_index = {date: j for j, date in enumerate(store_dates)}
+    rows = np.array([id_index.get(asset_id, -1) for asset_id in ids])
+    cols = np.array([date_index.get(date, -1) for date in dates])
+
+    # Pad with a NaN row and column so ids and dates missing from the store gather NaN
+    padded = np.full((len(store_ids) + 1, len(store_dates) + 1), np.nan)
+    padded[:-1, :-1] = store_prices
+    gathered = padded[np.ix_(rows, cols)] if len(rows) and len(cols) else np.empty(prices.shape)
+
+    if not gathered.size:
+        return prices
+    covered = ~np.isnan(gathered).all(axis=1) & ~(np.isnan(gathered) & ~np.isnan(prices)).any(axis=1)
+    prices[covered] = gathered[covered]
+    return prices
+
+def price_matrix(rows, series='unit', filename=ADJUSTED_FILE):
+    """parse_price_rows() for the chosen series: (names, ids, types, dates, prices)"""
+    if series not in PRICE_SERIES:
+        raise ValueError(f"Unknown price series {series}, choose from {', '.join(PRICE_SERIES)}")
+    names, ids, types, dates, prices = parse_price_rows(rows)
+    if series == 'adjusted':
+        prices = adjusted_prices(ids, dates, prices, filename)
+    return names, ids, types, dates, prices
+
+def distribution_report(watchlist_file='watchlist.csv'):
+    """Print the assets whose unit and adjusted returns differ, i.e. where the unit series is distorted"""
+    names, ids, _, dates, unit = parse_price_rows(read_csv_rows(watchlist_file))
+    adjusted = adjusted_prices(ids, dates, unit, adjusted_file_for(watchlist_file))
+    with np.errstate(invalid='ignore'):
+        gap = np.abs(compute_returns(adjusted) - compute_returns(unit)) * 100
+    gap = np.nan_to_num(gap)
+    affected = np.nonzero((gap > 0.01).any(axis=1))[0]
+    print(f"{len(affected)} of {len(ids)} assets have adjustment events")
+    for i in affected:
+        days = np.nonzero(gap[i] > 0.01)[0]
+        events = ', '.join(f"{dates[j + 1]} ({gap[i, j]:.2f}%)" for j in days[:5])
+        print(f"  {names[i]} ({ids[i]}): {len(days)} days, e.g. {events}")
+
+if __name__ == '__main__':
+    distribution_report(sys.argv[1] if len(sys.argv) > 1 else 'watchlist.csv')
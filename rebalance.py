@@ -0,0 +1,254 @@
+import argparse
+import csv
+import numpy as np
+from storage import atomic_open, read_csv_rows
+from portfolio_table import load_portfolio_table
+
+# Smallest tradable quantity per asset type: A-share stocks trade in board lots
+# of 100 shares, open-end fund units to 0.01
+LOT_SIZES = {'stock': 100, 'fund': 0.01}
+
+# Transaction cost per trade: a proportional rate with a minimum fee, by asset type
+COST_RATES = {'stock': 0.0003, 'fund': 0.0015}
+MIN_FEES = {'stock': 5.0, 'fund': 0.0}
+
+# Drift from the target weight (percentage points) tolerated before an asset is traded
+DEFAULT_TOLERANCE = 1.0
+
+# Trades whose cost is more than this share of the value they move back toward
+# the target are skipped, e.g. a 500-yuan band-edge trade paying a 5-yuan minimum fee
+MAX_COST_SHARE = 0.01
+
+# Batch file columns, in the same order as the buy_or_sell.py arguments
+BATCH_HEADER = ['operation', 'id', 'quantity', 'price']
+
+def _trade_costs(trade_values, cost_rates, min_fees):
+    return np.where(trade_values != 0, np.maximum(np.abs(trade_values) * cost_rates, min_fees), 0.0)
+
+def _economic(trade_values, costs, max_cost_share):
+    """Mask of trades worth their cost (no-trades included)"""
+    return costs <= np.abs(trade_values) * max_cost_share
+
+def _affordable_buys(lots, lot_sizes, prices, cost_rates, min_fees, budget, max_cost_share):
+    """
+    Buy units (candidates x assets) that fit each candidate's budget, costs included
+
+    Lots are rounded to the nearest lot while the buys fit; otherwise they
+    are rounded down, then scaled down together until they fit. A buy that
+    becomes uneconomic on the way is dropped.
+    """
+    scale = np.ones((len(lots), 1))
+    nearest = np.ones((len(lots), 1), dtype=bool)
+    for _ in range(50):
+        scaled = lots * scale
+        units = np.round(np.where(nearest, np.round(scaled), np.floor(scaled)) * lot_sizes, 8)
+        trade_values = units * prices
+        costs = _trade_costs(trade_values, cost_rates, min_fees)
+        keep = _economic(trade_values, costs, max_cost_share)
+        units, trade_values, costs = units * keep, trade_values * keep, costs * keep
+        spend = (trade_values + costs).sum(axis=1, keepdims=True)
+        over = spend > budget + 1e-9
+        if not over.any():
+            return units
+        scale = np.where(over & ~nearest, scale * np.clip(budget / spend, 0.0, 0.999), scale)
+        nearest &= ~over
+    # Whatever still does not fit after the iterations buys nothing
+    return np.where(over, 0.0, units)
+
+def evaluate_rebalances(holdings, prices, targets, tolerance=DEFAULT_TOLERANCE, lot_sizes=1.0,
+                        cost_rates=0.0, min_fees=0.0, cash=0.0, to_target=False,
+                        max_cost_share=MAX_COST_SHARE):
+    """
+    Plan the rebalance for many candidate targets at once
+
+    holdings, prices, lot_sizes, cost_rates and min_fees are per-asset arrays
+    (or scalars), targets is a candidates x assets matrix of target weights in
+    percent and tolerance a band in percentage points, one per candidate or
+    shared. cash is uninvested money counted in the portfolio value.
+
+    Only assets whose weight is outside target +/- tolerance are traded, and
+    only back to the nearest edge of the band (or to the target itself with
+    to_target=True), which is the smallest trade list that brings every asset
+    inside its band. Units are rounded to lot sizes and sells never exceed the
+    current holdings. Trades costing more than max_cost_share of their value
+    are skipped, and when cash is short buys are rounded down (and scaled back
+    if needed) so they and all costs are paid from cash plus the sale proceeds.
+
+    Returns candidates x assets arrays (units, trade_values, costs,
+    weights_after) and per-candidate arrays (turnover in percent of the
+    portfolio value, total_cost, net_cash, trades, max_drift).
+    """
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    holdings = np.nan_to_num(np.asarray(holdings, dtype=float))
+    prices = np.nan_to_num(np.asarray(prices, dtype=float))
+    lot_sizes = np.broadcast_to(np.asarray(lot_sizes, dtype=float), holdings.shape)
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=float), (len(targets),))[:, None]
+
+    values = holdings * prices
+    total = values.sum() + cash
+    weights = values / total * 100 if total else np.zeros_like(values)
+
+    drift = weights - targets
+    outside = np.abs(drift) > tolerance
+    goal = targets if to_target else targets + np.clip(drift, -tolerance, tolerance)
+    wanted = np.where(outside, (goal - weights) / 100 * total, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lots = np.where(prices > 0, wanted / prices / lot_sizes, 0.0)
+    units = np.round(np.round(lots) * lot_sizes, 8)
+    units = np.maximum(units, -holdings)
+    costs = _trade_costs(units * prices, cost_rates, min_fees)
+    units = np.where(_economic(units * prices, costs, max_cost_share), units, 0.0)
+
+    # Sells fund the buys: buy at most cash plus the proceeds net of the sell costs
+    sells = np.minimum(units, 0.0)
+    sell_values = sells * prices
+    budget = np.maximum(cash - (sell_values + _trade_costs(sell_values, cost_rates, min_fees)).sum(axis=1, keepdims=True), 0.0)
+    buys = _affordable_buys(np.where(units > 0, lots, 0.0), lot_sizes, prices, cost_rates, min_fees,
+                            budget, max_cost_share)
+    units = sells + buys
+
+    trade_values = units * prices
+    traded = units != 0
+    costs = _trade_costs(trade_values, cost_rates, min_fees)
+
+    values_after = values + trade_values
+    # Buys and sells only move money between assets and cash; costs leave the portfolio
+    total_after = total - costs.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights_after = np.where(total_after > 0, values_after / total_after * 100, 0.0)
+
+    return {
+        'units': units,
+        'trade_values': trade_values,
+        'costs': costs,
+        'weights_after': weights_after,
+        'turnover': np.abs(trade_values).sum(axis=1) / total * 100 if total else np.zeros(len(targets)),
+        'total_cost': costs.sum(axis=1),
+        # Cash released by the trades; never below -cash
+        'net_cash': -trade_values.sum(axis=1) - costs.sum(axis=1),
+        'trades': traded.sum(axis=1),
+        'max_drift': np.abs(weights_after - targets).max(axis=1) if targets.shape[1] else np.zeros(len(targets)),
+    }
+
+def asset_parameters(types):
+    """Per-asset lot sizes, cost rates and minimum fees from the asset types"""
+    lot_sizes = np.array([LOT_SIZES.get(t, 1.0) for t in types], dtype=float)
+    cost_rates = np.array([COST_RATES.get(t, 0.0) for t in types], dtype=float)
+    min_fees = np.array([MIN_FEES.get(t, 0.0) for t in types], dtype=float)
+    return lot_sizes, cost_rates, min_fees
+
+def plan_rebalance(table, targets, tolerance=DEFAULT_TOLERANCE, cash=0.0, to_target=False,
+                   max_cost_share=MAX_COST_SHARE):
+    """
+    Trade list that brings a portfolio table within tolerance of the target weights (percent, aligned with the rows)
+
+    Returns (trades, result): trades are dicts with operation, id, name,
+    quantity, price, value and cost, sells first so their proceeds fund the
+    buys; result is evaluate_rebalances() for this single candidate.
+    """
+    prices = np.nan_to_num(table['last_price'])
+    lot_sizes, cost_rates, min_fees = asset_parameters(table.types)
+    result = evaluate_rebalances(table['holdings'], prices, targets, tolerance,
+                                 lot_sizes, cost_rates, min_fees, cash, to_target, max_cost_share)
+
+    units, costs = result['units'][0], result['costs'][0]
+    trades = []
+    for i in np.nonzero(units)[0]:
+        trades.append({
+            'operation': 'buy' if units[i] > 0 else 'sell',
+            'id': table.ids[i],
+            'name': table.names[i],
+            'quantity': abs(float(units[i])),
+            'price': float(prices[i]),
+            'value': abs(float(units[i] * prices[i])),
+            'cost': float(costs[i]),
+        })
+    trades.sort(key=lambda trade: trade['operation'] != 'sell')
+    return trades, result
+
+def format_quantity(quantity):
+    """Quantity without trailing zeros, e.g. 300 or 12.5"""
+    return f"{quantity:.8f}".rstrip('0').rstrip('.')
+
+def write_batch_file(filename, trades):
+    """Write trades as a batch file for python buy_or_sell.py --batch"""
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(BATCH_HEADER)
+        for trade in trades:
+            writer.writerow([trade['operation'], trade['id'], format_quantity(trade['quantity']), trade['price']])
+
+def read_targets(filename, table):
+    """Target weights (percent) from a CSV file with id and percentage columns, aligned with the table rows"""
+    rows = read_csv_rows(filename)
+    header = [col.lstrip('\ufeff') for col in rows[0]] if rows else []
+    if 'id' not in header or 'percentage' not in header:
+        raise ValueError(f"{filename} needs 'id' and 'percentage' columns")
+    id_col, pct_col = header.index('id'), header.index('percentage')
+    targets = np.zeros(len(table))
+    for row in rows[1:]:
+        if len(row) > max(id_col, pct_col) and row[id_col] in table.id_index:
+            targets[table.id_index[row[id_col]]] = float(row[pct_col].rstrip('%') or 0)
+    return targets
+
+def print_trades(trades, result):
+    """Print the trade list and its totals"""
+    print(f"\n{'Operation':<10} {'ID':<10} {'Asset':<30} {'Quantity':>12} {'Price':>10} {'Value':>12} {'Cost':>8}")
+    print("-" * 98)
+    for trade in trades:
+        print(f"{trade['operation']:<10} {trade['id']:<10} {trade['name'][:30]:<30} {format_quantity(trade['quantity']):>12} "
+              f"{trade['price']:>10.4f} {trade['value']:>12.2f} {trade['cost']:>8.2f}")
+    print("-" * 98)
+    print(f"Trades: {int(result['trades'][0])}, turnover: {result['turnover'][0]:.2f}%, "
+          f"costs: {result['total_cost'][0]:.2f}, net cash: {result['net_cash'][0]:.2f}, "
+          f"max drift after: {result['max_drift'][0]:.2f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn target weights into a trade list for buy_or_sell.py --batch")
+    parser.add_argument('--targets', default=None, help="CSV with id,percentage columns (default: run the Sharpe optimizer)")
+    parser.add_argument('--tolerance', type=float, nargs='+', default=[DEFAULT_TOLERANCE],
+                        help="drift band in percentage points; extra values are compared against the first")
+    parser.add_argument('--to-target', action='store_true', help="trade back to the target instead of the band edge")
+    parser.add_argument('--cash', type=float, default=0.0, help="uninvested cash available for buys")
+    parser.add_argument('--max-cost-share', type=float, default=MAX_COST_SHARE,
+                        help="skip trades whose cost exceeds this share of their value, e.g. 0.01")
+    parser.add_argument('--risk-free-rate', type=float, default=0.0167)
+    parser.add_argument('--min-return', type=float, default=None)
+    parser.add_argument('--max-weight', type=float, default=0.10)
+    parser.add_argument('--output', default='rebalance_trades.csv')
+    args = parser.parse_args()
+
+    table = load_portfolio_table('portfolio.csv')
+    if table is None or table.missing('last_price', 'holdings'):
+        print("Error: portfolio.csv needs last_price and holdings columns")
+        return
+
+    if args.targets:
+        targets = read_targets(args.targets, table)
+    else:
+        from optimize_portfolio import optimized_sharpe_ratio
+        targets = np.array(optimized_sharpe_ratio(args.risk_free_rate, args.min_return, args.max_weight), dtype=float)
+    if len(targets) != len(table):
+        print("Error: Target weights do not match the assets in portfolio.csv")
+        return
+
+    trades, result = plan_rebalance(table, targets, args.tolerance[0], args.cash, args.to_target, args.max_cost_share)
+    print_trades(trades, result)
+
+    if len(args.tolerance) > 1:
+        # All bands are evaluated in one vectorized pass
+        lot_sizes, cost_rates, min_fees = asset_parameters(table.types)
+        candidates = evaluate_rebalances(table['holdings'], table['last_price'], np.tile(targets, (len(args.tolerance), 1)),
+                                         args.tolerance, lot_sizes, cost_rates, min_fees, args.cash, args.to_target,
+                                         args.max_cost_share)
+        print(f"\n{'Tolerance':>10} {'Trades':>7} {'Turnover':>9} {'Costs':>10} {'Net cash':>12} {'Max drift':>10}")
+        for k, tolerance in enumerate(args.tolerance):
+            print(f"{tolerance:>9.2f}% {int(candidates['trades'][k]):>7} {candidates['turnover'][k]:>8.2f}% "
+                  f"{candidates['total_cost'][k]:>10.2f} {candidates['net_cash'][k]:>12.2f} {candidates['max_drift'][k]:>9.2f}%")
+
+    write_batch_file(args.output, trades)
+    print(f"\n{len(trades)} trades written to {args.output}; apply with: python buy_or_sell.py --batch {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from storage import atomic_open
+from returns_matrix import annual_return_and_risk, correlation_matrix
+from clean_returns import load_returns
+from optimize_portfolio import (optimize_weights, read_portfolio_data, read_correlation_data,
+                                calculate_portfolio_return, calculate_portfolio_risk)
+from instrumentation import stage
+
+# Per-asset mean weight and confidence interval of the last resampled run
+REPORT_FILE = 'resampled_weights.csv'
+
+# Resamples each worker solves per task; successive resamples in a task warm-start from each other
+RESAMPLE_CHUNK = 8
+
+# Percentiles reported as the confidence interval of every weight
+CONFIDENCE = (5.0, 95.0)
+
+# Daily returns matrix of the current worker process, set once by _init_worker
+_returns = None
+
+def _init_worker(returns):
+    """Keep the returns matrix in the worker so tasks only carry seeds"""
+    global _returns
+    _returns = returns
+
+def bootstrap_columns(n_dates, rng, block=1):
+    """
+    Date columns for one bootstrap history of n_dates days
+
+    Days are drawn with replacement for all assets together, which keeps the
+    cross-asset correlation; block > 1 draws runs of consecutive days
+    (moving-block bootstrap) to keep some autocorrelation as well.
+    """
+    block = max(1, min(block, n_dates))
+    starts = rng.integers(0, n_dates - block + 1, size=-(-n_dates // block))
+    return (starts[:, None] + np.arange(block)).ravel()[:n_dates]
+
+def resample_inputs(returns, columns):
+    """Annual return, risk (percent) and correlation re-estimated from the resampled columns"""
+    sample = returns[:, columns]
+    annual_return, risk = annual_return_and_risk(sample)
+    return annual_return, risk, correlation_matrix(sample)
+
+def _solve_chunk(seeds, start_weights, risk_free_rate, min_return, max_weight, block, deadline=None):
+    """
+    Worker: optimize a chunk of resamples, each warm-started from the previous solution
+
+    Stops early once deadline (time.time() seconds) has passed. Returns
+    (weights, failures, solved) with one row of weights per successful resample.
+    """
+    returns = _returns
+    weights = []
+    failures = 0
+    solved = 0
+    current = np.asarray(start_weights, dtype=float)
+    for seed in seeds:
+        if deadline is not None and time.time() >= deadline:
+            break
+        solved += 1
+        rng = np.random.default_rng(seed)
+        annual_return, risk, corr = resample_inputs(returns, bootstrap_columns(returns.shape[1], rng, block))
+        result = optimize_weights(annual_return, risk, corr, current, risk_free_rate, min_return, max_weight)
+        if result.success:
+            w = np.clip(result.x, 0.0, None)
+            w = w / w.sum() if w.sum() > 0 else w
+            weights.append(w)
+            current = w
+        else:
+            failures += 1
+    return weights, failures, solved
+
+def resampled_weights(returns, start_weights, risk_free_rate=0.02, min_return=None, max_weight=1.0,
+                      max_resamples=500, time_budget=None, workers=None, block=1, seed=0):
+    """
+    Michaud-style resampled efficient weights
+
+    returns is the assets x dates matrix of daily decimal returns. Each
+    resample bootstraps the history, re-estimates annual return, risk and
+    correlation and solves the max-Sharpe problem; the weights are averaged.
+
+    Resamples run in chunks of RESAMPLE_CHUNK across a process pool. With a
+    time_budget (seconds) chunks are only submitted while the measured time
+    per resample says the work in flight will finish within the budget,
+    workers stop between resamples at the deadline and chunks still queued
+    then are cancelled, so the number of resamples scales with the machine.
+
+    Returns (mean_weights, info): info holds the resample weights matrix,
+    percentile bounds (CONFIDENCE), std, resamples, failures and seconds.
+    """
+    started = time.perf_counter()
+    deadline = time.time() + time_budget if time_budget is not None else None
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).generate_state(max_resamples, dtype=np.uint64)
+    chunks = [seeds[k:k + RESAMPLE_CHUNK] for k in range(0, max_resamples, RESAMPLE_CHUNK)]
+    args = (start_weights, risk_free_rate, min_return, max_weight, block, deadline)
+
+    weights, failures, done = [], 0, 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(returns,)) as pool:
+        pending = {}
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            # Keep every worker busy as long as the budget allows another chunk. done / elapsed
+            # is already the pool's throughput, so the work in flight takes queued * per_resample
+            elapsed = time.perf_counter() - started
+            per_resample = elapsed / done if done else None
+            while next_chunk < len(chunks) and len(pending) < workers:
+                if time_budget is not None:
+                    if elapsed >= time_budget:
+                        break
+                    if per_resample is not None:
+                        queued = sum(len(chunks[k]) for k in pending.values())
+                        if elapsed + (queued + len(chunks[next_chunk])) * per_resample > time_budget:
+                            break
+                future = pool.submit(_solve_chunk, chunks[next_chunk], *args)
+                pending[future] = next_chunk
+                next_chunk += 1
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pending.pop(future)
+                if future.cancelled():
+                    continue
+                chunk_weights, chunk_failures, solved = future.result()
+                done += solved
+                weights += chunk_weights
+                failures += chunk_failures
+            if time_budget is not None and time.perf_counter() - started >= time_budget:
+                # Out of time: submit nothing new and drop chunks that have not started
+                next_chunk = len(chunks)
+                for future in list(pending):
+                    if future.cancel():
+                        pending.pop(future)
+
+    matrix = np.array(weights) if weights else np.empty((0, len(start_weights)))
+    mean = matrix.mean(axis=0) if len(matrix) else np.asarray(start_weights, dtype=float)
+    low, high = (np.percentile(matrix, CONFIDENCE, axis=0) if len(matrix)
+                 else (np.full(len(mean), np.nan), np.full(len(mean), np.nan)))
+    return mean, {
+        'weights': matrix,
+        'low': low,
+        'high': high,
+        'std': matrix.std(axis=0) if len(matrix) else np.full(len(mean), np.nan),
+        'resamples': len(matrix),
+        'failures': failures,
+        'seconds': time.perf_counter() - started,
+    }
+
+def write_resampled_report(filename, names, ids, point_weights, mean, info):
+    """Point-estimate weight, resampled mean, std and confidence interval of every asset (percent)"""
+    low_label, high_label = (f"p{int(q)}" for q in CONFIDENCE)
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'point_estimate', 'resampled_mean', 'std', low_label, high_label])
+        for i, name in enumerate(names):
+            writer.writerow([name, ids[i], f"{point_weights[i] * 100:.2f}", f"{mean[i] * 100:.2f}",
+                             f"{info['std'][i] * 100:.2f}", f"{info['low'][i] * 100:.2f}", f"{info['high'][i] * 100:.2f}"])
+
+def resampled_sharpe_ratio(risk_free_rate=0.02, min_return=None, max_weight=1.0, max_resamples=500,
+                           time_budget=None, workers=None, block=1, seed=0, report_file=REPORT_FILE):
+    """
+    Resampled max-Sharpe weights for portfolio.csv
+
+    The point-estimate solution (portfolio.csv and asset_correlationship.csv,
+    as optimized_sharpe_ratio) is the warm start for every resample; the
+    histories are bootstrapped from percentage_change.csv.
+
+    Returns:
+    list: Resampled percentage vector
+    """
+    with stage('read_portfolio_data'):
+        names, ids, percentages, annual_returns, risks = read_portfolio_data('portfolio.csv')
+    with stage('read_correlation_data'):
+        asset_names, corr = read_correlation_data('asset_correlationship.csv')
+    with stage('load_returns'):
+        data = load_returns('percentage_change.csv')
+
+    if not names or not asset_names or data is None:
+        print("Error: portfolio.csv, asset_correlationship.csv and percentage_change.csv are required")
+        return percentages
+    row = {asset_id: i for i, asset_id in enumerate(data['ids'])}
+    missing = [name for name, asset_id in zip(names, ids) if asset_id not in row]
+    if missing:
+        print(f"Error: no return history in percentage_change.csv for {', '.join(missing)}")
+        return percentages
+    returns = data['returns'][[row[asset_id] for asset_id in ids]] / 100
+
+    current = np.array(percentages) / 100.0
+    with stage('optimize_weights', n_assets=len(current)):
+        result = optimize_weights(np.array(annual_returns), np.array(risks), corr, current,
+                                  risk_free_rate, min_return, max_weight)
+    point = result.x if result.success else current
+    if not result.success:
+        print(f"Point-estimate optimization failed ({result.message}), resampling from the current weights")
+
+    with stage('resampled_weights', n_assets=len(current), max_resamples=max_resamples) as metrics:
+        mean, info = resampled_weights(returns, point, risk_free_rate, min_return, max_weight,
+                                       max_resamples, time_budget, workers, block, seed)
+        metrics.set(resamples=info['resamples'], failures=info['failures'])
+
+    if not info['resamples']:
+        print("Resampled optimization failed: no resample could be solved")
+        return percentages
+
+    print(f"\n{info['resamples']} resamples solved ({info['failures']} infeasible) in {info['seconds']:.1f}s")
+    interval = f"{CONFIDENCE[0]:g}-{CONFIDENCE[1]:g}% interval"
+    print(f"{'Asset':<30} {'Point (%)':>10} {'Mean (%)':>10} {interval:>22}")
+    for i, name in enumerate(names):
+        bounds = f"{info['low'][i] * 100:.2f} - {info['high'][i] * 100:.2f}"
+        print(f"{name:<30} {point[i] * 100:>10.2f} {mean[i] * 100:>10.2f} {bounds:>22}")
+    write_resampled_report(report_file, names, ids, point, mean, info)
+    print(f"Weights and confidence intervals written to {report_file}")
+
+    returns_pct, risks_pct = np.array(annual_returns), np.array(risks)
+    portfolio_return = calculate_portfolio_return(mean, returns_pct)
+    portfolio_risk = calculate_portfolio_risk(mean, risks_pct, corr)
+    print(f"\nResampled Portfolio Metrics:")
+    print(f"Annual Return: {portfolio_return:.2f}%")
+    print(f"Risk (Standard Deviation): {portfolio_risk:.2f}%")
+    if portfolio_risk:
+        print(f"Sharpe Ratio: {(portfolio_return - risk_free_rate * 100) / portfolio_risk:.4f}")
+    return [w * 100 for w in mean]
@@ -0,0 +1,156 @@
+import numpy as np
+from storage import iter_csv_rows, line_count
+
+# Trading days per year used to annualize daily statistics
+TRADING_DAYS = 252
+
+# Rows per block when building the correlation matrix; serial and parallel runs
+# use the same blocks so their results are bit-for-bit identical
+CORRELATION_BLOCK = 256
+
+def parse_price_rows(rows):
+    """
+    Convert watchlist rows into (names, ids, types, dates, prices)
+
+    prices is an assets x dates float64 array with NaN for empty cells.
+    """
+    if not rows:
+        return [], [], [], [], np.empty((0, 0))
+
+    dates = rows[0][3:]
+    names, ids, types = [], [], []
+    prices = np.full((len(rows) - 1, len(dates)), np.nan)
+
+    for i, row in enumerate(rows[1:]):
+        names.append(row[0] if len(row) > 0 else '')
+        ids.append(row[1] if len(row) > 1 else '')
+        types.append(row[2] if len(row) > 2 else '')
+        parse_cells(row[3:], len(dates), prices[i])
+
+    return names, ids, types, dates, prices
+
+def parse_cells(cells, width, out, strip=''):
+    """Parse one row of numeric cells into out[:width] (NaN stays for empty or invalid cells)"""
+    for j, value in enumerate(cells[:width]):
+        if value:
+            try:
+                out[j] = float(value.rstrip(strip) if strip else value)
+            except ValueError:
+                pass
+
+def stream_matrix(filename, strip=''):
+    """
+    Read a name,id,type,<values...> CSV file one row at a time into a preallocated matrix
+
+    Memory is the float64 matrix plus a single row of strings, instead of
+    every cell as a Python string. strip='%' parses percentage_change.csv
+    cells. Returns (header, names, ids, types, matrix) with NaN for empty
+    cells; the width is set by the header.
+    """
+    rows = iter_csv_rows(filename)
+    header = next(rows, None)
+    if header is None:
+        return [], [], [], [], np.empty((0, 0))
+    width = max(len(header) - 3, 0)
+    # Every row ends with a newline, so the line count bounds the row count
+    matrix = np.full((max(line_count(filename) - 1, 0), width), np.nan)
+    names, ids, types = [], [], []
+    for i, row in enumerate(rows):
+        names.append(row[0] if len(row) > 0 else '')
+        ids.append(row[1] if len(row) > 1 else '')
+        types.append(row[2] if len(row) > 2 else '')
+        parse_cells(row[3:], width, matrix[i], strip)
+    return header, names, ids, types, matrix[:len(names)]
+
+def load_price_matrix(filename):
+    """Read a watchlist-format CSV file into a price matrix, streaming (same result as parse_price_rows)"""
+    header, names, ids, types, prices = stream_matrix(filename)
+    return names, ids, types, header[3:], prices
+
+def compute_returns(prices):
+    """
+    Daily returns in decimal form between consecutive date columns
+
+    Matches calculate_percentage_change: a change is NaN when either price is
+    missing or the previous price is 0.
+    """
+    if prices.shape[1] < 2:
+        return np.empty((prices.shape[0], 0))
+    prev = prices[:, :-1]
+    curr = prices[:, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = curr / prev - 1.0
+    returns[prev == 0] = np.nan
+    return returns
+
+def latest_prices(prices):
+    """Most recent non-empty price per asset (NaN if the asset has none)"""
+    valid = ~np.isnan(prices)
+    has_any = valid.any(axis=1)
+    # Index of the last valid column in each row
+    last_index = prices.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    result = np.full(prices.shape[0], np.nan)
+    rows = np.nonzero(has_any)[0]
+    result[rows] = prices[rows, last_index[rows]]
+    return result
+
+def annual_return_and_risk(returns):
+    """
+    Annualized compound return and volatility per asset, both in percent
+
+    Same definitions as update_annual_return_and_risk: only days with data are
+    counted, the return is compounded to TRADING_DAYS/n and the risk is the
+    sample standard deviation scaled by sqrt(TRADING_DAYS). Assets without
+    data get 0.
+    """
+    valid = ~np.isnan(returns)
+    n_days = valid.sum(axis=1)
+    filled = np.where(valid, returns, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        cumulative = np.prod(1.0 + filled, axis=1)
+        annual_return = np.where(n_days > 0, (cumulative ** (TRADING_DAYS / np.maximum(n_days, 1)) - 1) * 100, 0.0)
+
+        mean = filled.sum(axis=1) / np.maximum(n_days, 1)
+        deviations = np.where(valid, returns - mean[:, None], 0.0)
+        variance = (deviations ** 2).sum(axis=1) / np.maximum(n_days - 1, 1)
+        risk = np.where(n_days > 1, np.sqrt(variance) * np.sqrt(TRADING_DAYS) * 100, 0.0)
+
+    return annual_return, risk
+
+def normalize_returns(returns):
+    """
+    Center and scale each asset's returns so that Z @ Z.T is the correlation matrix
+
+    Missing returns count as 0; assets with zero variance become all-zero rows.
+    """
+    filled = np.where(np.isnan(returns), 0.0, returns)
+    if filled.shape[1]:
+        filled = filled - filled.mean(axis=1, keepdims=True)
+    std = np.sqrt((filled ** 2).sum(axis=1))
+    normalized = np.zeros_like(filled)
+    nonzero = std > 0
+    normalized[nonzero] = filled[nonzero] / std[nonzero, None]
+    return normalized
+
+def correlation_block(normalized, start, stop):
+    """Rows start:stop of the correlation matrix, with the diagonal set to 1"""
+    block = normalized[start:stop] @ normalized.T
+    rows = np.arange(start, stop)
+    block[rows - start, rows] = 1.0
+    return block
+
+def correlation_matrix(returns):
+    """
+    Pairwise correlation of daily returns, as computed by asset_correlation_analysis
+
+    Missing returns count as 0 and assets with zero variance get correlation 0
+    with everything else; the diagonal is always 1.
+    """
+    normalized = normalize_returns(returns)
+    n = normalized.shape[0]
+    correlation = np.empty((n, n))
+    for start in range(0, n, CORRELATION_BLOCK):
+        stop = min(start + CORRELATION_BLOCK, n)
+        correlation[start:stop] = correlation_block(normalized, start, stop)
+    return correlation
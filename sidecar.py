@@ -0,0 +1,78 @@
+import os
+import numpy as np
+from storage import atomic_open
+from returns_matrix import stream_matrix
+
+# Binary copies of percentage_change.csv and asset_correlationship.csv, written
+# next to them (percentage_change.npz, asset_correlationship.npz). A sidecar is
+# only used while the CSV it was written with is unchanged; otherwise readers
+# fall back to parsing the CSV.
+SIDECAR_DTYPES = ['float64', 'float32']
+
+def default_dtype():
+    """Sidecar float type from PORTFOLIO_SIDECAR_DTYPE; float64 gives exactly the CSV values"""
+    dtype = os.environ.get('PORTFOLIO_SIDECAR_DTYPE', 'float64')
+    return dtype if dtype in SIDECAR_DTYPES else 'float64'
+
+def sidecar_file(csv_file):
+    """percentage_change.csv -> percentage_change.npz"""
+    return os.path.splitext(csv_file)[0] + '.npz'
+
+def _signature(filename):
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+def _load_current(csv_file, kind):
+    """The sidecar's arrays if it was written for the current contents of csv_file, else None"""
+    path = sidecar_file(csv_file)
+    if not os.path.exists(path) or not os.path.exists(csv_file):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        if str(data['kind']) != kind or data['source'].tolist() != _signature(csv_file):
+            return None
+        return {key: data[key] for key in data.files}
+
+def write_returns_sidecar(csv_file, header, names, ids, types, returns, dtype=None):
+    """Store the returns matrix (percent, NaN for missing) of a percentage_change.csv that was just written"""
+    with atomic_open(sidecar_file(csv_file), 'wb', backup=False) as f:
+        np.savez(f, kind=np.array('returns'), returns=np.asarray(returns, dtype=dtype or default_dtype()),
+                 header=np.array(header, dtype=str), names=np.array(names, dtype=str),
+                 ids=np.array(ids, dtype=str), types=np.array(types, dtype=str),
+                 source=np.array(_signature(csv_file), dtype=np.int64))
+
+def read_returns_sidecar(csv_file):
+    """(header, names, ids, types, returns) from the sidecar of csv_file, or None when it is missing or stale"""
+    data = _load_current(csv_file, 'returns')
+    if data is None:
+        return None
+    return (data['header'].tolist(), data['names'].tolist(), data['ids'].tolist(), data['types'].tolist(),
+            data['returns'].astype(np.float64, copy=False))
+
+def read_returns(csv_file):
+    """(header, names, ids, types, returns) of a percentage_change.csv: the sidecar when current, else streamed from the CSV"""
+    return read_returns_sidecar(csv_file) or stream_matrix(csv_file, strip='%')
+
+def write_correlation_sidecar(csv_file, names, ids, dates, matrix, dtype=None):
+    """
+    Store a correlation matrix CSV that was just written as its upper triangle
+
+    ids and dates record which assets and return dates the matrix was computed from.
+    """
+    matrix = np.asarray(matrix)
+    upper = matrix[np.triu_indices(len(matrix))]
+    with atomic_open(sidecar_file(csv_file), 'wb', backup=False) as f:
+        np.savez(f, kind=np.array('correlation'), upper=upper.astype(dtype or default_dtype()),
+                 names=np.array(names, dtype=str), ids=np.array(ids, dtype=str), dates=np.array(dates, dtype=str),
+                 source=np.array(_signature(csv_file), dtype=np.int64))
+
+def read_correlation_sidecar(csv_file):
+    """(names, ids, dates, matrix) from the sidecar of csv_file, or None when it is missing or stale"""
+    data = _load_current(csv_file, 'correlation')
+    if data is None:
+        return None
+    n = len(data['names'])
+    rows, cols = np.triu_indices(n)
+    matrix = np.empty((n, n))
+    matrix[rows, cols] = data['upper']
+    matrix[cols, rows] = data['upper']
+    return data['names'].tolist(), data['ids'].tolist(), data['dates'].tolist(), matrix
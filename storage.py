@@ -0,0 +1,207 @@
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from instrumentation import count
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Number of previous versions kept next to each file as <file>.bak.1 ... <file>.bak.N
+BACKUP_GENERATIONS = 3
+
+# Seconds to wait for another process to release a lock before giving up
+LOCK_TIMEOUT = 120
+
+# Locks held by the current thread: path -> [lock file object, exclusive, depth]
+_held = threading.local()
+
+def _lock_path(filename):
+    """Return the advisory lock file used for filename"""
+    return os.path.abspath(filename) + '.lock'
+
+def _try_lock(f, exclusive):
+    """Try to take the OS lock on an open lock file without blocking"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        else:
+            # msvcrt only has exclusive byte-range locks, so readers serialize as well
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _unlock(f):
+    """Release the OS lock on an open lock file"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def locked(filename, exclusive=False, timeout=LOCK_TIMEOUT):
+    """
+    Hold an advisory lock on filename for the duration of the block.
+
+    Shared locks allow concurrent readers, exclusive locks are taken by writers
+    and by read-modify-write sequences. Locks are re-entrant within a thread,
+    so a function holding the exclusive lock can call read_csv_rows/write_csv_rows.
+    A shared lock cannot be upgraded: flock drops it before taking the
+    exclusive one, and two processes upgrading at once would wait on each
+    other until the timeout. Take the exclusive lock up front instead.
+    """
+    if not hasattr(_held, 'locks'):
+        _held.locks = {}
+    path = _lock_path(filename)
+    entry = _held.locks.get(path)
+
+    if entry is not None:
+        # Already held by this thread; an exclusive lock also covers shared use
+        if exclusive and not entry[1]:
+            raise RuntimeError(f"Shared lock on {filename} cannot be upgraded to exclusive; "
+                               f"take the exclusive lock before reading")
+        entry[2] += 1
+        try:
+            yield
+        finally:
+            entry[2] -= 1
+        return
+
+    f = open(path, 'a+')
+    try:
+        _acquire(f, exclusive, timeout, filename)
+    except Exception:
+        f.close()
+        raise
+    _held.locks[path] = [f, exclusive, 1]
+    try:
+        yield
+    finally:
+        del _held.locks[path]
+        try:
+            _unlock(f)
+        finally:
+            f.close()
+
+def _acquire(f, exclusive, timeout, filename):
+    """Block until the lock is taken or timeout expires"""
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while not _try_lock(f, exclusive):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out waiting for lock on {filename}")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+def _fsync_directory(directory):
+    """Flush a directory entry so a rename survives a crash (no-op where unsupported)"""
+    if fcntl is None:
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def rotate_backups(filename, generations=BACKUP_GENERATIONS):
+    """Shift <file>.bak.N generations and keep the current file as <file>.bak.1"""
+    if generations <= 0 or not os.path.exists(filename):
+        return
+    for n in range(generations, 1, -1):
+        older = f"{filename}.bak.{n - 1}"
+        if os.path.exists(older):
+            os.replace(older, f"{filename}.bak.{n}")
+    newest = f"{filename}.bak.1"
+    if os.path.exists(newest):
+        os.remove(newest)
+    try:
+        # A hard link keeps the old inode alive once the new file is renamed over it
+        os.link(filename, newest)
+    except OSError:
+        shutil.copy2(filename, newest)
+
+@contextmanager
+def atomic_open(filename, mode='w', encoding='utf-8', newline='', backup=True):
+    """
+    Open a temporary file next to filename and rename it over filename on success.
+
+    The data is fsynced before the rename, so readers see either the complete old
+    file or the complete new one. If the block raises, the target is untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    with locked(filename, exclusive=True):
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix='.tmp', dir=directory)
+        try:
+            if 'b' in mode:
+                f = os.fdopen(fd, mode)
+            else:
+                f = os.fdopen(fd, mode, encoding=encoding, newline=newline)
+            with f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(filename):
+                shutil.copymode(filename, tmp_path)
+                if backup:
+                    rotate_backups(filename)
+            os.replace(tmp_path, filename)
+            _fsync_directory(directory)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def read_csv_rows(filename, encoding='utf-8'):
+    """Read all rows of a CSV file under a shared lock"""
+    with locked(filename):
+        with open(filename, 'r', encoding=encoding) as f:
+            reader = csv.reader(f)
+            rows = list(reader)
+    count(rows_read=len(rows))
+    return rows
+
+def iter_csv_rows(filename, encoding='utf-8'):
+    """
+    Yield the rows of a CSV file one at a time under a shared lock
+
+    The lock is held until the generator is exhausted or closed, so only one
+    row is ever held in memory.
+    """
+    n = 0
+    with locked(filename):
+        with open(filename, 'r', encoding=encoding) as f:
+            for row in csv.reader(f):
+                n += 1
+                yield row
+    count(rows_read=n)
+
+def line_count(filename, chunk_size=1 << 20):
+    """Number of lines in a file (an upper bound on its CSV rows), counted without decoding it"""
+    lines, last = 0, b'\n'
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    return lines + (last != b'\n')
+
+def write_csv_rows(filename, rows, encoding='utf-8'):
+    """Atomically replace a CSV file with rows under an exclusive lock; rows may be a generator"""
+    n = 0
+    with atomic_open(filename, 'w', encoding=encoding) as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+    count(rows_written=n)
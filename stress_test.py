@@ -0,0 +1,247 @@
+import argparse
+import csv
+import numpy as np
+from storage import atomic_open, read_csv_rows
+from portfolio_table import load_portfolio_table
+from returns_matrix import correlation_matrix
+from optimize_portfolio import read_correlation_data
+from clean_returns import load_returns
+
+# Scenarios replayed when none are given on the command line: A-share
+# episodes (skipped when the data does not reach back that far), then the
+# last month, quarter and year of the data
+DEFAULT_WINDOWS = [
+    ('2015 A-share crash', '2015-06-12', '2015-08-26'),
+    ('2016 circuit breaker', '2016-01-04', '2016-01-28'),
+    ('2018 trade war', '2018-01-29', '2018-12-28'),
+    ('2020-03 COVID sell-off', '2020-03-05', '2020-03-23'),
+    ('2022 spring sell-off', '2022-01-04', '2022-04-26'),
+    ('2024-01 small-cap sell-off', '2024-01-02', '2024-02-05'),
+]
+RECENT_WINDOWS = [('Last 21 trading days', 21), ('Last 63 trading days', 63), ('Last 252 trading days', 252)]
+
+def window_returns(returns, starts, stops):
+    """
+    Compounded return of every asset over many date windows at once
+
+    returns is assets x dates (decimal, NaN for missing days, which count as
+    0%); window k covers columns starts[k]:stops[k]. Uses prefix sums of
+    log(1 + r), so each window costs O(assets) regardless of its length.
+    Returns a windows x assets matrix.
+    """
+    filled = np.where(np.isnan(returns), 0.0, returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.log1p(np.maximum(filled, -0.999999))
+    prefix = np.concatenate([np.zeros((len(returns), 1)), np.cumsum(logs, axis=1)], axis=1)
+    starts, stops = np.asarray(starts), np.asarray(stops)
+    return np.expm1(prefix[:, stops] - prefix[:, starts]).T
+
+def conditional_shock(covariance, shocked, shocks):
+    """
+    Expected returns of every asset given shocks to some of them
+
+    Gaussian conditional mean: the other assets move by
+    Sigma_US Sigma_SS^-1 s. The shocked assets take exactly their shocks.
+    """
+    shocked = np.asarray(shocked, dtype=int)
+    move = covariance[:, shocked] @ np.linalg.pinv(covariance[np.ix_(shocked, shocked)]) @ np.asarray(shocks, dtype=float)
+    move[shocked] = shocks
+    return move
+
+def parse_shocks(spec, names, ids):
+    """
+    'key=percent;key=percent' into (asset rows, decimal shocks)
+
+    A key is an asset id, or otherwise a substring of asset names (e.g. '债'
+    shocks every asset with 债 in its name).
+    """
+    rows, shocks = [], []
+    for part in spec.replace(',', ';').split(';'):
+        if not part.strip():
+            continue
+        key, _, value = part.partition('=')
+        key, shock = key.strip(), float(value.strip().rstrip('%')) / 100
+        matched = [i for i, asset_id in enumerate(ids) if asset_id == key]
+        if not matched:
+            matched = [i for i, name in enumerate(names) if key in name]
+        if not matched:
+            raise ValueError(f"No asset matches '{key}'")
+        for i in matched:
+            if i not in rows:
+                rows.append(i)
+                shocks.append(shock)
+    return rows, shocks
+
+def read_scenario_file(filename):
+    """Scenarios from a CSV file with name,start,end,shocks columns (start/end for replays, shocks otherwise)"""
+    rows = read_csv_rows(filename)
+    header = [col.lstrip('\ufeff') for col in rows[0]] if rows else []
+    scenarios = []
+    for row in rows[1:]:
+        record = dict(zip(header, row))
+        if record.get('start') and record.get('end'):
+            scenarios.append(('historical', record.get('name', ''), (record['start'], record['end'])))
+        elif record.get('shocks'):
+            scenarios.append(('shock', record.get('name', ''), record['shocks']))
+    return scenarios
+
+def build_scenarios(scenarios, data, covariance, rolling=None):
+    """
+    Scenario matrix (scenarios x assets, decimal returns) and labels
+
+    scenarios are ('historical', name, (start, end)), ('recent', name, days)
+    or ('shock', name, spec).
+    Windows outside the data are reported and skipped. rolling=N adds every
+    N-day window in the data. All historical windows are computed in one
+    window_returns() call.
+    """
+    dates = np.array(data['dates'])
+    returns = data['returns'] / 100
+    labels, starts, stops, rows = [], [], [], []
+    shock_rows = []
+
+    for kind, name, spec in scenarios:
+        if kind == 'historical':
+            start, end = spec
+            first, last = np.searchsorted(dates, start), np.searchsorted(dates, end, side='right')
+            if len(dates) == 0 or start < dates[0] or last - first < 1:
+                print(f"Skipped '{name}': no return data between {start} and {end}")
+                continue
+            labels.append((name, 'historical', f"{dates[first]}~{dates[last - 1]}"))
+            starts.append(first)
+            stops.append(last)
+        elif kind == 'recent':
+            days = min(spec, len(dates))
+            if days < 1:
+                continue
+            labels.append((name, 'historical', f"{dates[-days]}~{dates[-1]}"))
+            starts.append(len(dates) - days)
+            stops.append(len(dates))
+        else:
+            shocked, shocks = parse_shocks(spec, data['names'], data['ids'])
+            shock_rows.append((name, spec, conditional_shock(covariance, shocked, shocks)))
+
+    if rolling and len(dates) >= rolling:
+        ends = np.arange(rolling, len(dates) + 1)
+        for stop in ends:
+            labels.append((f"Rolling {rolling}d to {dates[stop - 1]}", 'rolling', f"{dates[stop - rolling]}~{dates[stop - 1]}"))
+        starts.extend(ends - rolling)
+        stops.extend(ends)
+
+    if starts:
+        rows.append(window_returns(returns, starts, stops))
+    for name, spec, move in shock_rows:
+        labels.append((name, 'shock', spec))
+        rows.append(move[None, :])
+    matrix = np.vstack(rows) if rows else np.empty((0, returns.shape[0]))
+    return labels, matrix
+
+def evaluate(matrix, values):
+    """
+    Portfolio loss of every scenario in one matrix multiply
+
+    Returns (portfolio_return, pnl, worst_asset): portfolio return (decimal)
+    and money P&L per scenario, and the asset losing the most in each.
+    """
+    total = values.sum()
+    weights = values / total if total else np.zeros_like(values)
+    pnl = matrix @ values
+    portfolio_return = matrix @ weights
+    worst_asset = np.argmin(matrix * values, axis=1) if matrix.size else np.empty(0, dtype=int)
+    return portfolio_return, pnl, worst_asset
+
+def daily_covariance(data, correlation_file):
+    """Covariance of daily returns from their volatilities and the correlation matrix file (or the returns if it does not match)"""
+    returns = data['returns']
+    volatility = np.nan_to_num(np.nanstd(returns, axis=1, ddof=1)) if returns.shape[1] > 1 else np.zeros(len(returns))
+    corr = None
+    try:
+        names, matrix = read_correlation_data(correlation_file)
+        index = {name: k for k, name in enumerate(names)}
+        if all(name in index for name in data['names']):
+            order = [index[name] for name in data['names']]
+            corr = matrix[np.ix_(order, order)]
+    except (OSError, ValueError):
+        pass
+    if corr is None:
+        print(f"Note: {correlation_file} does not cover the assets in percentage_change.csv, using correlations of the returns")
+        corr = correlation_matrix(returns)
+    return np.outer(volatility, volatility) * corr
+
+def write_stress_report(filename, labels, names, portfolio_return, pnl, worst_asset, matrix):
+    """Scenarios ranked from the largest loss"""
+    order = np.argsort(pnl)
+    with atomic_open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'scenario', 'kind', 'detail', 'portfolio_return', 'pnl', 'worst_asset', 'worst_asset_return'])
+        for rank, k in enumerate(order, 1):
+            name, kind, detail = labels[k]
+            writer.writerow([rank, name, kind, detail, f"{portfolio_return[k] * 100:.2f}%", f"{pnl[k]:.2f}",
+                             names[worst_asset[k]], f"{matrix[k, worst_asset[k]] * 100:.2f}%"])
+
+def stress_test_main(windows=None, shocks=None, scenario_file=None, rolling=None, top=20,
+                     portfolio_file='portfolio.csv', percentage_change_file='percentage_change.csv',
+                     correlation_file='asset_correlationship.csv', report_file='stress_test.csv'):
+    """Replay historical windows and hypothetical shocks against the current holdings"""
+    table = load_portfolio_table(portfolio_file)
+    data = load_returns(percentage_change_file)
+    if table is None or data is None or table.missing('total_value'):
+        print(f"Error: {portfolio_file} with a total_value column and {percentage_change_file} are required")
+        return None
+
+    # Current money in each asset, aligned with the returns rows
+    values = np.zeros(len(data['ids']))
+    for i, asset_id in enumerate(data['ids']):
+        row = table.row_of(asset_id)
+        if row is not None:
+            values[i] = np.nan_to_num(table['total_value'][row])
+
+    scenarios = [('historical', name, (start, end)) for name, start, end in (windows or [])]
+    scenarios += [('shock', spec, spec) for spec in (shocks or [])]
+    if scenario_file:
+        scenarios += read_scenario_file(scenario_file)
+    if not scenarios and not rolling:
+        scenarios = [('historical', name, (start, end)) for name, start, end in DEFAULT_WINDOWS]
+        scenarios += [('recent', name, days) for name, days in RECENT_WINDOWS]
+
+    covariance = daily_covariance(data, correlation_file) if any(kind == 'shock' for kind, _, _ in scenarios) else None
+    try:
+        labels, matrix = build_scenarios(scenarios, data, covariance, rolling)
+    except ValueError as e:
+        # e.g. a --shock key that matches no asset or a shock that is not a number
+        print(f"Error: {e}")
+        return None
+    if not labels:
+        print("No scenarios to evaluate")
+        return None
+
+    portfolio_return, pnl, worst_asset = evaluate(matrix, values)
+    order = np.argsort(pnl)
+    print(f"{len(labels)} scenarios x {len(values)} assets, portfolio value {values.sum():.2f}")
+    print(f"\n{'Scenario':<40} {'Return':>9} {'P&L':>16}  Worst asset")
+    for k in order[:top]:
+        name = labels[k][0]
+        print(f"{name[:40]:<40} {portfolio_return[k] * 100:>8.2f}% {pnl[k]:>16.2f}  "
+              f"{data['names'][worst_asset[k]]} ({matrix[k, worst_asset[k]] * 100:.2f}%)")
+
+    write_stress_report(report_file, labels, data['names'], portfolio_return, pnl, worst_asset, matrix)
+    print(f"\nRanked results written to {report_file}")
+    return labels, portfolio_return, pnl
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical windows and hypothetical shocks against portfolio.csv")
+    parser.add_argument('--window', nargs=2, action='append', metavar=('START', 'END'), default=[],
+                        help="replay the returns between two dates (YYYY-MM-DD), repeatable")
+    parser.add_argument('--shock', action='append', default=[],
+                        help="e.g. '399001=-10;债=+1' (percent); unshocked assets move by their conditional expectation")
+    parser.add_argument('--scenarios', default=None, help="CSV with name,start,end,shocks columns")
+    parser.add_argument('--rolling', type=int, default=None, help="also replay every N-trading-day window")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', default='stress_test.csv')
+    args = parser.parse_args()
+
+    windows = [(f"{start}~{end}", start, end) for start, end in args.window]
+    stress_test_main(windows, args.shock, args.scenarios, args.rolling, args.top, report_file=args.output)
+
+if __name__ == '__main__':
+    main()
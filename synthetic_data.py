@@ -0,0 +1,119 @@
+import argparse
+import csv
+import os
+from datetime import date, timedelta
+import numpy as np
+
+# Market structure used for the synthetic universe
+N_SECTORS = 10
+MARKET_VOLATILITY = 0.012
+SECTOR_VOLATILITY = 0.008
+
+def trading_dates(years, end=date(2025, 8, 15), holiday_rate=0.03, seed=0):
+    """
+    Weekday dates covering roughly `years` years before `end`
+
+    A few multi-day holiday blocks are removed so the calendar has the same
+    kind of gaps as the A-share calendar (Spring Festival, National Day, ...).
+    """
+    rng = np.random.default_rng(seed)
+    start = end - timedelta(days=int(round(365.25 * years)))
+    days = []
+    current = start
+    while current <= end:
+        if current.weekday() < 5:
+            days.append(current)
+        current += timedelta(days=1)
+
+    keep = np.ones(len(days), dtype=bool)
+    n_blocks = int(len(days) * holiday_rate / 4)
+    for start_index in rng.integers(0, max(len(days) - 5, 1), size=n_blocks):
+        keep[start_index:start_index + rng.integers(1, 6)] = False
+    return [d.strftime('%Y-%m-%d') for d, k in zip(days, keep) if k]
+
+def _asset_prices(rng, market, sector_returns, n_dates, gap_rate, listing_rate):
+    """Simulate one asset's price path with listing delay and suspension gaps"""
+    sector = rng.integers(0, N_SECTORS)
+    beta = rng.uniform(0.2, 1.4)
+    drift = rng.normal(0.0003, 0.0004)
+    idio = rng.uniform(0.002, 0.02)
+    returns = drift + beta * market + sector_returns[:, sector] + rng.normal(0.0, idio, n_dates)
+    prices = rng.uniform(0.8, 50.0) * np.exp(np.cumsum(np.log1p(np.clip(returns, -0.5, 0.5))))
+    prices = prices.astype(object)
+
+    # Some assets are listed during the window and have leading blanks
+    if rng.random() < listing_rate:
+        prices[:rng.integers(1, max(n_dates // 2, 2))] = ''
+
+    # Suspensions/missing scrapes: short runs of empty cells
+    n_gaps = rng.poisson(gap_rate * n_dates / 3)
+    for start in rng.integers(0, n_dates, size=n_gaps):
+        prices[start:start + rng.integers(1, 6)] = ''
+    return prices
+
+def generate_watchlist(filename, n_assets, years, seed=0, gap_rate=0.01, listing_rate=0.1, fund_share=0.8):
+    """
+    Write a synthetic watchlist.csv with n_assets rows over `years` years
+
+    Prices follow a one-market/ten-sector factor model so the correlation
+    matrix has realistic structure. Rows are generated and written one at a
+    time, so memory stays small even for 10k assets x 20 years.
+    """
+    rng = np.random.default_rng(seed)
+    dates = trading_dates(years, seed=seed)
+    n_dates = len(dates)
+    market = rng.normal(0.0002, MARKET_VOLATILITY, n_dates)
+    sector_returns = rng.normal(0.0, SECTOR_VOLATILITY, (n_dates, N_SECTORS))
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'id', 'type'] + dates)
+        for i in range(n_assets):
+            asset_type = 'fund' if rng.random() < fund_share else 'stock'
+            prices = _asset_prices(rng, market, sector_returns, n_dates, gap_rate, listing_rate)
+            cells = [p if p == '' else f"{p:.4f}" for p in prices]
+            writer.writerow([f"synthetic_{asset_type}_{i}", f"{i:06d}", asset_type] + cells)
+    return n_dates
+
+def generate_portfolio(watchlist_file, filename, seed=0, held_share=0.3):
+    """Write a portfolio.csv matching watchlist_file, holding a random subset of assets"""
+    rng = np.random.default_rng(seed + 1)
+    header = ['name', 'id', 'type', 'last_price', 'holdings', 'holding_price',
+              'holding_earnings', 'total_value', 'percentage', 'annual_return', 'risk']
+    with open(watchlist_file, 'r', encoding='utf-8') as src, \
+            open(filename, 'w', newline='', encoding='utf-8') as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        next(reader)
+        writer.writerow(header)
+        for row in reader:
+            last = next((p for p in reversed(row[3:]) if p), '')
+            if last and rng.random() < held_share:
+                holdings = str(int(rng.integers(1, 100)) * 100)
+                holding_price = f"{float(last) * rng.uniform(0.7, 1.3):.2f}"
+            else:
+                holdings, holding_price = '0', ''
+            writer.writerow(row[:3] + ['', holdings, holding_price, '', '0', '0%', '0%', '0%'])
+
+def generate_dataset(output_dir, n_assets, years, seed=0, gap_rate=0.01):
+    """Create watchlist.csv and portfolio.csv in output_dir"""
+    watchlist_file = os.path.join(output_dir, 'watchlist.csv')
+    n_dates = generate_watchlist(watchlist_file, n_assets, years, seed=seed, gap_rate=gap_rate)
+    generate_portfolio(watchlist_file, os.path.join(output_dir, 'portfolio.csv'), seed=seed)
+    return n_dates
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic watchlist.csv/portfolio.csv")
+    parser.add_argument('output_dir')
+    parser.add_argument('--assets', type=int, default=100)
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gap-rate', type=float, default=0.01, help="share of missing price cells")
+    args = parser.parse_args()
+
+    n_dates = generate_dataset(args.output_dir, args.assets, args.years, args.seed, args.gap_rate)
+    print(f"Generated {args.assets} assets x {n_dates} dates in {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
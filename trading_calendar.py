@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import numpy as np
+from storage import atomic_open
+from returns_matrix import load_price_matrix
+
+# Calendar and alignment index cached next to the watchlist, rebuilt when it changes
+CALENDAR_FILE = 'trading_calendar.npz'
+
+# A watchlist date is a trading day when at least this share of the reference
+# assets (stocks, or every asset if there are none) has a price on it
+MIN_ACTIVE_SHARE = 0.5
+
+# How returns are computed across dates on which an asset has no price:
+#   none  - a gap gives missing returns on both sides, as calculate_percentage_change always did
+#   ffill - the last price is carried forward (0% on the gap days, the move lands when trading resumes)
+#   span  - gap days stay missing and the first day back gets the whole multi-day return
+ALIGN_MODES = ['none', 'ffill', 'span']
+
+def build_calendar(prices, types=None, min_share=MIN_ACTIVE_SHARE):
+    """
+    Trading-day columns of a watchlist price matrix
+
+    Dates where too few reference assets traded (e.g. a QDII fund priced on
+    a US trading day during an A-share holiday) are left out; their prices are
+    still used by forward-fill and span alignment on the next trading day.
+    Returns the sorted array of column positions.
+    """
+    valid = ~np.isnan(prices)
+    reference = np.ones(len(prices), dtype=bool)
+    if types is not None:
+        stocks = np.array([t == 'stock' for t in types], dtype=bool)
+        if stocks.any():
+            reference = stocks
+    if not reference.any():
+        return np.arange(prices.shape[1])
+    active_share = valid[reference].mean(axis=0)
+    return np.nonzero(active_share >= min_share)[0]
+
+def fill_index(prices, columns, limit=None):
+    """
+    Source column of the latest price at or before each calendar date, per asset
+
+    Returns an int32 assets x len(columns) matrix with -1 where the asset has
+    no price yet, or where its last price is more than limit calendar days old.
+    Prices then align with a single gather: prices[rows, index].
+    """
+    n_assets, n_dates = prices.shape
+    positions = np.where(~np.isnan(prices), np.arange(n_dates), -1)
+    latest = np.maximum.accumulate(positions, axis=1) if n_dates else positions
+    index = latest[:, columns].astype(np.int32)
+
+    if limit is not None and len(columns):
+        # Calendar position of each date, so staleness is counted in trading days
+        calendar_position = np.searchsorted(columns, np.arange(n_dates), side='right') - 1
+        age = np.arange(len(columns)) - np.where(index >= 0, calendar_position[np.maximum(index, 0)], 0)
+        index[age > limit] = -1
+    return index
+
+def gather(prices, index):
+    """Prices at the positions in a fill_index() matrix (NaN for -1)"""
+    padded = np.concatenate([prices, np.full((len(prices), 1), np.nan)], axis=1)
+    return padded[np.arange(len(prices))[:, None], index]
+
+def aligned_returns(prices, columns, index, mode='ffill'):
+    """
+    Daily returns (decimal) between consecutive calendar dates
+
+    prices is the raw watchlist matrix and index its fill_index() for the
+    calendar columns. Returns an assets x (len(columns) - 1) matrix, NaN when
+    a return cannot be computed or the previous price is 0.
+    """
+    if mode not in ALIGN_MODES:
+        raise ValueError(f"Unknown alignment {mode}, choose from {', '.join(ALIGN_MODES)}")
+    if len(columns) < 2:
+        return np.empty((len(prices), 0))
+
+    if mode == 'none':
+        current = prices[:, columns]
+        previous = current[:, :-1]
+        current = current[:, 1:]
+    else:
+        filled = gather(prices, index)
+        previous, current = filled[:, :-1], filled[:, 1:]
+        if mode == 'span':
+            # Only days the asset actually has a fresh price get a return
+            fresh = index[:, 1:] != index[:, :-1]
+            current = np.where(fresh, current, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = current / previous - 1.0
+    returns[previous == 0] = np.nan
+    return returns
+
+def _signature(filename):
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
+
+def load_calendar(watchlist_file, prices, types, min_share=MIN_ACTIVE_SHARE, limit=None, cache_file=None):
+    """
+    (columns, index) for a watchlist, from the cache when it was built from the same file and parameters
+
+    The cache stores the calendar columns and the fill index, so later runs
+    align the prices with one gather instead of rebuilding the date mapping.
+    """
+    cache_file = cache_file or os.path.join(os.path.dirname(watchlist_file), CALENDAR_FILE)
+    params = json.dumps({'source': _signature(watchlist_file), 'min_share': min_share, 'limit': limit})
+    if os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as data:
+            if str(data['params']) == params and data['index'].shape[0] == len(prices):
+                return data['columns'], data['index']
+
+    columns = build_calendar(prices, types, min_share)
+    index = fill_index(prices, columns, limit)
+    with atomic_open(cache_file, 'wb') as f:
+        np.savez(f, columns=columns, index=index, params=np.array(params))
+    return columns, index
+
+def calendar_report(watchlist_file='watchlist.csv', min_share=MIN_ACTIVE_SHARE):
+    """Print the calendar built from a watchlist and how many prices each alignment recovers"""
+    names, ids, types, dates, prices = load_price_matrix(watchlist_file)
+    columns, index = load_calendar(watchlist_file, prices, types, min_share)
+    dropped = len(dates) - len(columns)
+    print(f"{len(dates)} watchlist dates, {len(columns)} trading days, {dropped} non-trading dates folded into the next trading day")
+    for mode in ALIGN_MODES:
+        returns = aligned_returns(prices, columns, index, mode)
+        print(f"  {mode:<6} {int((~np.isnan(returns)).sum())} daily returns")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the trading calendar built from watchlist.csv")
+    parser.add_argument('watchlist', nargs='?', default='watchlist.csv')
+    parser.add_argument('--min-share', type=float, default=MIN_ACTIVE_SHARE)
+    args = parser.parse_args()
+    calendar_report(args.watchlist, args.min_share)
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ import random
 from lxml import etree
 from datetime import datetime, timedelta
 from collections import OrderedDict
+from storage import locked, read_csv_rows, write_csv_rows
+from instrumentation import stage, count
+from price_series import adjusted_file_for, merge_adjusted
 
 # Configuration
 headers = {
@@ -29,9 +32,12 @@ def get_page_data(url, pages):
     for page in range(1, pages+1):
         url2 = url + '&page=' + str(page)  # 拼接url
 
-        for _ in range(10):
+        for attempt in range(10):
+            if attempt:
+                count(retries=1)
             try:
                 resp = requests.get(url=url2, headers=headers)
+                count(http_requests=1, http_bytes=len(resp.content))
                 if resp.status_code == 200:  # 若网页正常响应
                     html = etree.HTML(resp.content.decode('utf-8'))  # 解析网页
                     rep_list = html.xpath("//tbody")  # 数据存在tbody下
@@ -71,9 +77,12 @@ def get_result_data(code, start_date, end_date):
     url_prefix = 'https://fundf10.eastmoney.com/F10DataApi.aspx?type=lsjz&code='
     url1 = url_prefix + code + f'&sdate={start_date}&edate={end_date}&per=45'  # 拼接第一页的url，&per=45是每页显示的条数
     
-    for _ in range(10): 
+    for attempt in range(10): 
+        if attempt:
+            count(retries=1)
         try:
             resp = requests.get(url=url1, headers=headers)
+            count(http_requests=1, http_bytes=len(resp.content))
             if resp.status_code == 200:  # 若网页正常响应
                 html = etree.HTML(resp.content.decode('utf-8'))  # 解析网页
                 rep_text = str(html.xpath("//body/text()")[0])
@@ -95,20 +104,22 @@ def get_result_data(code, start_date, end_date):
     return all_data
 
 def get_fund_data(code, start_date, end_date):
-    """Fetch fund historical data from East Money"""
+    """Fetch fund historical data from East Money: (unit NAV, cumulative NAV) by date"""
     try:
         data_list = get_result_data(code, start_date, end_date)
         data = {}
+        adjusted = {}
         for row in data_list:
             if len(row) >= 3:
                 date = row[0].strip()
                 price = row[1].strip()  # Net value
                 # row[1]是单位净值 row[2]是累计净值
                 data[date] = price
-        return data
+                adjusted[date] = row[2].strip()
+        return data, adjusted
     except Exception as e:
         print(f"Error fetching fund data for {code}: {e}")
-    return {}
+    return {}, {}
 
 def get_stock_data(code, start_date, end_date):
     """Fetch stock historical data using efinance library"""
@@ -119,8 +130,9 @@ def get_stock_data(code, start_date, end_date):
         beg_date = start_date.replace('-', '')
         end_date = end_date.replace('-', '')
         
-        # Get stock quote history
-        data = ef.stock.get_quote_history(code, beg=beg_date, end=end_date)
+        # Get stock quote history; fqt=1 (efinance's default) gives forward-adjusted (前复权) closes
+        data = ef.stock.get_quote_history(code, beg=beg_date, end=end_date, fqt=1)
+        count(http_requests=1)
         
         # Convert to dictionary with date as key and closing price as value
         price_data = {}
@@ -142,23 +154,28 @@ def read_watchlist(filename):
     
     for encoding in encodings:
         try:
-            with open(filename, 'r', encoding=encoding) as f:
-                reader = csv.reader(f)
-                rows = list(reader)
+            rows = read_csv_rows(filename, encoding=encoding)
             print(f"Successfully read file with {encoding} encoding")
             return rows
         except UnicodeDecodeError:
             continue
     
     # If all encodings fail, try with error handling
-    with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
+    with locked(filename):
+        with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
+            reader = csv.reader(f)
+            rows = list(reader)
     print("Read file with utf-8 encoding and error ignoring")
     return rows
 
-def update_watchlist(rows, new_data):
-    """Update watchlist with new price data"""
+def update_watchlist(rows, new_data, keep_existing_dates=False):
+    """
+    Update watchlist with new price data
+
+    By default only dates present in new_data are kept, which is what a full
+    re-fetch wants. Incremental fetches pass keep_existing_dates=True so that
+    history outside the fetched window is preserved.
+    """
     if not rows:
         return rows
         
@@ -181,7 +198,7 @@ def update_watchlist(rows, new_data):
             if date in item_data and item_data[date]:
                 has_data = True
                 break
-        if has_data and date not in all_dates:
+        if (has_data or keep_existing_dates) and date not in all_dates:
             all_dates[date] = None
     
     # Sort dates chronologically
@@ -211,46 +228,77 @@ def update_watchlist(rows, new_data):
 
 def write_watchlist(filename, rows):
     """Write updated watchlist to CSV"""
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
+    write_csv_rows(filename, rows)
 
-def update_prices():
-    start_date, end_date = parse_args()
-    
-    # Read existing watchlist
-    rows = read_watchlist('watchlist.csv')
-    if not rows or len(rows) < 2:
-        print("No items in watchlist or invalid format")
-        return
-    
-    # Get all items (skip header)
-    items = rows[1:]
+def fetch_new_data(items, start_date, end_date):
+    """
+    Fetch prices between start_date and end_date for watchlist rows
+
+    Returns (new_data, adjusted_data), both keyed by id: the unit prices for
+    watchlist.csv and the adjusted series for the adjusted price store (see
+    price_series.py). Stock closes are already forward-adjusted, so they are
+    used for both.
+    """
     new_data = {}
+    adjusted_data = {}
     
     # Fetch data for each item
     for item in items:
         name, id, type = item[:3]
         print(f"Fetching data for {name} ({id})...")
         
-        if type == 'fund':
-            data = get_fund_data(id, start_date, end_date)
-        elif type == 'stock':
-            data = get_stock_data(id, start_date, end_date)
-        else:
-            print(f"Unknown type {type} for {name}")
-            continue
+        with stage('fetch_asset_prices', asset_id=id, type=type) as metrics:
+            if type == 'fund':
+                data, adjusted = get_fund_data(id, start_date, end_date)
+            elif type == 'stock':
+                data = get_stock_data(id, start_date, end_date)
+                adjusted = data
+            else:
+                print(f"Unknown type {type} for {name}")
+                continue
+            metrics.add(rows=len(data))
             
         if data:
             new_data[id] = data
+            adjusted_data[id] = adjusted
             # Add random delay to avoid being blocked
             time.sleep(random.uniform(0.5, 1.5))
     
-    # Update watchlist with new data
-    updated_rows = update_watchlist(rows, new_data)
+    return new_data, adjusted_data
+
+def merge_into_watchlist(filename, new_data, keep_existing_dates=False, adjusted_data=None):
+    """Merge fetched prices into the watchlist file, and adjusted prices into its adjusted price store"""
+    # Fetching takes minutes, so re-read the watchlist under the exclusive lock
+    # and merge into the current file rather than the copy read at start-up
+    with locked(filename, exclusive=True):
+        rows = read_watchlist(filename)
+        
+        # Update watchlist with new data
+        updated_rows = update_watchlist(rows, new_data, keep_existing_dates)
+        
+        # Write updated watchlist
+        write_watchlist(filename, updated_rows)
+        
+        if adjusted_data:
+            merge_adjusted(adjusted_file_for(filename), adjusted_data)
+
+def update_prices():
+    start_date, end_date = parse_args()
     
-    # Write updated watchlist
-    write_watchlist('watchlist.csv', updated_rows)
+    with stage('update_prices', start_date=start_date, end_date=end_date):
+        # Read existing watchlist
+        with stage('read_watchlist'):
+            rows = read_watchlist('watchlist.csv')
+        if not rows or len(rows) < 2:
+            print("No items in watchlist or invalid format")
+            return
+        
+        # Get all items (skip header) and fetch their prices
+        with stage('fetch_new_data', assets=len(rows) - 1):
+            new_data, adjusted_data = fetch_new_data(rows[1:], start_date, end_date)
+        
+        with stage('merge_into_watchlist', assets_updated=len(new_data)):
+            merge_into_watchlist('watchlist.csv', new_data, adjusted_data=adjusted_data)
     print("Watchlist updated successfully")
 
 if __name__ == '__main__':
@@ -0,0 +1,326 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+import numpy as np
+from storage import atomic_open, locked, read_csv_rows, write_csv_rows
+
+# Value history lives in one directory per year; every column is a raw binary
+# file that snapshots are appended to, so a year of history is read back with
+# np.memmap instead of parsing text
+HISTORY_DIR = 'value_history'
+
+# Asset registry shared by all partitions: row k of assets.csv is asset index k
+ASSETS_FILE = 'assets.csv'
+
+# One record per portfolio snapshot, and one per held asset in each snapshot.
+# Times are local wall-clock seconds since 1970-01-01, so their date is the local date.
+TABLES = {
+    'snapshot': {'time': np.int64, 'total': np.float64},
+    'position': {'time': np.int64, 'asset': np.int32, 'price': np.float64,
+                 'holdings': np.float64, 'value': np.float64, 'earnings': np.float64},
+}
+
+SECONDS_PER_DAY = 86400
+
+def _local_seconds(when):
+    """Local wall-clock time as seconds since 1970-01-01"""
+    return int((when - datetime(1970, 1, 1)).total_seconds())
+
+def _column_path(directory, year, table, column):
+    return os.path.join(directory, str(year), f'{table}_{column}.bin')
+
+def _lock_name(directory):
+    return os.path.join(directory, 'history')
+
+def _asset_indices(directory, ids, names, types):
+    """Indices of ids in the asset registry, appending unknown ids to it"""
+    path = os.path.join(directory, ASSETS_FILE)
+    rows = read_csv_rows(path) if os.path.exists(path) else [['id', 'name', 'type']]
+    index = {row[0]: k for k, row in enumerate(rows[1:])}
+    added = False
+    for asset_id, name, asset_type in zip(ids, names, types):
+        if asset_id not in index:
+            index[asset_id] = len(rows) - 1
+            rows.append([asset_id, name, asset_type])
+            added = True
+    if added:
+        write_csv_rows(path, rows)
+    return np.array([index[asset_id] for asset_id in ids], dtype=np.int32)
+
+def read_assets(directory=HISTORY_DIR):
+    """(ids, names, types) of the asset registry, in asset index order"""
+    path = os.path.join(directory, ASSETS_FILE)
+    rows = read_csv_rows(path)[1:] if os.path.exists(path) else []
+    return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+
+def _trim(directory, year, table):
+    """Cut the column files of a table partition back to their shortest whole-record length"""
+    paths = {column: _column_path(directory, year, table, column) for column in TABLES[table]}
+    records = min((os.path.getsize(path) if os.path.exists(path) else 0) // np.dtype(TABLES[table][column]).itemsize
+                  for column, path in paths.items())
+    for column, path in paths.items():
+        size = records * np.dtype(TABLES[table][column]).itemsize
+        if os.path.exists(path) and os.path.getsize(path) != size:
+            os.truncate(path, size)
+
+def _append(directory, year, table, columns):
+    """
+    Append equal-length arrays to the column files of one table partition
+
+    Leftovers of an interrupted append are trimmed first, so the columns
+    stay aligned record by record. Call with the history lock held.
+    """
+    os.makedirs(os.path.join(directory, str(year)), exist_ok=True)
+    _trim(directory, year, table)
+    for column, dtype in TABLES[table].items():
+        with open(_column_path(directory, year, table, column), 'ab') as f:
+            f.write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+def record_snapshot(table, when=None, directory=HISTORY_DIR):
+    """
+    Append today's per-asset and total values of a PortfolioTable to the history
+
+    Only held assets are stored. Several snapshots on one day are all kept;
+    readers use the last one of each day.
+    """
+    missing = table.missing('last_price', 'holdings', 'total_value')
+    if missing:
+        print(f"Error: Required columns {', '.join(missing)} not found in portfolio.csv")
+        return None
+    when = when or datetime.now()
+    seconds = _local_seconds(when)
+    holdings = np.nan_to_num(table['holdings'])
+    held = np.nonzero(holdings != 0)[0]
+    values = np.nan_to_num(table['total_value'])
+    earnings = np.nan_to_num(table['holding_earnings']) if 'holding_earnings' in table else np.zeros(len(table))
+
+    os.makedirs(directory, exist_ok=True)
+    with locked(_lock_name(directory), exclusive=True):
+        assets = _asset_indices(directory, [table.ids[i] for i in held],
+                                [table.names[i] for i in held], [table.types[i] for i in held])
+        _append(directory, when.year, 'position', {
+            'time': np.full(len(held), seconds),
+            'asset': assets,
+            'price': np.nan_to_num(table['last_price'])[held],
+            'holdings': holdings[held],
+            'value': values[held],
+            'earnings': earnings[held],
+        })
+        # The snapshot row goes last, so a snapshot is only visible once its positions are complete
+        total = float(values.sum())
+        _append(directory, when.year, 'snapshot', {'time': [seconds], 'total': [total]})
+    return total
+
+def _read_table(directory, table, start=None, end=None):
+    """
+    Memory-mapped columns of a table between start and end (datetimes, inclusive)
+
+    Column files are cut to their shortest length, so a snapshot interrupted
+    half-way through its append is ignored.
+    """
+    if not os.path.isdir(directory):
+        return {column: np.empty(0, dtype=dtype) for column, dtype in TABLES[table].items()}
+    years = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+    years = [y for y in years if (start is None or y >= start.year) and (end is None or y <= end.year)]
+    low = _local_seconds(start) if start else None
+    high = _local_seconds(end) if end else None
+
+    parts = {column: [] for column in TABLES[table]}
+    for year in years:
+        mapped = {}
+        for column, dtype in TABLES[table].items():
+            path = _column_path(directory, year, table, column)
+            # Only whole records: a partial write is not a multiple of the item size
+            records = (os.path.getsize(path) if os.path.exists(path) else 0) // np.dtype(dtype).itemsize
+            mapped[column] = (np.memmap(path, dtype=dtype, mode='r', shape=(records,)) if records
+                              else np.empty(0, dtype=dtype))
+        length = min(len(array) for array in mapped.values())
+        times = mapped['time'][:length]
+        # Records are appended in time order, so a range is two binary searches
+        first = np.searchsorted(times, low, side='left') if low is not None else 0
+        last = np.searchsorted(times, high, side='right') if high is not None else length
+        for column, array in mapped.items():
+            parts[column].append(array[first:last])
+    return {column: np.concatenate(arrays) if arrays else np.empty(0, dtype=TABLES[table][column])
+            for column, arrays in parts.items()}
+
+def load_history(start=None, end=None, directory=HISTORY_DIR):
+    """
+    Daily value history between start and end (datetimes, inclusive)
+
+    Returns a dict with dates (datetime64[D]), total (one per day, from the
+    day's last snapshot) and, when positions were recorded, ids, names and
+    days x assets matrices value, holdings, price and earnings (0 where an
+    asset was not held).
+    """
+    if not os.path.isdir(directory):
+        empty = np.empty((0, 0))
+        return {'dates': np.empty(0, dtype='datetime64[D]'), 'total': np.empty(0), 'ids': [], 'names': [],
+                'value': empty, 'holdings': empty, 'price': empty, 'earnings': empty}
+    with locked(_lock_name(directory)):
+        snapshots = _read_table(directory, 'snapshot', start, end)
+        positions = _read_table(directory, 'position', start, end)
+        ids, names, _ = read_assets(directory)
+
+    times = np.asarray(snapshots['time'])
+    days = times // SECONDS_PER_DAY
+    last_of_day = np.r_[days[1:] != days[:-1], True] if len(days) else np.empty(0, dtype=bool)
+    day_times = times[last_of_day]
+    history = {
+        'dates': (day_times // SECONDS_PER_DAY).astype('datetime64[D]'),
+        'total': np.asarray(snapshots['total'])[last_of_day],
+        'ids': ids,
+        'names': names,
+    }
+
+    # Positions of each day's last snapshot, scattered into days x assets matrices
+    keep = np.isin(positions['time'], day_times)
+    row = np.searchsorted(day_times, positions['time'][keep])
+    asset = np.asarray(positions['asset'])[keep]
+    for column in ('value', 'holdings', 'price', 'earnings'):
+        matrix = np.zeros((len(day_times), len(ids)))
+        matrix[row, asset] = np.asarray(positions[column])[keep]
+        history[column] = matrix
+    return history
+
+def import_total_value_log(log_file, directory=HISTORY_DIR):
+    """
+    Add the 'timestamp, total' lines of the old total_value.log as snapshots without positions
+
+    The snapshot partitions of the affected years are merged and rewritten in
+    time order; times already in the history are skipped.
+    """
+    entries = {}
+    with open(log_file, encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) == 2:
+                try:
+                    entries[_local_seconds(datetime.strptime(parts[0].strip(), '%Y-%m-%d %H:%M:%S'))] = float(parts[1])
+                except ValueError:
+                    continue
+
+    os.makedirs(directory, exist_ok=True)
+    imported = 0
+    with locked(_lock_name(directory), exclusive=True):
+        for year in sorted({(datetime(1970, 1, 1) + timedelta(seconds=t)).year for t in entries}):
+            start, end = datetime(year, 1, 1), datetime(year, 12, 31, 23, 59, 59)
+            existing = _read_table(directory, 'snapshot', start, end)
+            current = dict(zip(np.asarray(existing['time']).tolist(), np.asarray(existing['total']).tolist()))
+            new = {t: v for t, v in entries.items()
+                   if _local_seconds(start) <= t <= _local_seconds(end) and t not in current}
+            if not new:
+                continue
+            merged = sorted({**current, **new}.items())
+            for column, values in (('time', [t for t, _ in merged]), ('total', [v for _, v in merged])):
+                path = _column_path(directory, year, 'snapshot', column)
+                with atomic_open(path, 'wb', backup=False) as f:
+                    f.write(np.asarray(values, dtype=TABLES['snapshot'][column]).tobytes())
+            imported += len(new)
+    return imported
+
+def drawdowns(total):
+    """Drawdown from the running peak for each day (decimal, <= 0) and the maximum drawdown"""
+    total = np.asarray(total, dtype=float)
+    if not len(total):
+        return np.empty(0), 0.0
+    peak = np.maximum.accumulate(total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(peak > 0, total / peak - 1.0, 0.0)
+    return drawdown, float(drawdown.min())
+
+def implied_flows(holdings, prices):
+    """
+    Money added (+) or withdrawn (-) each day, implied by holding changes valued at that day's price
+
+    The first day has no flow. An asset sold out has no price on that day, so
+    its last recorded price is used.
+    """
+    if len(holdings) < 2:
+        return np.zeros(len(holdings))
+    known = np.where(prices > 0, np.arange(len(prices))[:, None], 0)
+    filled = prices[np.maximum.accumulate(known, axis=0), np.arange(prices.shape[1])]
+    return np.r_[0.0, (np.diff(holdings, axis=0) * filled[1:]).sum(axis=1)]
+
+def time_weighted_return(total, flows):
+    """Chain-linked return (decimal) with flows assumed to happen at the end of each day"""
+    total = np.asarray(total, dtype=float)
+    if len(total) < 2:
+        return 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily = (total[1:] - flows[1:]) / total[:-1] - 1.0
+    daily = daily[np.isfinite(daily)]
+    return float(np.prod(1.0 + daily) - 1.0)
+
+def xirr(amounts, dates, low=-0.9999, high=100.0, iterations=200):
+    """
+    Annual rate at which the dated amounts (negative = invested) have zero net present value
+
+    Solved by bisection on the NPV, which is monotonic in the rate when the
+    investments come before the proceeds. Returns NaN when the NPV has no root
+    in [low, high].
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    years = (np.asarray(dates, dtype='datetime64[D]') - np.asarray(dates, dtype='datetime64[D]').min()).astype(float) / 365.0
+
+    def npv(rate):
+        return (amounts / (1.0 + rate) ** years).sum()
+
+    f_low, f_high = npv(low), npv(high)
+    if not np.isfinite(f_low) or np.sign(f_low) == np.sign(f_high):
+        return float('nan')
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        f_mid = npv(mid)
+        if np.sign(f_mid) == np.sign(f_low):
+            low, f_low = mid, f_mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+def money_weighted_return(dates, total, flows):
+    """XIRR of starting value and flows invested against the final value"""
+    if len(total) < 2:
+        return float('nan')
+    amounts = -np.asarray(flows, dtype=float).copy()
+    amounts[0] -= total[0]
+    amounts[-1] += total[-1]
+    return xirr(amounts, dates)
+
+def summarize(start=None, end=None, directory=HISTORY_DIR):
+    """Print value, drawdown and return figures for a date range"""
+    history = load_history(start, end, directory)
+    dates, total = history['dates'], history['total']
+    if not len(dates):
+        print(f"No value history in {directory}")
+        return
+    _, max_drawdown = drawdowns(total)
+    has_positions = history['holdings'].any(axis=1)
+    print(f"{dates[0]} ~ {dates[-1]}: {len(dates)} days")
+    print(f"Total value: {total[0]:.2f} -> {total[-1]:.2f}")
+    print(f"Max drawdown: {max_drawdown * 100:.2f}%")
+    if has_positions.sum() >= 2:
+        # Flows can only be inferred between days that recorded positions
+        rows = np.nonzero(has_positions)[0]
+        flows = implied_flows(history['holdings'][rows], history['price'][rows])
+        print(f"Time-weighted return: {time_weighted_return(total[rows], flows) * 100:.2f}%")
+        print(f"Money-weighted return (annual): {money_weighted_return(dates[rows], total[rows], flows) * 100:.2f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the portfolio value history")
+    parser.add_argument('--start', default=None, help="YYYY-MM-DD")
+    parser.add_argument('--end', default=None, help="YYYY-MM-DD")
+    parser.add_argument('--import-log', default=None, help="import an old total_value_log/total_value.log")
+    args = parser.parse_args()
+
+    if args.import_log:
+        print(f"Imported {import_total_value_log(args.import_log)} snapshots from {args.import_log}")
+        return
+    start = datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    end = datetime.strptime(args.end + ' 23:59:59', '%Y-%m-%d %H:%M:%S') if args.end else None
+    summarize(start, end)
+
+if __name__ == '__main__':
+    main()